@@ -0,0 +1,136 @@
+"""This Python file measures the cold start import time of the Smart Tile Maker entry points.
+
+Each entry point is started in a fresh interpreter with "python -X importtime" and the
+cumulative time of every top level import is added up. The run is repeated and the
+median is reported, so one slow disk read does not skew the result.
+
+Entry points:
+- library: "import main", what any tool using SDImageGenerator pays.
+- cli: What "main.py batch" imports before the first request is sent.
+- gui: What the GUI imports before the window is created.
+
+Usage: python benchmarks/import_time.py [--repeat 5] [--top 5] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Folder holding main.py
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code run for each entry point, mirroring what the entry point imports
+ENTRY_POINTS = {
+    "library": "import main",
+    "cli": ("import main, argparse\n"
+            "main.config.load()\n"
+            "main.get_sd_client()\n"
+            "main.openai.Completion"),
+    "gui": ("import main\n"
+            "from PyQt5 import QtWidgets, QtCore, QtGui\n"
+            "main.config.load()\n"
+            "main.get_sd_client()\n"
+            "main.openai.Completion"),
+}
+
+# Packages that the library entry point should not load, reported for every entry point
+HEAVY_PACKAGES = ("PyQt5", "openai", "aiohttp", "requests", "PIL", "numpy")
+
+
+def parse_importtime(stderr):
+    """Parses the output of "python -X importtime".
+
+    Args:
+    - stderr (str): The standard error of the interpreter.
+
+    Returns:
+    - tuple: (imports, modules) where imports is the cumulative time in microseconds of each
+      top level import and modules is the set of every module imported.
+    """
+    imports = {}
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # Nested imports are indented and already counted in their parent
+        if name.startswith("  "):
+            continue
+        imports[name.strip()] = imports.get(name.strip(), 0) + int(cumulative)
+    return imports, modules
+
+
+def measure(code, home):
+    """Runs code in a fresh interpreter and returns its import times.
+
+    Args:
+    - code (str): The code to run.
+    - home (str): The home folder to use, so the real output folder is not touched.
+
+    Returns:
+    - tuple: (imports, modules) as returned by parse_importtime().
+    """
+    env = dict(os.environ, HOME=home, USERPROFILE=home, OPENAI_API_KEY="benchmark")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return parse_importtime(result.stderr)
+
+
+def summarize(runs, top):
+    """Summarizes the import times of several runs of one entry point.
+
+    Args:
+    - runs (list): The (imports, modules) of each run.
+    - top (int): The number of slowest imports to list.
+
+    Returns:
+    - dict: The median and minimum total in milliseconds, the heavy packages loaded and the slowest imports.
+    """
+    totals = [sum(imports.values()) for imports, _ in runs]
+    # Use the run with the median total for the breakdown
+    imports, modules = runs[totals.index(sorted(totals)[len(totals) // 2])]
+    return {
+        "median_ms": statistics.median(totals) / 1000,
+        "min_ms": min(totals) / 1000,
+        "heavy": [name for name in HEAVY_PACKAGES
+                  if any(module == name or module.startswith(name + ".") for module in modules)],
+        "slowest": sorted(imports.items(), key=lambda item: -item[1])[:top],
+    }
+
+
+def main(argv=None):
+    """Measures every entry point and prints the results.
+
+    Args:
+    - argv (list): The command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per entry point (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to list (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        for entry_point, code in ENTRY_POINTS.items():
+            results[entry_point] = summarize([measure(code, home) for _ in range(max(1, args.repeat))], args.top)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for entry_point, result in results.items():
+        print(f"{entry_point}: {result['median_ms']:.1f} ms median, {result['min_ms']:.1f} ms min, "
+              f"heavy packages: {', '.join(result['heavy']) or 'none'}")
+        for name, cumulative in result["slowest"]:
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,196 +10,4938 @@ Author: Matthew C
 Date: 15/16/2023
 """
 
-# Import necessary packages
-from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QFormLayout,
-                             QLineEdit, QPushButton, QGroupBox, QFileDialog,
-                             QMainWindow, QMessageBox, QVBoxLayout)
-from PyQt5.QtCore import QUrl, QDir
-from requests.exceptions import RequestException
-from PyQt5.QtGui import QDesktopServices
-from PIL import Image, PngImagePlugin
-import openai
+# Import necessary packages. Heavy packages are loaded on first use and
+# PyQt5 is only imported when the GUI starts
+import importlib
 import os
-import requests
-import io
 import base64
 import sys
+import threading
+import json
+import struct
+import zlib
+import re
+import time
+import collections
+import hashlib
+import tempfile
+import contextlib
+import concurrent.futures
+import multiprocessing
+import atexit
+import io
+
+
+class LazyModule:
+    """Stand-in for a module that imports the real module on first use.
+
+    Attributes and assignments are forwarded to the real module, so "openai.api_key = key"
+    works the same as with a normal import.
+
+    Attributes:
+    - _module_name (str): The name of the module to import.
+    """
+
+    def __init__(self, module_name):
+        """Initializes the LazyModule object.
+
+        Args:
+        - module_name (str): The name of the module to import.
+        """
+        object.__setattr__(self, "_module_name", module_name)
+
+    def __getattr__(self, attr):
+        # importlib caches the module, so the import only runs once
+        return getattr(importlib.import_module(self._module_name), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(importlib.import_module(self._module_name), attr, value)
+
+
+openai = LazyModule("openai")
+requests = LazyModule("requests")
+aiohttp = LazyModule("aiohttp")
+asyncio = LazyModule("asyncio")
+np = LazyModule("numpy")
+Image = LazyModule("PIL.Image")
+
+# URL for Stable Diffusion (SD) model API
+SD_URL = "http://127.0.0.1:7860"
+
+# Number of keep-alive connections kept open to each SD backend
+SD_POOL_SIZE = 8
+
+# (connect, read) timeouts in seconds for each SD endpoint
+SD_TIMEOUTS = {
+    "/": (3.05, 5),
+    "/sdapi/v1/options": (3.05, 120),
+    "/sdapi/v1/txt2img": (3.05, 600),
+    "/sdapi/v1/interrupt": (3.05, 5),
+    "/sdapi/v1/progress": (3.05, 5),
+}
+
+# Timeout used for any SD endpoint not listed in SD_TIMEOUTS
+SD_DEFAULT_TIMEOUT = (3.05, 60)
+
+# Seconds an SD client being closed waits for the interrupts it is still sending
+SD_INTERRUPT_FLUSH_TIMEOUT = 3
+
+# Seconds between polls of an SD backend's progress while it generates an image
+SD_PROGRESS_INTERVAL = 0.5
+
+# Number of times a failed connect to an SD backend is retried
+SD_CONNECT_RETRIES = 2
+
+# Number of threads the async engine uses for blocking work such as saving files
+ENGINE_THREADS = 4
+
+# Number of worker processes the async engine uses for CPU heavy image work, None for one per core
+ENGINE_PROCESSES = None
+
+# SD checkpoint trained on textures
+SD_CHECKPOINT = "TextureDiffusion_10.ckpt [ded387e0f3]"
+
+# Named txt2img settings. Drafts keep the final size because SD's starting noise depends on
+# the size, so only then does a draft's seed give the same texture at full quality
+SD_PROFILES = {
+    "draft": {"steps": 8, "cfg_scale": 7, "width": 512, "height": 512},
+    "final": {"steps": 20, "cfg_scale": 7, "width": 512, "height": 512},
+    "hires": {"steps": 20, "cfg_scale": 7, "width": 512, "height": 512, "enable_hr": True,
+              "hr_scale": 2, "hr_upscaler": "Latent", "hr_second_pass_steps": 10, "denoising_strength": 0.5},
+}
+
+# Profile used unless another is chosen
+SD_PROFILE = "final"
+
+# Added to the file name of textures rendered with the draft profile
+DRAFT_SUFFIX = "_draft"
+
+# Lowest tile score a texture needs when tile scoring is turned on, see tile_scores()
+TILE_MIN_SCORE = 0.5
+
+# Number of times a texture that does not tile is generated again with a new seed
+TILE_RETRIES = 2
+
+# Added to a fixed seed on each retry, far enough that it never meets another texture's seeds
+TILE_RETRY_SEED_STEP = 1000003
+
+# Smallest jump in 8 bit levels a seam is compared with, so flat images are not rejected for rounding
+TILE_NOISE_FLOOR = 2.0
+
+# PNG text keyword the tile score is stored under, next to "parameters"
+TILE_SCORE_KEY = "tileability"
+
+# PBR maps derived from each texture, saved as <texture>_<map>.png
+PBR_MAPS = ("height", "normal", "roughness", "ao")
+
+# How steep the normal map makes the slopes of the height map
+PBR_NORMAL_STRENGTH = 8.0
+
+# How dark the ambient occlusion map makes the dips of the height map
+PBR_AO_STRENGTH = 4.0
+
+# Filters mip levels can be made with, see mip_chain()
+MIP_FILTERS = ("box", "kaiser")
+
+# Filter used for mip levels unless another is chosen
+MIP_FILTER = "kaiser"
+
+# Half width in destination pixels and shape of the Kaiser window around the sinc filter
+MIP_KAISER_RADIUS = 3
+MIP_KAISER_ALPHA = 4.0
+
+# Ways the mip levels can be saved: one PNG per level, or one uncompressed DDS holding them all
+MIP_LAYOUTS = ("files", "dds")
+
+# GPU block compression formats: the DXGI format for DDS and the Vulkan format for KTX2 as
+# (linear, sRGB), the bytes per 4x4 block, and the KTX2 colour model with its
+# (bit offset, bit length - 1, channel) samples
+BLOCK_FORMATS = {
+    "bc1": {"dxgi": (71, 72), "vk": (131, 132), "block": 8, "model": 128, "samples": ((0, 63, 0),)},
+    "bc3": {"dxgi": (77, 78), "vk": (137, 138), "block": 16, "model": 130, "samples": ((0, 63, 15), (64, 63, 0))},
+    "bc4": {"dxgi": (80, 80), "vk": (139, 139), "block": 8, "model": 131, "samples": ((0, 63, 0),)},
+    "bc5": {"dxgi": (83, 83), "vk": (141, 141), "block": 16, "model": 132, "samples": ((0, 63, 0), (64, 63, 1))},
+    "bc7": {"dxgi": (98, 99), "vk": (145, 146), "block": 16, "model": 134, "samples": ((0, 127, 0),)},
+}
+
+# Formats a colour texture can be exported in, the PBR maps always use PBR_MAP_FORMATS
+COLOR_FORMATS = ("bc1", "bc3", "bc7")
+
+# Format each PBR map is exported in, normals keep X and Y and the grey maps one channel
+PBR_MAP_FORMATS = {"height": "bc4", "normal": "bc5", "roughness": "bc4", "ao": "bc4"}
+
+# Files block compressed textures can be exported in
+CONTAINERS = ("dds", "ktx2")
+
+# Pixels of each tile's own wrapped edges framing it in an atlas, so filtering never bleeds in a neighbour
+ATLAS_GUTTER = 8
+
+# Name of the atlas files saved in each theme folder, e.g. atlas.png, atlas.json and atlas_normal.png
+ATLAS_NAME = "atlas"
+
+# Name of the texture array files saved in each theme folder, e.g. array_bc7.dds, and of their
+# manifest array.json when no atlas is saved
+ARRAY_NAME = "array"
+
+# Side of the grey thumbnail a perceptual hash is taken from, of which the 8 x 8 lowest DCT frequencies make the 64 bits
+PHASH_SIZE = 32
+
+# Bits, out of 64, two perceptual hashes may differ by for their textures to count as duplicates
+DEDUP_MAX_DISTANCE = 10
+
+# Number of textures generated for each theme
+TEXTURE_COUNT = 5
+
+# Number of themes named by GPT at the same time
+GPT_WORKERS = 1
+
+# Number of images requested from each SD backend at the same time
+SD_WORKERS = 1
+
+# Seconds before an SD backend that stopped answering is probed again, doubled after each failed probe
+SD_PROBE_DELAY = 2
+
+# Longest wait in seconds between probes of an SD backend that stopped answering
+SD_PROBE_MAX_DELAY = 60
+
+# Number of named textures that may wait for SD before GPT is paused
+SD_QUEUE_SIZE = TEXTURE_COUNT
+
+# Largest size in bytes of the generated texture cache before the least recently used are removed
+TEXTURE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# GPT model used to name textures
+GPT_ENGINE = "text-davinci-003"
+
+# Seconds a GPT request may take
+GPT_TIMEOUT = 30
+
+# Seconds a theme's texture names are reused before GPT is asked again
+NAME_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Largest number of themes kept in the texture name cache
+NAME_CACHE_MAX_ENTRIES = 1000
+
+# Extra times GPT is asked for one name when its reply is not a usable new name
+NAME_RETRIES = 3
+
+# Seconds a passed preflight check is trusted before it is run again
+PREFLIGHT_TTL = 60
+
+# Seconds each preflight check may take
+PREFLIGHT_TIMEOUT = 3
+
+
+class Config:
+    """Class that holds the settings of the tool.
+
+    Creating a Config has no side effects, the folder is created and the key is
+    resolved when load() is called by an entry point.
+
+    Attributes:
+    - folder_path (str): The folder for storing generated images.
+    - sd_urls (list): The URLs of the SD backends.
+    - key (str): "OS_KEY" if the OpenAI key comes from the environment, "USER_KEY" if the user must enter it.
+    - texture_cache (bool): Whether generated textures are cached and reused.
+    - texture_cache_max_bytes (int): The largest size of the texture cache.
+    - name_cache (bool): Whether texture names are reused for themes GPT has already named.
+    - name_cache_path (str): The SQLite file of the texture name cache.
+    - dedup (bool): Whether textures that look like one already saved in the folder are generated again.
+    - dedup_max_distance (int): The Hamming distance up to which perceptual hashes count as duplicates.
+
+    Methods:
+    - load(): Creates the output folder, resolves the OpenAI key and reads SD_URLS from the environment.
+    - texture_cache_path(): Returns the folder of the texture cache.
+    - hash_index_path(): Returns the SQLite file of the perceptual hash index.
+    """
+
+    def __init__(self, folder_path=None, sd_urls=None):
+        """Initializes the Config object.
+
+        Args:
+        - folder_path (str): Optional folder for storing generated images. Defaults to ~/Smart-Tile-Maker.
+        - sd_urls (list): Optional URLs of the SD backends. Defaults to SD_URL.
+        """
+        # Create a folder path for storing generated images
+        self.folder_path = folder_path or os.path.join(os.path.expanduser("~"), "Smart-Tile-Maker")
+        self.sd_urls = list(sd_urls or [SD_URL])
+        # The key type is only known after load()
+        self.key = ""
+        self.texture_cache = True
+        self.texture_cache_max_bytes = TEXTURE_CACHE_MAX_BYTES
+        self.name_cache = True
+        # Kept in the default folder so it is shared by every output folder
+        self.name_cache_path = os.path.join(os.path.expanduser("~"), "Smart-Tile-Maker", ".name-cache.sqlite3")
+        self.dedup = False
+        self.dedup_max_distance = DEDUP_MAX_DISTANCE
+
+    def load(self):
+        """Creates the output folder, resolves the OpenAI key and reads SD_URLS from the environment.
+
+        Returns:
+        - Config: This config, so it can be chained.
+        """
+        os.makedirs(self.folder_path, exist_ok=True)
+        # SD_URLS holds a comma separated list of SD backends to spread the images over
+        if os.environ.get("SD_URLS", "").strip():
+            self.sd_urls = [url.strip() for url in os.environ["SD_URLS"].split(",") if url.strip()]
+        # Check if the OpenAI API key is provided as an environment variable
+        if "OPENAI_API_KEY" in os.environ:
+            # Set key type as "OS_KEY" if environment variable is present
+            self.key = "OS_KEY"
+            # Set OpenAI API key from environment variable
+            openai.api_key = os.environ["OPENAI_API_KEY"]
+        else:
+            # Set key type as "USER_KEY" if environment variable is not present
+            self.key = "USER_KEY"
+        return self
+
+    def texture_cache_path(self):
+        """Returns the folder of the texture cache.
+
+        Returns:
+        - str: The cache folder inside the output folder.
+        """
+        return os.path.join(self.folder_path, ".texture-cache")
+
+    def hash_index_path(self):
+        """Returns the SQLite file of the perceptual hash index.
+
+        Returns:
+        - str: The index file inside the output folder, next to the textures it indexes.
+        """
+        return os.path.join(self.folder_path, ".hash-index.sqlite3")
+
+
+# The settings used by the tool, loaded by the GUI and batch entry points
+config = Config()
+
+
+class SDClient:
+    """Class that sends every request to one Stable Diffusion backend through a pooled keep-alive session.
+
+    Attributes:
+    - base_url (str): The URL of the SD backend.
+    - session (requests.Session): The session holding the pooled connections.
+    - timeouts (dict): The (connect, read) timeout for each endpoint path.
+    - active_checkpoint (str): The checkpoint loaded on the backend, or None if not known yet.
+    - swaps (int): The number of times the checkpoint has been switched.
+
+    Methods:
+    - timeout_for(path): Returns the timeout used for an endpoint path.
+    - get(path): Sends a GET request to the backend.
+    - post(path, payload): Sends a POST request with a JSON payload to the backend.
+    - ensure_checkpoint(checkpoint): Switches the backend checkpoint only if it is not already loaded.
+    - forget_checkpoint(): Clears the cached checkpoint so it is read again on next use.
+    - interrupt(): Asks the backend to stop the image it is generating.
+    - close(): Closes all pooled connections.
+    """
+
+    def __init__(self, base_url, pool_size=SD_POOL_SIZE, timeouts=None):
+        """Initializes the SDClient object.
+
+        Args:
+        - base_url (str): The URL of the SD backend.
+        - pool_size (int): The number of keep-alive connections kept open to the backend.
+        - timeouts (dict): Optional (connect, read) timeouts that override SD_TIMEOUTS.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = dict(SD_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        # Only retry failed connects, a retried txt2img would render the image twice
+        retry = Retry(total=SD_CONNECT_RETRIES, connect=SD_CONNECT_RETRIES, read=0, status=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              pool_block=True, max_retries=retry)
+        # Create one session so connections are reused between calls
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # The checkpoint is read from the backend on first use
+        self.active_checkpoint = None
+        self.swaps = 0
+        self._checkpoint_lock = threading.Lock()
+
+    def timeout_for(self, path):
+        """Returns the timeout used for an endpoint path.
+
+        Args:
+        - path (str): The endpoint path, e.g. "/sdapi/v1/txt2img".
+
+        Returns:
+        - tuple: The (connect, read) timeout in seconds.
+        """
+        return self.timeouts.get(path, SD_DEFAULT_TIMEOUT)
+
+    def get(self, path="/", timeout=None):
+        """Sends a GET request to the backend.
+
+        Args:
+        - path (str): The endpoint path.
+        - timeout: Optional timeout that overrides the one for the endpoint.
+
+        Returns:
+        - requests.Response: The response from the backend.
+        """
+        return self.session.get(f"{self.base_url}{path}",
+                                timeout=timeout or self.timeout_for(path))
+
+    def post(self, path, payload, timeout=None):
+        """Sends a POST request with a JSON payload to the backend.
+
+        Args:
+        - path (str): The endpoint path.
+        - payload (dict): The JSON payload.
+        - timeout: Optional timeout that overrides the one for the endpoint.
+
+        Returns:
+        - requests.Response: The response from the backend.
+        """
+        return self.session.post(f"{self.base_url}{path}", json=payload,
+                                 timeout=timeout or self.timeout_for(path))
+
+    def ensure_checkpoint(self, checkpoint):
+        """Switches the backend checkpoint only if it is not already loaded.
+
+        Args:
+        - checkpoint (str): The checkpoint title, e.g. "TextureDiffusion_10.ckpt [ded387e0f3]".
+
+        Returns:
+        - boolean: True if the checkpoint had to be switched, False if it was already loaded.
+        """
+        # Hold the lock so parallel jobs do not switch the same backend at once
+        with self._checkpoint_lock:
+            # Read the loaded checkpoint once instead of setting it before every image
+            if self.active_checkpoint is None:
+                response = self.get('/sdapi/v1/options')
+                response.raise_for_status()
+                self.active_checkpoint = response.json().get("sd_model_checkpoint")
+            if same_checkpoint(self.active_checkpoint, checkpoint):
+                return False
+            # Forget the cached value first so a failed switch is re-read next time
+            self.active_checkpoint = None
+            response = self.post('/sdapi/v1/options', {"sd_model_checkpoint": checkpoint})
+            response.raise_for_status()
+            self.active_checkpoint = checkpoint
+            self.swaps += 1
+            return True
+
+    def forget_checkpoint(self):
+        """Clears the cached checkpoint so it is read again on next use."""
+        with self._checkpoint_lock:
+            self.active_checkpoint = None
+
+    def interrupt(self):
+        """Asks the backend to stop the image it is generating.
+
+        Returns:
+        - requests.Response: The response from the backend.
+        """
+        return self.post('/sdapi/v1/interrupt', {})
+
+    def close(self):
+        """Closes all pooled connections."""
+        self.session.close()
+
+
+class AsyncSDClient:
+    """Class that sends requests to one Stable Diffusion backend from asyncio code through a pooled aiohttp session.
+
+    The loaded checkpoint is kept on the SDClient of the same backend, so the sync and
+    async clients agree on what is loaded. Must be created on the event loop it is used from.
+
+    Attributes:
+    - client (SDClient): The sync client of the backend, holding its timeouts and checkpoint.
+    - base_url (str): The URL of the SD backend.
+    - session (aiohttp.ClientSession): The session holding the pooled connections.
+
+    Methods:
+    - timeout_for(path, deadline): Returns the aiohttp timeout used for an endpoint path.
+    - get(path, deadline, params): Sends a GET request to the backend and returns the JSON reply.
+    - post(path, payload, deadline): Sends a POST request with a JSON payload and returns the JSON reply.
+    - ensure_checkpoint(checkpoint, deadline): Switches the backend checkpoint only if it is not already loaded.
+    - interrupt(): Asks the backend to stop the image it is generating.
+    - interrupt_soon(): Sends interrupt() in the background.
+    - flush_interrupts(timeout): Waits for the interrupts sent in the background.
+    - close(): Closes all pooled connections, once the interrupts are sent.
+    """
+
+    def __init__(self, client, pool_size=SD_POOL_SIZE):
+        """Initializes the AsyncSDClient object.
+
+        Args:
+        - client (SDClient): The sync client of the backend.
+        - pool_size (int): The number of connections kept open to the backend.
+        """
+        self.client = client
+        self.base_url = client.base_url
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size))
+        self._checkpoint_lock = asyncio.Lock()
+        # Interrupts sent in the background, kept so they are not garbage collected
+        self._interrupts = set()
+
+    def timeout_for(self, path, deadline=None):
+        """Returns the aiohttp timeout used for an endpoint path.
+
+        Args:
+        - path (str): The endpoint path, e.g. "/sdapi/v1/txt2img".
+        - deadline (Deadline): Optional deadline that caps the whole request.
+
+        Returns:
+        - aiohttp.ClientTimeout: The connect and read timeouts of the endpoint.
+        """
+        connect, read = self.client.timeout_for(path)
+        total = deadline.timeout() if deadline is not None else None
+        return aiohttp.ClientTimeout(total=total, sock_connect=connect, sock_read=read)
+
+    async def _request(self, method, path, payload=None, deadline=None, params=None):
+        """Sends a request to the backend and returns the JSON reply, retrying failed connects."""
+        for attempt in range(SD_CONNECT_RETRIES + 1):
+            try:
+                async with self.session.request(method, f"{self.base_url}{path}", json=payload, params=params,
+                                                timeout=self.timeout_for(path, deadline)) as response:
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except aiohttp.ClientConnectorError:
+                # Only retry failed connects, a retried txt2img would render the image twice
+                if attempt == SD_CONNECT_RETRIES:
+                    raise
+                await asyncio.sleep(0.2 * 2 ** attempt)
+
+    async def get(self, path="/", deadline=None, params=None):
+        """Sends a GET request to the backend.
+
+        Args:
+        - path (str): The endpoint path.
+        - deadline (Deadline): Optional deadline the request must finish by.
+        - params (dict): Optional query parameters.
+
+        Returns:
+        - The JSON reply from the backend.
+        """
+        return await self._request("GET", path, deadline=deadline, params=params)
+
+    async def post(self, path, payload, deadline=None):
+        """Sends a POST request with a JSON payload to the backend.
+
+        Args:
+        - path (str): The endpoint path.
+        - payload (dict): The JSON payload.
+        - deadline (Deadline): Optional deadline the request must finish by.
+
+        Returns:
+        - The JSON reply from the backend.
+        """
+        return await self._request("POST", path, payload, deadline)
+
+    async def ensure_checkpoint(self, checkpoint, deadline=None):
+        """Switches the backend checkpoint only if it is not already loaded.
+
+        Args:
+        - checkpoint (str): The checkpoint title, e.g. "TextureDiffusion_10.ckpt [ded387e0f3]".
+        - deadline (Deadline): Optional deadline the switch must finish by.
+
+        Returns:
+        - boolean: True if the checkpoint had to be switched, False if it was already loaded.
+        """
+        client = self.client
+        # Hold the lock so parallel jobs do not switch the same backend at once
+        async with self._checkpoint_lock:
+            # Read the loaded checkpoint once instead of setting it before every image
+            if client.active_checkpoint is None:
+                options = await self.get('/sdapi/v1/options', deadline)
+                client.active_checkpoint = options.get("sd_model_checkpoint")
+            if same_checkpoint(client.active_checkpoint, checkpoint):
+                return False
+            # Forget the cached value first so a failed switch is re-read next time
+            client.active_checkpoint = None
+            await self.post('/sdapi/v1/options', {"sd_model_checkpoint": checkpoint}, deadline)
+            client.active_checkpoint = checkpoint
+            client.swaps += 1
+            return True
+
+    async def interrupt(self):
+        """Asks the backend to stop the image it is generating.
+
+        Returns:
+        - boolean: True if the backend got the request.
+        """
+        try:
+            await self.post('/sdapi/v1/interrupt', {})
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+        return True
+
+    def interrupt_soon(self):
+        """Sends interrupt() in the background, for use while a job is being cancelled."""
+        task = asyncio.ensure_future(self.interrupt())
+        self._interrupts.add(task)
+        task.add_done_callback(self._interrupts.discard)
+
+    async def flush_interrupts(self, timeout=SD_INTERRUPT_FLUSH_TIMEOUT):
+        """Waits for the interrupts sent in the background to reach the backend.
+
+        Args:
+        - timeout (float): Seconds to wait at most.
+
+        Returns:
+        - int: The number of interrupts still being sent after the timeout.
+        """
+        if not self._interrupts:
+            return 0
+        _, pending = await asyncio.wait(list(self._interrupts), timeout=timeout)
+        return len(pending)
+
+    async def close(self):
+        """Closes all pooled connections, once the interrupts are sent.
+
+        A job abandoned just before the program exits would otherwise keep SD busy after it.
+        """
+        await self.flush_interrupts()
+        await self.session.close()
+
+
+def same_checkpoint(loaded, wanted):
+    """Checks if two SD checkpoint titles refer to the same model.
+
+    A1111 reports titles as "name.ckpt [hash]", but older versions leave out the hash.
+
+    Args:
+    - loaded (str): The checkpoint title reported by the backend.
+    - wanted (str): The checkpoint title that is needed.
+
+    Returns:
+    - boolean: True if both titles name the same checkpoint.
+    """
+    if not loaded or not wanted:
+        return False
+    if loaded == wanted:
+        return True
+    # Compare only the names when either title has no hash
+    loaded_name, _, loaded_hash = loaded.partition(" [")
+    wanted_name, _, wanted_hash = wanted.partition(" [")
+    if loaded_hash and wanted_hash:
+        return loaded_hash == wanted_hash
+    return loaded_name == wanted_name
+
+
+# Shared SD clients, one per backend URL
+_sd_clients = {}
+_sd_clients_lock = threading.Lock()
+
+
+def get_sd_client(base_url=None):
+    """Returns the shared SDClient for a backend, creating it on first use.
+
+    Args:
+    - base_url (str): The URL of the SD backend. Defaults to the first of config.sd_urls.
+
+    Returns:
+    - SDClient: The shared client for the backend.
+    """
+    base_url = base_url or config.sd_urls[0]
+    with _sd_clients_lock:
+        if base_url not in _sd_clients:
+            _sd_clients[base_url] = SDClient(base_url)
+        return _sd_clients[base_url]
+
+
+class Deadline:
+    """Class that tracks the time a job must be finished by, passed down to every request of the job.
+
+    Attributes:
+    - at (float): The time.monotonic() the job must be finished by, or None for no deadline.
+
+    Methods:
+    - remaining(): Returns the seconds left.
+    - expired(): Checks if the deadline has passed.
+    - sooner(seconds): Returns the earlier of this deadline and one seconds from now.
+    - timeout(limit): Returns the timeout for one request, capped by the seconds left.
+    - wait_for(awaitable): Awaits an awaitable, giving up when the deadline passes.
+    """
+
+    def __init__(self, seconds=None):
+        """Initializes the Deadline object.
+
+        Args:
+        - seconds (float): Seconds from now the job must be finished by, or None for no deadline.
+        """
+        self.at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        """Returns the seconds left.
+
+        Returns:
+        - float: The seconds until the deadline, negative once it has passed, or None for no deadline.
+        """
+        return None if self.at is None else self.at - time.monotonic()
+
+    def expired(self):
+        """Checks if the deadline has passed.
+
+        Returns:
+        - boolean: True if the deadline has passed.
+        """
+        return self.at is not None and time.monotonic() >= self.at
+
+    def sooner(self, seconds):
+        """Returns the earlier of this deadline and one seconds from now.
+
+        Args:
+        - seconds (float): Seconds from now, or None to keep this deadline.
+
+        Returns:
+        - Deadline: The deadline that passes first.
+        """
+        if seconds is None:
+            return self
+        deadline = Deadline(seconds)
+        if self.at is not None and self.at <= deadline.at:
+            return self
+        return deadline
+
+    def timeout(self, limit=None):
+        """Returns the timeout for one request, capped by the seconds left.
+
+        Args:
+        - limit (float): The request's own timeout, or None for no limit.
+
+        Returns:
+        - float: The smaller of limit and the seconds left, or None if neither is set.
+
+        Raises:
+        - asyncio.TimeoutError: If the deadline has passed.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        if remaining <= 0:
+            raise asyncio.TimeoutError("The deadline has passed")
+        return remaining if limit is None else min(limit, remaining)
+
+    async def wait_for(self, awaitable, limit=None):
+        """Awaits an awaitable, giving up when the deadline passes.
+
+        Args:
+        - awaitable: The coroutine or future to await.
+        - limit (float): Optional timeout of its own.
+
+        Returns:
+        - The result of the awaitable.
+
+        Raises:
+        - asyncio.TimeoutError: If the deadline or the limit passes first.
+        """
+        try:
+            timeout = self.timeout(limit)
+        except asyncio.TimeoutError:
+            # Close the coroutine so it is not reported as never awaited
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise
+        return await asyncio.wait_for(awaitable, timeout)
+
+
+class TaskGroup:
+    """Async context manager that runs tasks together and cancels them together.
+
+    Works like asyncio.TaskGroup from Python 3.11: leaving the block waits for every task,
+    the first task to fail cancels the others, and cancelling the block cancels every task.
+    The first error is raised as is instead of inside an ExceptionGroup.
+
+    Methods:
+    - create_task(coro): Starts a task in the group.
+    - cancel(): Cancels every task still running.
+    """
+
+    def __init__(self):
+        """Initializes the TaskGroup object."""
+        self._tasks = set()
+        self._error = None
+
+    async def __aenter__(self):
+        return self
+
+    def create_task(self, coro):
+        """Starts a task in the group.
+
+        Args:
+        - coro: The coroutine to run.
+
+        Returns:
+        - asyncio.Task: The task.
+        """
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task):
+        """Forgets a finished task, cancelling the others if it failed."""
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None and self._error is None:
+            self._error = task.exception()
+            self.cancel()
+
+    def cancel(self):
+        """Cancels every task still running."""
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.cancel()
+        cancelled = False
+        # Wait for every task, even when this block is cancelled while waiting
+        while self._tasks:
+            try:
+                await asyncio.wait(list(self._tasks))
+            except asyncio.CancelledError:
+                cancelled = True
+                self.cancel()
+        if exc is None and self._error is not None:
+            raise self._error
+        if exc is None and cancelled:
+            raise asyncio.CancelledError()
+        return False
+
+
+class AsyncEngine:
+    """Class that runs the generation coroutines on an asyncio event loop in a background thread.
+
+    Sync code hands coroutines to the loop with submit() or run_sync(), so dozens of GPT and SD
+    requests can be in flight without a thread for each one. Blocking work such as file access
+    is moved off the loop with in_thread(). Coroutines may also be awaited from another event
+    loop, each loop gets its own SD sessions.
+
+    Methods:
+    - loop(): Returns the event loop, starting it on first use.
+    - submit(coro): Schedules a coroutine on the loop.
+    - run_sync(coro): Runs a coroutine on the loop and waits for its result.
+    - in_thread(func, *args): Runs a blocking function on the engine's threads.
+    - in_process(func, *args): Runs a CPU heavy function on the engine's worker processes.
+    - sd_client(client): Returns the AsyncSDClient of a backend for the running loop.
+    - backend_slot(base_url): Returns the semaphore limiting the jobs sent to a backend at once.
+    - close(): Closes every SD session, stops the worker processes and stops the loop.
+    """
+
+    def __init__(self, threads=ENGINE_THREADS, processes=ENGINE_PROCESSES):
+        """Initializes the AsyncEngine object.
+
+        Args:
+        - threads (int): The number of threads used for blocking work.
+        - processes (int): The number of worker processes used for CPU heavy work, None for one per core.
+        """
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="engine")
+        # Started on first use, most runs never need it
+        self._processes = None
+        self._process_count = processes
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # AsyncSDClients and backend semaphores for each (loop, URL)
+        self._sd_clients = {}
+        self._slots = {}
+
+    def loop(self):
+        """Returns the event loop, starting it on first use.
+
+        Returns:
+        - asyncio.AbstractEventLoop: The loop running in the engine thread.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="engine-loop", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro):
+        """Schedules a coroutine on the loop.
+
+        Args:
+        - coro: The coroutine.
+
+        Returns:
+        - concurrent.futures.Future: The future of its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop())
+
+    def run_sync(self, coro):
+        """Runs a coroutine on the loop and waits for its result.
+
+        Args:
+        - coro: The coroutine.
+
+        Returns:
+        - The result of the coroutine.
+
+        Raises:
+        - RuntimeError: If called from the loop itself, which would never finish.
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("run_sync() cannot be called from the engine loop, await the coroutine instead")
+        return self.submit(coro).result()
+
+    async def in_thread(self, func, *args):
+        """Runs a blocking function on the engine's threads.
+
+        Args:
+        - func (callable): The function.
+        - *args: The arguments to pass.
+
+        Returns:
+        - The result of the function.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def in_process(self, func, *args):
+        """Runs a CPU heavy function on the engine's worker processes.
+
+        The processes are spawned rather than forked, as forking a process with running
+        threads can copy a held lock into the child.
+
+        Args:
+        - func (callable): A module level function, so it can be sent to another process.
+        - *args: The arguments to pass, they must be picklable.
+
+        Returns:
+        - The result of the function.
+        """
+        with self._lock:
+            if self._processes is None:
+                self._processes = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self._process_count, mp_context=multiprocessing.get_context("spawn"))
+        return await asyncio.get_running_loop().run_in_executor(self._processes, func, *args)
+
+    def sd_client(self, client):
+        """Returns the AsyncSDClient of a backend for the running loop, creating it on first use.
+
+        Args:
+        - client (SDClient): The sync client of the backend.
+
+        Returns:
+        - AsyncSDClient: The shared async client.
+        """
+        key = (asyncio.get_running_loop(), client.base_url)
+        if key not in self._sd_clients:
+            self._sd_clients[key] = AsyncSDClient(client)
+        return self._sd_clients[key]
+
+    def backend_slot(self, base_url):
+        """Returns the semaphore limiting the jobs sent to a backend at once.
+
+        Args:
+        - base_url (str): The URL of the SD backend.
+
+        Returns:
+        - asyncio.Semaphore: A semaphore with SD_WORKERS slots.
+        """
+        key = (asyncio.get_running_loop(), base_url)
+        if key not in self._slots:
+            self._slots[key] = asyncio.Semaphore(SD_WORKERS)
+        return self._slots[key]
+
+    async def _close_sessions(self):
+        """Closes the SD sessions of the running loop, all at once so their interrupts are flushed together."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(self._sd_clients.pop(key).close()
+                               for key in [key for key in self._sd_clients if key[0] is loop]))
+
+    def close(self):
+        """Closes every SD session, stops the worker processes and stops the loop."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+            processes, self._processes = self._processes, None
+        if processes is not None:
+            processes.shutdown(wait=False, cancel_futures=True)
+        if loop is None:
+            return
+        try:
+            # Leave the interrupts time to be sent before giving up on the sessions
+            asyncio.run_coroutine_threadsafe(self._close_sessions(), loop).result(
+                timeout=SD_INTERRUPT_FLUSH_TIMEOUT + 2)
+        except concurrent.futures.TimeoutError:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+
+
+# The shared engine, started on first use
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Returns the shared AsyncEngine, creating it on first use.
+
+    Returns:
+    - AsyncEngine: The shared engine.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncEngine()
+            # Close the sessions cleanly instead of leaving aiohttp to warn about them at exit
+            atexit.register(_engine.close)
+        return _engine
+
+
+class NoBackendError(Exception):
+    """Raised when none of the SD backends are answering."""
+
+
+def is_backend_failure(error):
+    """Checks if an error means the SD backend is down rather than that the request was bad.
+
+    Args:
+    - error (Exception): The error raised by a request.
+
+    Returns:
+    - boolean: True if the backend could not be reached or a proxy in front of it gave up.
+    """
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code in (502, 503, 504)
+    # The same failures as raised by AsyncSDClient
+    if isinstance(error, (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError)):
+        return True
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in (502, 503, 504)
+    return False
+
+
+class SDBackend:
+    """Class that tracks the load and health of one SD backend.
+
+    Attributes:
+    - client (SDClient): The client for the backend.
+    - in_flight (int): The number of jobs sent to the backend that have not finished.
+    - started (int): The number of jobs ever sent to the backend.
+    - healthy (bool): Whether the backend is answering.
+    - failures (int): The number of failed probes since the backend stopped answering.
+    - probe_at (float): The time.monotonic() when the backend should be probed again.
+    - checkpoint (str): The checkpoint the backend's last job needed, or None if not known yet.
+    """
+
+    def __init__(self, client):
+        """Initializes the SDBackend object.
+
+        Args:
+        - client (SDClient): The client for the backend.
+        """
+        self.client = client
+        self.in_flight = 0
+        self.started = 0
+        self.healthy = True
+        self.failures = 0
+        self.probe_at = 0.0
+        self.checkpoint = None
+
+    def loaded_checkpoint(self):
+        """Returns the checkpoint the backend has loaded, or is being switched to by its jobs.
+
+        Returns:
+        - str: The checkpoint title, or None if not known yet.
+        """
+        # The client only knows once a job has checked, which would let a second job pick
+        # the same backend's checkpoint as if nothing had it
+        return self.checkpoint or self.client.active_checkpoint
+
+
+class BackendPool:
+    """Class that spreads SD jobs over several backends, least loaded first.
+
+    Jobs stick to the backends that already have their checkpoint loaded, since a switch
+    takes several seconds. Backends that stop answering are taken out of the pool and
+    probed again in the background with a growing delay until they answer.
+
+    Attributes:
+    - backends (list): The SDBackend for each URL.
+    - probe_timeout (float): Seconds a probe may take.
+
+    Methods:
+    - acquire(checkpoint, can_swap): Picks the backend for a job, preferring ones with its checkpoint loaded.
+    - release(backend, error): Marks a job as finished, taking the backend out of the pool if it failed.
+    - lease(checkpoint, can_swap): Context manager that acquires a backend and releases it afterwards.
+    - loaded_checkpoints(): Returns the free job slots of the healthy backends for each loaded checkpoint.
+    - idle_checkpoints(): Returns the checkpoint of each healthy backend that has no job.
+    - swaps(): Returns the number of checkpoint switches on every backend.
+    - probe(backend): Checks if a backend is answering.
+    - probe_all(): Probes every backend at the same time.
+    - stats(): Returns the load and health of each backend.
+    """
+
+    def __init__(self, urls, probe_timeout=PREFLIGHT_TIMEOUT):
+        """Initializes the BackendPool object.
+
+        Args:
+        - urls (list): The URLs of the SD backends.
+        - probe_timeout (float): Seconds a probe may take.
+        """
+        self.backends = [SDBackend(get_sd_client(url)) for url in urls]
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._monitor = None
+
+    def acquire(self, checkpoint=None, can_swap=None, probe=True):
+        """Picks the backend for a job, preferring ones with its checkpoint loaded.
+
+        In order, the job goes to:
+        1. A backend with the checkpoint loaded and a free job slot.
+        2. An idle backend whose own checkpoint has no jobs waiting, which is then switched.
+        3. A backend with the checkpoint loaded, queueing behind its other jobs.
+        4. The least loaded backend, when no backend has the checkpoint and none is free.
+
+        Args:
+        - checkpoint (str): The checkpoint the job needs, or None to ignore checkpoints.
+        - can_swap (callable): Optional can_swap(loaded_checkpoint) that says if a backend with
+          that checkpoint may be switched, i.e. no queued job needs it. Defaults to always.
+        - probe (bool): Whether to probe every backend and try again when none are answering.
+          Async callers pass False and probe off the event loop themselves.
+
+        Returns:
+        - SDBackend: The backend, with the job counted as in flight.
+
+        Raises:
+        - NoBackendError: If no backend is answering.
+        """
+        for attempt in range(2):
+            with self._lock:
+                healthy = [backend for backend in self.backends if backend.healthy]
+                if healthy:
+                    backend = self._pick(healthy, checkpoint, can_swap)
+                    backend.checkpoint = checkpoint or backend.checkpoint
+                    backend.in_flight += 1
+                    backend.started += 1
+                    return backend
+            if not probe or attempt:
+                break
+            # Every backend is out, check right away instead of waiting for the monitor
+            self.probe_all()
+        raise NoBackendError("None of the SD backends are answering: "
+                             + ", ".join(backend.client.base_url for backend in self.backends))
+
+    def _pick(self, healthy, checkpoint, can_swap):
+        """Picks the backend for a job from the healthy ones, see acquire()."""
+        # Ties go to the backend that was given the fewest jobs overall
+        def load(backend):
+            return (backend.in_flight, backend.started)
+        if checkpoint is None:
+            return min(healthy, key=load)
+        loaded = [backend for backend in healthy
+                  if same_checkpoint(backend.loaded_checkpoint(), checkpoint)]
+        free = [backend for backend in loaded if backend.in_flight < SD_WORKERS]
+        if free:
+            return min(free, key=load)
+        # Only switch a backend once it is idle and nothing queued needs its checkpoint,
+        # backends whose checkpoint is not known yet go first
+        idle = [backend for backend in healthy if backend.in_flight == 0
+                and (can_swap is None or backend.loaded_checkpoint() is None
+                     or can_swap(backend.loaded_checkpoint()))]
+        if idle:
+            return min(idle, key=lambda b: (b.loaded_checkpoint() is not None, b.started))
+        return min(loaded or healthy, key=load)
+
+    def loaded_checkpoints(self):
+        """Returns the free job slots of the healthy backends for each loaded checkpoint.
+
+        Returns:
+        - dict: The number of free job slots for each checkpoint title.
+        """
+        with self._lock:
+            slots = {}
+            for backend in self.backends:
+                checkpoint = backend.loaded_checkpoint()
+                if backend.healthy and checkpoint is not None:
+                    slots[checkpoint] = slots.get(checkpoint, 0) + max(0, SD_WORKERS - backend.in_flight)
+            return slots
+
+    def idle_checkpoints(self):
+        """Returns the checkpoint of each healthy backend that has no job.
+
+        Returns:
+        - list: The checkpoint title of each idle backend, None where it is not known yet.
+        """
+        with self._lock:
+            return [backend.loaded_checkpoint() for backend in self.backends
+                    if backend.healthy and backend.in_flight == 0]
+
+    def swaps(self):
+        """Returns the number of checkpoint switches on every backend.
+
+        Returns:
+        - int: The total number of switches since the pool was created.
+        """
+        return sum(backend.client.swaps for backend in self.backends)
+
+    def release(self, backend, error=None):
+        """Marks a job as finished, taking the backend out of the pool if it failed.
+
+        Args:
+        - backend (SDBackend): The backend the job ran on.
+        - error (Exception): The error the job failed with, if any.
+        """
+        with self._lock:
+            backend.in_flight -= 1
+        if error is not None and is_backend_failure(error):
+            self._eject(backend)
+
+    @contextlib.contextmanager
+    def lease(self, checkpoint=None, can_swap=None):
+        """Context manager that acquires a backend and releases it afterwards.
+
+        Args:
+        - checkpoint (str): The checkpoint the job needs, see acquire().
+        - can_swap (callable): Optional can_swap(loaded_checkpoint), see acquire().
+
+        Yields:
+        - SDBackend: The backend to send the job to.
+        """
+        backend = self.acquire(checkpoint, can_swap)
+        try:
+            yield backend
+        except Exception as e:
+            self.release(backend, e)
+            raise
+        self.release(backend)
+
+    def _eject(self, backend):
+        """Takes a backend out of the pool and makes sure the monitor will probe it."""
+        with self._lock:
+            if backend.healthy:
+                backend.healthy = False
+                backend.failures = 0
+                backend.probe_at = time.monotonic() + SD_PROBE_DELAY
+                print(f"SD backend {backend.client.base_url} is not answering, taking it out of the pool")
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._watch, daemon=True)
+                self._monitor.start()
+
+    def _watch(self):
+        """Probes the backends that are out of the pool until every one is back."""
+        while True:
+            with self._lock:
+                down = [backend for backend in self.backends if not backend.healthy]
+                if not down:
+                    self._monitor = None
+                    return
+                wait = min(backend.probe_at for backend in down) - time.monotonic()
+            if wait > 0:
+                time.sleep(min(wait, 1.0))
+                continue
+            for backend in down:
+                if backend.probe_at <= time.monotonic():
+                    self.probe(backend)
+
+    def probe(self, backend):
+        """Checks if a backend is answering, putting it back in the pool if it is.
+
+        Args:
+        - backend (SDBackend): The backend to check.
+
+        Returns:
+        - boolean: True if the backend answered.
+        """
+        try:
+            response = backend.client.get("/", timeout=self.probe_timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            with self._lock:
+                was_healthy = backend.healthy
+                backend.healthy = False
+                backend.failures += 1
+                backend.probe_at = time.monotonic() + min(
+                    SD_PROBE_MAX_DELAY, SD_PROBE_DELAY * 2 ** (backend.failures - 1))
+            if was_healthy:
+                self._eject(backend)
+            return False
+        with self._lock:
+            if not backend.healthy:
+                print(f"SD backend {backend.client.base_url} is answering again")
+            backend.healthy = True
+            backend.failures = 0
+        return True
+
+    def probe_all(self):
+        """Probes every backend at the same time.
+
+        Returns:
+        - int: The number of backends that answered.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.backends)) as executor:
+            return sum(executor.map(self.probe, self.backends))
+
+    def stats(self):
+        """Returns the load and health of each backend.
+
+        Returns:
+        - list: A dict with the url, healthy, in_flight, started, checkpoint and swaps of each backend.
+        """
+        with self._lock:
+            return [{"url": backend.client.base_url, "healthy": backend.healthy,
+                     "in_flight": backend.in_flight, "started": backend.started,
+                     "checkpoint": backend.client.active_checkpoint, "swaps": backend.client.swaps}
+                    for backend in self.backends]
+
+
+# Shared backend pools, one per list of URLs
+_backend_pools = {}
+_backend_pools_lock = threading.Lock()
+
+
+def get_backend_pool(urls=None):
+    """Returns the shared BackendPool for a list of SD backends, creating it on first use.
+
+    Args:
+    - urls (list): The URLs of the SD backends. Defaults to config.sd_urls.
+
+    Returns:
+    - BackendPool: The shared pool.
+    """
+    urls = tuple(urls or config.sd_urls)
+    with _backend_pools_lock:
+        if urls not in _backend_pools:
+            _backend_pools[urls] = BackendPool(urls)
+        return _backend_pools[urls]
+
+
+# Signature at the start of every PNG file
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def iter_png_chunks(data):
+    """Yields the chunks of a PNG file without decoding any pixels.
+
+    Args:
+    - data (bytes): The PNG file contents.
+
+    Yields:
+    - tuple: (chunk_type, chunk_data, start, end) where start and end are the byte offsets of the whole chunk.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG image")
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        # Each chunk is length, type, data and a CRC
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        end = pos + 12 + length
+        yield chunk_type, data[pos + 8:pos + 8 + length], pos, end
+        if chunk_type == b"IEND":
+            return
+        pos = end
+
+
+def read_png_text(data, key="parameters"):
+    """Reads a text chunk from a PNG file.
+
+    Args:
+    - data (bytes): The PNG file contents.
+    - key (str): The text keyword to read.
+
+    Returns:
+    - str: The text stored under the keyword, or None if the PNG has none.
+    """
+    for chunk_type, body, _, _ in iter_png_chunks(data):
+        if chunk_type == b"tEXt":
+            name, _, text = body.partition(b"\0")
+            if name.decode("latin-1") == key:
+                return text.decode("latin-1")
+        elif chunk_type == b"zTXt":
+            name, _, rest = body.partition(b"\0")
+            if name.decode("latin-1") == key:
+                # Skip the compression method byte
+                return zlib.decompress(rest[1:]).decode("latin-1")
+        elif chunk_type == b"iTXt":
+            name, _, rest = body.partition(b"\0")
+            if name.decode("latin-1") == key:
+                compressed, rest = rest[0], rest[2:]
+                # Skip the language tag and translated keyword
+                _, _, rest = rest.partition(b"\0")
+                _, _, text = rest.partition(b"\0")
+                if compressed:
+                    text = zlib.decompress(text)
+                return text.decode("utf-8")
+    return None
+
+
+def png_chunk(chunk_type, body):
+    """Builds a PNG chunk with its length and CRC.
+
+    Args:
+    - chunk_type (bytes): The four letter chunk type, e.g. b"tEXt".
+    - body (bytes): The chunk data.
+
+    Returns:
+    - bytes: The encoded chunk.
+    """
+    return (struct.pack(">I", len(body)) + chunk_type + body
+            + struct.pack(">I", zlib.crc32(chunk_type + body)))
+
+
+def png_with_text(data, key, text):
+    """Splices a text chunk into a PNG file without decoding or recompressing the pixels.
+
+    Any existing text chunk with the same keyword is replaced. The new chunk is written
+    as tEXt when the text is Latin-1 and as iTXt otherwise.
+
+    Args:
+    - data (bytes): The PNG file contents.
+    - key (str): The text keyword, e.g. "parameters".
+    - text (str): The text to store.
+
+    Returns:
+    - bytes: The PNG file contents with the text chunk added.
+    """
+    try:
+        chunk = png_chunk(b"tEXt", key.encode("latin-1") + b"\0" + text.encode("latin-1"))
+    except UnicodeEncodeError:
+        # iTXt is keyword, compression flag, compression method, language, translated keyword, text
+        chunk = png_chunk(b"iTXt", key.encode("latin-1") + b"\0\0\0\0\0" + text.encode("utf-8"))
+    name = key.encode("latin-1") + b"\0"
+    parts = [PNG_SIGNATURE]
+    for chunk_type, body, start, end in iter_png_chunks(data):
+        # Drop the old copy of the same text
+        if chunk_type in (b"tEXt", b"zTXt", b"iTXt") and body.startswith(name):
+            continue
+        parts.append(data[start:end])
+        # Put the text straight after the header, like PIL does
+        if chunk_type == b"IHDR":
+            parts.append(chunk)
+    return b"".join(parts)
+
+
+def save_png(path, data):
+    """Writes PNG file contents to disk in one buffered write.
+
+    Args:
+    - path (str): The output file path.
+    - data (bytes): The PNG file contents.
+    """
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def image_parameters(info, index, image_bytes):
+    """Builds the "parameters" text for an image returned by txt2img without asking SD for it.
+
+    Args:
+    - info (str): The "info" JSON string from the txt2img response.
+    - index (int): The position of the image in the response.
+    - image_bytes (bytes): The decoded PNG file.
+
+    Returns:
+    - str: The generation parameters text, or an empty string if none are available.
+    """
+    # txt2img already returns the infotext for each image
+    try:
+        infotexts = json.loads(info).get("infotexts") or []
+    except (TypeError, ValueError, AttributeError):
+        infotexts = []
+    if index < len(infotexts) and infotexts[index]:
+        return infotexts[index]
+    # Otherwise read it from the PNG text chunks, which is all /png-info does
+    try:
+        return read_png_text(image_bytes) or ""
+    except (ValueError, zlib.error, UnicodeDecodeError):
+        return ""
+
+
+def image_seed(info, index):
+    """Returns the seed SD used for an image returned by txt2img.
+
+    Args:
+    - info (str): The "info" JSON string from the txt2img response.
+    - index (int): The position of the image in the response.
+
+    Returns:
+    - int: The seed, or None if the response does not include it.
+    """
+    try:
+        info = json.loads(info)
+        seeds = info.get("all_seeds") or [info.get("seed")]
+        return int(seeds[min(index, len(seeds) - 1)])
+    except (TypeError, ValueError, AttributeError, IndexError):
+        return None
+
+
+def parse_parameters(text):
+    """Reads the "parameters" text SD stores in its images.
+
+    Args:
+    - text (str): The parameters text, e.g. "PBR, Wood\nSteps: 20, Sampler: Euler a, Seed: 13, ...".
+
+    Returns:
+    - dict: The "prompt" and each "key: value" setting of the last line, e.g. "Seed" and "Steps".
+    """
+    lines = text.strip().splitlines()
+    settings = {}
+    # The settings are on the last line, which always starts with the steps
+    if lines and lines[-1].startswith("Steps: "):
+        for match in re.finditer(r'\s*([^:,]+):\s*("(?:\\.|[^"])*"|[^,]*)(?:,|$)', lines.pop()):
+            settings[match.group(1)] = match.group(2)
+    prompt = []
+    for line in lines:
+        if line.startswith("Negative prompt: "):
+            break
+        prompt.append(line)
+    settings["prompt"] = "\n".join(prompt)
+    return settings
+
+
+def parse_progress(r):
+    """Reads a reply from the SD progress endpoint.
+
+    Args:
+    - r (dict): The JSON reply from /sdapi/v1/progress.
+
+    Returns:
+    - dict: The step, steps, progress (0 to 1), eta in seconds and the low resolution preview
+      as PNG bytes (None if SD sent none), or None if the backend is not generating.
+    """
+    state = r.get("state") or {}
+    step = state.get("sampling_step") or 0
+    progress = r.get("progress") or 0
+    # An idle backend reports no progress at all
+    if not step and not progress:
+        return None
+    preview = r.get("current_image")
+    return {
+        "step": step,
+        "steps": state.get("sampling_steps") or 0,
+        "progress": progress,
+        "eta": r.get("eta_relative"),
+        # Newer versions send a data URL instead of plain base64
+        "preview": base64.b64decode(preview.split(",")[-1]) if preview else None,
+    }
+
+
+def image_array(image_bytes):
+    """Decodes a PNG file into an RGB array.
+
+    Args:
+    - image_bytes (bytes): The PNG file contents.
+
+    Returns:
+    - numpy.ndarray: The pixels as uint8 of shape (height, width, 3).
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def tile_scores(images):
+    """Scores how well images tile from the seams their wrapped edges make.
+
+    The jump from the last column to the first, and from the last row to the first, is compared
+    with the typical jump between the other neighbouring columns and rows. The same is done for
+    the bend in the gradient, which shows seams where the colours match but the slopes do not.
+    Every image of a stack is scored at once.
+
+    Args:
+    - images: The pixels of one image of shape (height, width, channels), or of a stack of
+      images of shape (count, height, width, channels), in 8 bit levels.
+
+    Returns:
+    - float: The score of the image from 0 to 1, or a numpy.ndarray with the score of each image
+      in the stack. 1 means the seams are no stronger than the rest of the image, 0.5 that the
+      worst seam is twice as strong.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    # Seams show in the brightness, so only the luma is compared
+    if images.shape[-1] >= 3:
+        luma = images[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    else:
+        luma = images[..., 0]
+    ratios = []
+    # Columns first, then rows
+    for axis, across in ((-1, -2), (-2, -1)):
+        # Mean jump and gradient bend between neighbouring columns inside the image
+        steps = np.diff(luma, axis=axis)
+        bends = np.abs(np.diff(steps, axis=axis)).mean(axis=across)
+        steps = np.abs(steps, out=steps).mean(axis=across)
+        # The same for the last two and first two columns put side by side, which meet at the seam
+        seam = np.diff(np.take(luma, [-2, -1, 0, 1], axis=axis), axis=axis)
+        seam_bends = np.abs(np.diff(seam, axis=axis)).mean(axis=across)
+        seam_step = np.abs(np.take(seam, 1, axis=axis)).mean(axis=-1)
+        ratios.append(seam_step / np.maximum(np.median(steps, axis=-1), TILE_NOISE_FLOOR))
+        ratios.append(seam_bends.max(axis=-1) / np.maximum(np.median(bends, axis=-1), TILE_NOISE_FLOOR))
+    scores = np.clip(1 / np.maximum(np.max(ratios, axis=0), 1e-6), 0, 1)
+    return float(scores) if scores.ndim == 0 else scores
+
+
+def perceptual_hash(pixels):
+    """Returns the 64 bit perceptual hash (pHash) of an image.
+
+    The image is shrunk to a PHASH_SIZE grey thumbnail by averaging blocks of pixels, and each of
+    the 8 x 8 lowest frequencies of the thumbnail's DCT becomes one bit, set when it is above
+    their median. Noise, fine detail and small colour shifts barely move the low frequencies, so
+    two renders of the same material differ in few bits while unrelated textures differ in about half.
+
+    Args:
+    - pixels (numpy.ndarray): The pixels of shape (height, width) or (height, width, channels).
+
+    Returns:
+    - int: The hash, compare two with bin(a ^ b).count("1").
+    """
+    pixels = np.asarray(pixels, dtype=np.float32)
+    if pixels.ndim == 3:
+        pixels = pixels[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32) if pixels.shape[-1] >= 3 else pixels[..., 0]
+    height, width = pixels.shape
+    size = min(PHASH_SIZE, height, width)
+    # Average blocks as even as the size allows, summing along each axis once
+    rows = np.arange(size) * height // size
+    columns = np.arange(size) * width // size
+    sums = np.add.reduceat(np.add.reduceat(pixels, rows, axis=0), columns, axis=1)
+    thumbnail = sums / np.outer(np.diff(rows, append=height), np.diff(columns, append=width))
+    # DCT-II basis, only the lowest frequencies are needed
+    n = np.arange(size)
+    basis = np.cos(np.pi * (2 * n[None, :] + 1) * n[:8, None] / (2 * size))
+    low = (basis @ thumbnail @ basis.T).ravel()
+    # The first frequency is the mean brightness, which says nothing about the pattern
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def png_bytes(pixels):
+    """Encodes an array as a PNG file.
+
+    Args:
+    - pixels (numpy.ndarray): uint8 pixels of shape (height, width) for grey or (height, width, 3) for RGB.
+
+    Returns:
+    - bytes: The PNG file contents.
+    """
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def wrap_blur(array, radius):
+    """Blurs an image with a box filter that wraps round the edges, so a tiling image still tiles.
+
+    Each axis is summed once with a running total, so the cost does not grow with the radius.
+
+    Args:
+    - array (numpy.ndarray): The image of shape (height, width) or (height, width, channels).
+    - radius (int): The number of pixels on each side of the centre that are averaged.
+
+    Returns:
+    - numpy.ndarray: The blurred image as float32.
+    """
+    size = 2 * radius + 1
+    array = np.asarray(array, dtype=np.float32)
+    for axis in (0, 1):
+        # Pad with the far edge plus one leading zero-width slot for the running total
+        pad = [(0, 0)] * array.ndim
+        pad[axis] = (radius + 1, radius)
+        totals = np.cumsum(np.pad(array, pad, mode="wrap"), axis=axis, dtype=np.float32)
+        count = totals.shape[axis]
+        array = (np.take(totals, np.arange(size, count), axis=axis)
+                 - np.take(totals, np.arange(count - size), axis=axis)) / size
+    return array
+
+
+def derive_pbr_maps(pixels, normal_strength=PBR_NORMAL_STRENGTH, ao_strength=PBR_AO_STRENGTH):
+    """Derives PBR maps from an albedo texture.
+
+    Every filter wraps round the edges, so the maps of a tiling texture tile too.
+
+    Args:
+    - pixels (numpy.ndarray): The albedo as uint8 of shape (height, width, 3), e.g. from image_array().
+    - normal_strength (float): How steep the normal map makes the slopes of the height map.
+    - ao_strength (float): How dark the ambient occlusion map makes the dips of the height map.
+
+    Returns:
+    - dict: uint8 arrays for each name in PBR_MAPS. "normal" is a tangent space normal map
+      with green pointing up (OpenGL), the others are grey.
+    """
+    luma = np.asarray(pixels, dtype=np.float32)[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32) / 255
+    # Take away the broad shading so lighting baked into the albedo does not become a slope
+    height = wrap_blur(luma - wrap_blur(luma, max(1, max(luma.shape) // 8)), 1)
+    # Relief under one 8 bit level is rounding left by the blurs, so it is not stretched into slopes
+    height = (height - height.min()) / max(float(height.max() - height.min()), 1 / 255)
+
+    # Sobel slopes, rolling wraps the neighbours round the edges
+    across = np.roll(height, -1, axis=1) - np.roll(height, 1, axis=1)
+    across = (np.roll(across, -1, axis=0) + 2 * across + np.roll(across, 1, axis=0)) / 8
+    down = np.roll(height, -1, axis=0) - np.roll(height, 1, axis=0)
+    down = (np.roll(down, -1, axis=1) + 2 * down + np.roll(down, 1, axis=1)) / 8
+    # Image rows run down but the green channel points up
+    normal = np.stack([-across * normal_strength, down * normal_strength, np.ones_like(height)], axis=-1)
+    normal /= np.linalg.norm(normal, axis=-1, keepdims=True)
+
+    # Busy detail reads as rough, smooth areas as glossy
+    detail = wrap_blur(np.abs(height - wrap_blur(height, 2)), 2)
+    roughness = 0.4 + 0.6 * detail / max(float(detail.max()), 1 / 255)
+
+    # Points lower than their surroundings at a small and a large scale get less light
+    cavity = sum(np.maximum(wrap_blur(height, radius) - height, 0) for radius in (4, 16))
+    ao = np.clip(1 - ao_strength * cavity / 2, 0, 1)
+
+    def to_bytes(values):
+        """Converts values from 0 to 1 to uint8."""
+        return np.round(np.clip(values, 0, 1) * 255).astype(np.uint8)
+
+    return {
+        "height": to_bytes(height),
+        "normal": to_bytes((normal + 1) / 2),
+        "roughness": to_bytes(roughness),
+        "ao": to_bytes(ao),
+    }
+
+
+def save_pbr_maps(path, image_bytes=None, maps=PBR_MAPS, mip_layout=None, mip_filter=MIP_FILTER, container=None):
+    """Derives the PBR maps of a texture and saves each one next to it.
+
+    Meant to run in a worker process, see AsyncEngine.in_process().
+
+    Args:
+    - path (str): The texture file, e.g. "Texture0.png" saves "Texture0_normal.png" and so on.
+    - image_bytes (bytes): Optional PNG contents of the texture, read from path if not given.
+    - maps (tuple): The names of the maps to save, from PBR_MAPS.
+    - mip_layout (str): Optional layout from MIP_LAYOUTS to also save the mip levels of each map in.
+    - mip_filter (str): The filter from MIP_FILTERS the mip levels are made with.
+    - container (str): Optional "dds" or "ktx2" to also save each map block compressed with its
+      mip chain, in its format from PBR_MAP_FORMATS.
+
+    Returns:
+    - list: The path of each file saved.
+    """
+    if image_bytes is None:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+    derived = derive_pbr_maps(image_array(image_bytes))
+    stem = os.path.splitext(path)[0]
+    paths = []
+    for name in maps:
+        map_path = f"{stem}_{name}.png"
+        save_png(map_path, png_bytes(derived[name]))
+        paths.append(map_path)
+        # The maps hold data rather than colours, and normals must stay unit length
+        paths += save_levels(map_path, derived[name], mip_layout, mip_filter,
+                             PBR_MAP_FORMATS[name] if container is not None else None, container or "dds",
+                             srgb=False, normal=name == "normal")
+    return paths
+
+
+def srgb_to_linear(values):
+    """Converts sRGB values from 0 to 1 to linear light."""
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(values):
+    """Converts linear light values from 0 to 1 to sRGB."""
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * np.power(values, 1 / 2.4) - 0.055)
+
+
+def wrap_resample(values, axis, size, mip_filter=MIP_FILTER):
+    """Shrinks an image along one axis with a filter that wraps round the edges.
+
+    Each destination pixel is a weighted sum of the source pixels under the filter, with the
+    indices taken modulo the source size, so the result still tiles. The sum is done one filter
+    tap at a time over the whole image.
+
+    Args:
+    - values (numpy.ndarray): The float image.
+    - axis (int): The axis to shrink, 0 for rows and 1 for columns.
+    - size (int): The new size of the axis.
+    - mip_filter (str): "box" averages the source pixels each destination pixel covers, "kaiser"
+      is a sinc filter in a Kaiser window, which keeps the smaller levels sharper.
+
+    Returns:
+    - numpy.ndarray: The shrunk image.
+    """
+    count = values.shape[axis]
+    if size == count:
+        return values
+    scale = count / size
+    # Source position of each destination pixel centre
+    centres = (np.arange(size) + 0.5) * scale - 0.5
+    radius = scale / 2 if mip_filter == "box" else MIP_KAISER_RADIUS * scale
+    first = np.floor(centres - radius)
+    taps = first[:, None] + np.arange(int(np.ceil(2 * radius)) + 2)[None, :]
+    if mip_filter == "box":
+        # How much of each source pixel lies under the destination pixel
+        weights = np.clip(np.minimum(taps + 0.5, centres[:, None] + radius)
+                          - np.maximum(taps - 0.5, centres[:, None] - radius), 0, None)
+    elif mip_filter == "kaiser":
+        distance = (taps - centres[:, None]) / scale
+        window = np.clip(1 - (distance / MIP_KAISER_RADIUS) ** 2, 0, None)
+        weights = np.sinc(distance) * np.i0(MIP_KAISER_ALPHA * np.sqrt(window)) / np.i0(MIP_KAISER_ALPHA)
+        weights[window == 0] = 0
+    else:
+        raise ValueError(f"Unknown mip filter {mip_filter!r}, expected one of {', '.join(MIP_FILTERS)}")
+    weights /= weights.sum(axis=1, keepdims=True)
+    indices = taps.astype(np.intp) % count
+    # Line the weights up with the axis being shrunk
+    shape = [1] * values.ndim
+    shape[axis] = size
+    result = np.zeros(values.shape[:axis] + (size,) + values.shape[axis + 1:], dtype=np.float32)
+    for tap in range(taps.shape[1]):
+        result += np.take(values, indices[:, tap], axis=axis) * weights[:, tap].astype(np.float32).reshape(shape)
+    return result
+
+
+def mip_chain(pixels, mip_filter=MIP_FILTER, srgb=True, normal=False, max_level=None):
+    """Builds the full mip chain of an image, halving it down to 1x1 with filters that wrap round the edges.
+
+    Args:
+    - pixels (numpy.ndarray): uint8 pixels of shape (height, width) or (height, width, channels).
+    - mip_filter (str): The filter from MIP_FILTERS, see wrap_resample().
+    - srgb (bool): Whether the pixels are sRGB colours, which are averaged in linear light.
+    - normal (bool): Whether the pixels are a normal map, whose vectors are made unit length again.
+    - max_level (int): Optional last level to build, the chain stops there instead of at 1x1.
+
+    Returns:
+    - list: The uint8 pixels of each level, starting with pixels itself.
+    """
+    levels = [pixels]
+    values = pixels.astype(np.float32) / 255
+    if srgb:
+        values = srgb_to_linear(values)
+    while (values.shape[0] > 1 or values.shape[1] > 1) and (max_level is None or len(levels) <= max_level):
+        for axis in (0, 1):
+            values = wrap_resample(values, axis, max(1, values.shape[axis] // 2), mip_filter)
+        # The sinc filter can overshoot past black and white
+        values = np.clip(values, 0, 1)
+        if normal:
+            vectors = values[..., :3] * 2 - 1
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-6)
+            values[..., :3] = (vectors + 1) / 2
+        level = linear_to_srgb(values) if srgb else values
+        levels.append(np.round(level * 255).astype(np.uint8))
+    return levels
+
+
+def dds_bytes(levels):
+    """Packs uncompressed mip levels into a DDS file.
+
+    Args:
+    - levels (list): The uint8 pixels of each level, grey (height, width) or RGB (height, width, 3).
+
+    Returns:
+    - bytes: The DDS file, 8 bit luminance for grey levels and 32 bit BGRA otherwise.
+    """
+    height, width = levels[0].shape[:2]
+    grey = levels[0].ndim == 2
+    if grey:
+        # DDPF_LUMINANCE with an 8 bit red mask
+        pixel_format = struct.pack("<II4sIIIII", 32, 0x20000, b"\0\0\0\0", 8, 0xFF, 0, 0, 0)
+        data = [level.tobytes() for level in levels]
+    else:
+        # DDPF_RGB | DDPF_ALPHAPIXELS, stored as B, G, R, A bytes
+        pixel_format = struct.pack("<II4sIIIII", 32, 0x41, b"\0\0\0\0", 32,
+                                   0x00FF0000, 0x0000FF00, 0x000000FF, 0xFF000000)
+        data = []
+        for level in levels:
+            bgra = np.full(level.shape[:2] + (4,), 255, dtype=np.uint8)
+            bgra[..., :3] = level[..., 2::-1]
+            data.append(bgra.tobytes())
+    # DDSD_PITCH, the row size of the first level
+    header = dds_header(width, height, len(levels), pixel_format, 0x8, width * (1 if grey else 4))
+    return header + b"".join(data)
+
+
+def dds_header(width, height, level_count, pixel_format, size_flag, size):
+    """Builds the header of a DDS file.
+
+    Args:
+    - width (int): The width of the first level.
+    - height (int): The height of the first level.
+    - level_count (int): The number of mip levels.
+    - pixel_format (bytes): The 32 byte DDS_PIXELFORMAT.
+    - size_flag (int): 0x8 (DDSD_PITCH) for uncompressed data or 0x80000 (DDSD_LINEARSIZE) for blocks.
+    - size (int): The row size or the byte size of the first level, to match size_flag.
+
+    Returns:
+    - bytes: The magic number and the 124 byte DDS_HEADER.
+    """
+    # CAPS | HEIGHT | WIDTH | PIXELFORMAT | MIPMAPCOUNT
+    flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x20000 | size_flag
+    # TEXTURE | MIPMAP | COMPLEX
+    caps = 0x1000 | 0x400000 | 0x8
+    return (struct.pack("<4sIIIIIII", b"DDS ", 124, flags, height, width, size, 0, level_count)
+            + b"\0" * 44 + pixel_format + struct.pack("<IIIII", caps, 0, 0, 0, 0))
+
+
+def save_mip_levels(path, levels, layout="files"):
+    """Saves mip levels next to their image.
+
+    Args:
+    - path (str): The image file, e.g. "Texture0.png".
+    - levels (list): The uint8 pixels of each level, see mip_chain().
+    - layout (str): "files" saves level 1 and smaller as Texture0_mip1.png, Texture0_mip2.png, ...
+      "dds" saves every level, the image included, in Texture0.dds.
+
+    Returns:
+    - list: The path of each file saved.
+    """
+    stem = os.path.splitext(path)[0]
+    if layout == "dds":
+        save_png(f"{stem}.dds", dds_bytes(levels))
+        return [f"{stem}.dds"]
+    if layout != "files":
+        raise ValueError(f"Unknown mip layout {layout!r}, expected one of {', '.join(MIP_LAYOUTS)}")
+    paths = []
+    for index, level in enumerate(levels[1:], 1):
+        paths.append(f"{stem}_mip{index}.png")
+        save_png(paths[-1], png_bytes(level))
+    return paths
+
+
+def texel_blocks(pixels):
+    """Splits an image into the 4x4 blocks GPUs compress, wrapping round to fill the last ones.
+
+    Args:
+    - pixels (numpy.ndarray): The image of shape (height, width, channels).
+
+    Returns:
+    - numpy.ndarray: float32 blocks of shape (rows, columns, 16, channels), pixels in row order.
+    """
+    height, width, channels = pixels.shape
+    # Levels smaller than a block repeat like the texture would
+    pixels = np.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="wrap")
+    rows, columns = pixels.shape[0] // 4, pixels.shape[1] // 4
+    return (pixels.reshape(rows, 4, columns, 4, channels).transpose(0, 2, 1, 3, 4)
+            .reshape(rows, columns, 16, channels).astype(np.float32))
+
+
+def block_endpoints(blocks):
+    """Picks the two ends of the line that best fits the colours of each block.
+
+    The line runs along the block's main axis, found by power iteration on its covariance.
+
+    Args:
+    - blocks (numpy.ndarray): The blocks of shape (..., 16, channels).
+
+    Returns:
+    - tuple: (start, end) of shape (..., channels), the extremes of the pixels along the line.
+    """
+    mean = blocks.mean(axis=-2)
+    centred = blocks - mean[..., None, :]
+    covariance = np.einsum("...pi,...pj->...ij", centred, centred)
+    # Start from the channel that varies most, so the iteration never starts square to the axis
+    strongest = np.argmax(np.einsum("...ii->...i", covariance), axis=-1)
+    axis = np.take_along_axis(covariance, strongest[..., None, None], axis=-2)[..., 0, :]
+    for _ in range(4):
+        axis = axis / np.maximum(np.linalg.norm(axis, axis=-1, keepdims=True), 1e-6)
+        axis = np.einsum("...ij,...j->...i", covariance, axis)
+    axis = axis / np.maximum(np.linalg.norm(axis, axis=-1, keepdims=True), 1e-6)
+    along = np.einsum("...pi,...i->...p", centred, axis)
+    start = mean + along.min(axis=-1)[..., None] * axis
+    end = mean + along.max(axis=-1)[..., None] * axis
+    return np.clip(start, 0, 255), np.clip(end, 0, 255)
+
+
+def line_positions(blocks, start, end):
+    """Returns where each pixel falls on the line between two endpoints, 0 at start and 1 at end.
+
+    Every palette of a block format lies on that line, so rounding the position picks the
+    nearest palette entry.
+    """
+    direction = end - start
+    length = np.maximum(np.einsum("...i,...i->...", direction, direction), 1e-6)
+    along = np.einsum("...pi,...i->...p", blocks - start[..., None, :], direction) / length[..., None]
+    return np.clip(along, 0, 1)
+
+
+def packed_bytes(fields):
+    """Packs little endian fields of every block side by side.
+
+    Args:
+    - fields (list): (values, dtype) pairs, each values array of shape (...).
+
+    Returns:
+    - numpy.ndarray: uint8 array of shape (..., total bytes).
+    """
+    return np.concatenate([np.ascontiguousarray(values.astype(dtype)[..., None]).view(np.uint8)
+                           for values, dtype in fields], axis=-1)
+
+
+def bc4_blocks(values):
+    """Encodes one channel per block as BC4, the format BC3 alpha and BC5 use too.
+
+    Args:
+    - values (numpy.ndarray): Blocks of shape (..., 16) from 0 to 255.
+
+    Returns:
+    - numpy.ndarray: uint8 blocks of shape (..., 8).
+    """
+    high = np.rint(values.max(axis=-1))
+    low = np.rint(values.min(axis=-1))
+    # high > low picks the eight value palette: high, low and six steps from high to low
+    steps = np.rint((high[..., None] - values) / np.maximum(high - low, 1)[..., None] * 7).astype(np.uint64)
+    indices = np.array([0, 2, 3, 4, 5, 6, 7, 1], dtype=np.uint64)[steps]
+    bits = (indices << (np.arange(16, dtype=np.uint64) * 3)).sum(axis=-1, dtype=np.uint64)
+    return np.concatenate([packed_bytes([(high, np.uint8), (low, np.uint8)]),
+                           packed_bytes([(bits, "<u8")])[..., :6]], axis=-1)
+
+
+def bc1_blocks(colours):
+    """Encodes the colours of each block as BC1, the format BC3 colour uses too.
+
+    Args:
+    - colours (numpy.ndarray): Blocks of shape (..., 16, 3) from 0 to 255.
+
+    Returns:
+    - numpy.ndarray: uint8 blocks of shape (..., 8).
+    """
+    start, end = block_endpoints(colours)
+
+    def rgb565(colour):
+        """Returns the 16 bit value of a colour and the colour the GPU decodes from it."""
+        r, g, b = (np.rint(colour[..., 0] * 31 / 255), np.rint(colour[..., 1] * 63 / 255),
+                   np.rint(colour[..., 2] * 31 / 255))
+        decoded = np.stack([r * 255 / 31, g * 255 / 63, b * 255 / 31], axis=-1)
+        return r * 2048 + g * 32 + b, decoded
+
+    value0, colour0 = rgb565(end)
+    value1, colour1 = rgb565(start)
+    # The first endpoint must be the larger one to get the four colour palette
+    swap = value0 < value1
+    value0, value1 = np.where(swap, value1, value0), np.where(swap, value0, value1)
+    colour0, colour1 = (np.where(swap[..., None], colour1, colour0),
+                        np.where(swap[..., None], colour0, colour1))
+    steps = np.rint(line_positions(colours, colour0, colour1) * 3).astype(np.uint32)
+    # The palette is colour0, colour1, then the two thirds between them
+    indices = np.array([0, 2, 3, 1], dtype=np.uint32)[steps]
+    indices[value0 == value1] = 0
+    bits = (indices << (np.arange(16, dtype=np.uint32) * 2)).sum(axis=-1, dtype=np.uint32)
+    return packed_bytes([(value0, "<u2"), (value1, "<u2"), (bits, "<u4")])
+
+
+# Interpolation weights out of 64 of the 16 entry BC7 palette
+BC7_WEIGHTS = (0, 4, 9, 13, 17, 21, 26, 30, 34, 38, 43, 47, 51, 55, 60, 64)
+
+
+def bc7_blocks(colours):
+    """Encodes each block as BC7 mode 6, one RGBA line with 7 bit endpoints and 4 bit indices.
+
+    Mode 6 alone is a "lite" BC7 encoder: it never splits a block into subsets, but it is far
+    sharper than BC1 on smooth colours and fast enough to run on whole images at once.
+
+    Args:
+    - colours (numpy.ndarray): Blocks of shape (..., 16, 4) from 0 to 255.
+
+    Returns:
+    - numpy.ndarray: uint8 blocks of shape (..., 16).
+    """
+    start, end = block_endpoints(colours)
+
+    def quantize(endpoint):
+        """Splits an 8 bit RGBA endpoint into 7 bit values and the shared low bit that fits best."""
+        best = None
+        for p_bit in (0, 1):
+            values = np.clip(np.rint((endpoint - p_bit) / 2), 0, 127)
+            # Alpha counts for more, so opaque textures decode as fully opaque
+            error = ((values * 2 + p_bit - endpoint) ** 2 * np.array([1, 1, 1, 8])).sum(axis=-1)
+            if best is None:
+                best = (values, np.full(error.shape, p_bit, dtype=np.float64), error)
+            else:
+                better = error < best[2]
+                best = (np.where(better[..., None], values, best[0]), np.where(better, p_bit, best[1]),
+                        np.minimum(error, best[2]))
+        return best[0], best[1]
+
+    values0, p_bit0 = quantize(start)
+    values1, p_bit1 = quantize(end)
+    along = line_positions(colours, values0 * 2 + p_bit0[..., None], values1 * 2 + p_bit1[..., None])
+    weights = np.array(BC7_WEIGHTS, dtype=np.float32) / 64
+    indices = np.abs(along[..., None] - weights).argmin(axis=-1).astype(np.uint64)
+    # The first pixel's index is stored with 3 bits, so flip the line when its top bit is set
+    flip = indices[..., 0] >= 8
+    values0, values1 = np.where(flip[..., None], values1, values0), np.where(flip[..., None], values0, values1)
+    p_bit0, p_bit1 = np.where(flip, p_bit1, p_bit0), np.where(flip, p_bit0, p_bit1)
+    indices = np.where(flip[..., None], 15 - indices, indices)
+
+    # Mode 6 is six 0 bits then a 1, then R0 R1 G0 G1 B0 B1 A0 A1, the p-bits and the indices
+    fields = [(np.full(flip.shape, 1 << 6), 7)]
+    for channel in range(4):
+        fields += [(values0[..., channel], 7), (values1[..., channel], 7)]
+    fields += [(p_bit0, 1), (p_bit1, 1), (indices[..., 0], 3)]
+    fields += [(indices[..., pixel], 4) for pixel in range(1, 16)]
+    low = np.zeros(flip.shape, dtype=np.uint64)
+    high = np.zeros(flip.shape, dtype=np.uint64)
+    offset = 0
+    for values, count in fields:
+        values = values.astype(np.uint64)
+        if offset < 64:
+            low |= values << np.uint64(offset)
+        if offset + count > 64:
+            high |= (values >> np.uint64(64 - offset)) if offset < 64 else values << np.uint64(offset - 64)
+        offset += count
+    return packed_bytes([(low, "<u8"), (high, "<u8")])
+
+
+def encode_blocks(pixels, block_format):
+    """Block compresses an image for the GPU.
+
+    Args:
+    - pixels (numpy.ndarray): uint8 pixels of shape (height, width) or (height, width, channels).
+    - block_format (str): The format from BLOCK_FORMATS. BC4 keeps the first channel and BC5
+      the first two, the others keep RGB and BC3 and BC7 keep alpha too, opaque when missing.
+
+    Returns:
+    - bytes: The blocks in row order.
+    """
+    if pixels.ndim == 2:
+        pixels = pixels[..., None]
+    if block_format in ("bc3", "bc7") and pixels.shape[-1] < 4:
+        colour = pixels if pixels.shape[-1] == 3 else np.repeat(pixels[..., :1], 3, axis=-1)
+        pixels = np.concatenate([colour, np.full(pixels.shape[:2] + (1,), 255, dtype=np.uint8)], axis=-1)
+    elif block_format == "bc1" and pixels.shape[-1] < 3:
+        pixels = np.repeat(pixels[..., :1], 3, axis=-1)
+    blocks = texel_blocks(pixels)
+    if block_format == "bc1":
+        data = bc1_blocks(blocks[..., :3])
+    elif block_format == "bc3":
+        data = np.concatenate([bc4_blocks(blocks[..., 3]), bc1_blocks(blocks[..., :3])], axis=-1)
+    elif block_format == "bc4":
+        data = bc4_blocks(blocks[..., 0])
+    elif block_format == "bc5":
+        data = np.concatenate([bc4_blocks(blocks[..., 0]), bc4_blocks(blocks[..., 1])], axis=-1)
+    elif block_format == "bc7":
+        data = bc7_blocks(blocks)
+    else:
+        raise ValueError(f"Unknown block format {block_format!r}, expected one of {', '.join(BLOCK_FORMATS)}")
+    return data.tobytes()
+
+
+def dds_block_bytes(width, height, layers, block_format, srgb):
+    """Packs block compressed mip levels into a DDS file with a DX10 header.
+
+    Args:
+    - width (int): The width of the first level.
+    - height (int): The height of the first level.
+    - layers (list): The encoded blocks of each level, see encode_blocks(), for each layer.
+      More than one layer makes a texture array.
+    - block_format (str): The format from BLOCK_FORMATS.
+    - srgb (bool): Whether the texture holds sRGB colours.
+
+    Returns:
+    - bytes: The DDS file.
+    """
+    # DDPF_FOURCC "DX10", the real format is in the extra header
+    pixel_format = struct.pack("<II4sIIIII", 32, 0x4, b"DX10", 0, 0, 0, 0, 0)
+    # DXGI format, 2D texture, no flags, the array size, no alpha mode flags
+    dx10 = struct.pack("<IIIII", BLOCK_FORMATS[block_format]["dxgi"][srgb], 3, 0, len(layers), 0)
+    # DDSD_LINEARSIZE, the byte size of the first level. Each layer is stored with all its levels
+    return (dds_header(width, height, len(layers[0]), pixel_format, 0x80000, len(layers[0][0])) + dx10
+            + b"".join(b"".join(levels) for levels in layers))
+
+
+def ktx2_bytes(width, height, layers, block_format, srgb):
+    """Packs block compressed mip levels into a KTX2 file.
+
+    Args:
+    - width (int): The width of the first level.
+    - height (int): The height of the first level.
+    - layers (list): The encoded blocks of each level, see encode_blocks(), for each layer.
+      More than one layer makes a texture array.
+    - block_format (str): The format from BLOCK_FORMATS.
+    - srgb (bool): Whether the texture holds sRGB colours.
+
+    Returns:
+    - bytes: The KTX2 file.
+    """
+    info = BLOCK_FORMATS[block_format]
+    # Each level holds that level of every layer
+    levels = [b"".join(level) for level in zip(*layers)]
+    # The data format descriptor: a basic block with one 16 byte sample per part of the block
+    samples = b""
+    for bit_offset, bit_length, channel in info["samples"]:
+        # Alpha stays linear in an sRGB texture
+        if srgb and channel == 15:
+            channel |= 0x10
+        samples += struct.pack("<HBB4BII", bit_offset, bit_length, channel, 0, 0, 0, 0, 0, 0xFFFFFFFF)
+    block_size = 24 + len(samples)
+    dfd = (struct.pack("<IIHH", 4 + block_size, 0, 2, block_size)
+           # Colour model, BT.709 primaries, sRGB or linear transfer, straight alpha
+           + struct.pack("<BBBB", info["model"], 1, 2 if srgb else 1, 0)
+           # 4x4x1x1 texels per block, bytes per block in the first plane
+           + struct.pack("<4B8B", 3, 3, 0, 0, info["block"], 0, 0, 0, 0, 0, 0, 0) + samples)
+    level_index_size = 24 * len(levels)
+    dfd_offset = 80 + level_index_size
+    # Levels are stored smallest first, each aligned to a whole block
+    offset = dfd_offset + len(dfd)
+    placed = [None] * len(levels)
+    data = b""
+    for index in reversed(range(len(levels))):
+        padding = -(offset + len(data)) % info["block"]
+        data += b"\0" * padding
+        placed[index] = (offset + len(data), len(levels[index]))
+        data += levels[index]
+    header = (b"\xabKTX 20\xbb\r\n\x1a\n"
+              # A layer count of 0 means the texture is not an array
+              + struct.pack("<IIIIIIIII", info["vk"][srgb], 1, width, height, 0,
+                            len(layers) if len(layers) > 1 else 0, 1, len(levels), 0)
+              + struct.pack("<IIIIQQ", dfd_offset, len(dfd), 0, 0, 0, 0))
+    level_index = b"".join(struct.pack("<QQQ", start, length, length) for start, length in placed)
+    return header + level_index + dfd + data
+
+
+def save_compressed(path, layers, block_format, container="dds", srgb=True):
+    """Block compresses mip levels and saves them in one file next to their image.
+
+    Args:
+    - path (str): The image file, e.g. "Texture0.png" saves "Texture0_bc7.dds".
+    - layers (list): The uint8 pixels of each level, see mip_chain(), for each layer. More than
+      one layer makes a texture array.
+    - block_format (str): The format from BLOCK_FORMATS.
+    - container (str): "dds" or "ktx2".
+    - srgb (bool): Whether the image holds sRGB colours rather than data.
+
+    Returns:
+    - str: The path of the file saved.
+    """
+    height, width = layers[0][0].shape[:2]
+    encoded = [[encode_blocks(level, block_format) for level in levels] for levels in layers]
+    if container == "dds":
+        data = dds_block_bytes(width, height, encoded, block_format, srgb)
+    elif container == "ktx2":
+        data = ktx2_bytes(width, height, encoded, block_format, srgb)
+    else:
+        raise ValueError(f"Unknown container {container!r}, expected one of {', '.join(CONTAINERS)}")
+    out_path = f"{os.path.splitext(path)[0]}_{block_format}.{container}"
+    save_png(out_path, data)
+    return out_path
+
+
+def save_levels(path, pixels, layout=None, mip_filter=MIP_FILTER, block_format=None, container="dds",
+                srgb=True, normal=False, max_level=None):
+    """Builds the mip chain of an image and saves it next to the image, uncompressed, block compressed or both.
+
+    Args:
+    - path (str): The image file the saved files are named after.
+    - pixels (numpy.ndarray): The uint8 pixels of the image.
+    - layout (str): How the uncompressed levels are saved, see save_mip_levels(), or None to not save them.
+    - mip_filter (str): The filter from MIP_FILTERS the levels are made with.
+    - block_format (str): Optional format from BLOCK_FORMATS to also save the chain in, see save_compressed().
+    - container (str): The file the block compressed chain is saved in, "dds" or "ktx2".
+    - srgb (bool): Whether the pixels are sRGB colours rather than data.
+    - normal (bool): Whether the pixels are a normal map.
+    - max_level (int): Optional last level of the chain, see mip_chain().
+
+    Returns:
+    - list: The path of each file saved.
+    """
+    if layout is None and block_format is None:
+        return []
+    levels = mip_chain(pixels, mip_filter, srgb=srgb, normal=normal, max_level=max_level)
+    paths = save_mip_levels(path, levels, layout) if layout is not None else []
+    if block_format is not None:
+        paths.append(save_compressed(path, [levels], block_format, container, srgb))
+    return paths
+
+
+def save_mips(path, image_bytes=None, layout="files", mip_filter=MIP_FILTER, block_format=None, container="dds"):
+    """Builds the mip chain of a texture and saves it next to the texture, uncompressed, block compressed or both.
+
+    Meant to run in a worker process, see AsyncEngine.in_process().
+
+    Args:
+    - path (str): The texture file.
+    - image_bytes (bytes): Optional PNG contents of the texture, read from path if not given.
+    - layout (str): How the uncompressed levels are saved, see save_mip_levels(), or None to not save them.
+    - mip_filter (str): The filter from MIP_FILTERS the levels are made with.
+    - block_format (str): Optional format from BLOCK_FORMATS to also save the chain in, see save_compressed().
+    - container (str): The file the block compressed chain is saved in, "dds" or "ktx2".
+
+    Returns:
+    - list: The path of each file saved.
+    """
+    if image_bytes is None:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+    return save_levels(path, image_array(image_bytes), layout, mip_filter, block_format, container)
+
+
+def export_file(path, block_format="bc7", container="dds", mip_filter=MIP_FILTER):
+    """Exports a saved texture or PBR map block compressed with its mip chain.
+
+    Meant to run in a worker process, see AsyncEngine.in_process().
+
+    Args:
+    - path (str): The PNG file. Files named like PBR maps, e.g. "Texture0_normal.png", are
+      exported as data in their format from PBR_MAP_FORMATS.
+    - block_format (str): The format from COLOR_FORMATS for colour textures.
+    - container (str): "dds" or "ktx2".
+    - mip_filter (str): The filter from MIP_FILTERS the levels are made with.
+
+    Returns:
+    - str: The path of the file saved.
+    """
+    for name, map_format in PBR_MAP_FORMATS.items():
+        if path.endswith(f"_{name}.png"):
+            return save_levels(path, read_map(path, name), None, mip_filter, map_format, container,
+                               srgb=False, normal=name == "normal")[0]
+    return save_mips(path, None, None, mip_filter, block_format, container)[0]
+
+
+def build_atlas(tiles, gutter=ATLAS_GUTTER):
+    """Packs tiles of the same size into a grid, each framed by a gutter of its own wrapped edges.
+
+    The atlas is allocated once and each tile is copied straight into its cell, the gutters are
+    filled by copying rows and columns within the cell. Sampling a tile with wrapped UVs at its
+    edge then reads the tile's far side from the gutter instead of the next tile.
+
+    Args:
+    - tiles (list): uint8 pixels of each tile, all of the same shape.
+    - gutter (int): The gutter width in pixels, at most the tile size.
+
+    Returns:
+    - tuple: (atlas, rects) where rects holds the (left, top, width, height) of each tile.
+
+    Raises:
+    - ValueError: If the tiles differ in size or channels.
+    """
+    shape = tiles[0].shape
+    if any(tile.shape != shape for tile in tiles):
+        raise ValueError("Every texture in an atlas must have the same size and channels")
+    height, width = shape[:2]
+    gutter = max(0, min(gutter, height, width))
+    columns = int(np.ceil(np.sqrt(len(tiles))))
+    rows = -(-len(tiles) // columns)
+    cell_height, cell_width = height + 2 * gutter, width + 2 * gutter
+    atlas = np.zeros((rows * cell_height, columns * cell_width) + shape[2:], dtype=np.uint8)
+    rects = []
+    for index, tile in enumerate(tiles):
+        top = index // columns * cell_height
+        left = index % columns * cell_width
+        cell = atlas[top:top + cell_height, left:left + cell_width]
+        cell[gutter:gutter + height, gutter:gutter + width] = tile
+        if gutter:
+            # Above the tile goes its bottom, below it its top
+            cell[:gutter, gutter:gutter + width] = tile[-gutter:]
+            cell[gutter + height:, gutter:gutter + width] = tile[:gutter]
+            # Then the side gutters, corners included, from the columns just filled
+            cell[:, :gutter] = cell[:, width:width + gutter]
+            cell[:, gutter + width:] = cell[:, gutter:2 * gutter]
+        rects.append((left + gutter, top + gutter, width, height))
+    return atlas, rects
+
+
+def atlas_max_mip_level(gutter, mip_filter=MIP_FILTER):
+    """Returns the last mip level of an atlas at which filtering still stays inside each tile's gutter.
+
+    A box filter only averages the 2**level atlas pixels under each pixel of a level. The
+    Kaiser filter reaches MIP_KAISER_RADIUS pixels of each level either side, which with the
+    levels before it adds up to about MIP_KAISER_RADIUS * 2**level atlas pixels.
+
+    Args:
+    - gutter (int): The gutter width in pixels.
+    - mip_filter (str): The filter from MIP_FILTERS the levels are made with.
+
+    Returns:
+    - int: The level, 0 when even the first smaller level would bleed in a neighbour.
+    """
+    reach = 1 if mip_filter == "box" else MIP_KAISER_RADIUS
+    level = 0
+    while reach * 2 ** (level + 1) <= gutter:
+        level += 1
+    return level
+
+
+def save_atlas(folder, tiles, maps=(), gutter=ATLAS_GUTTER, mip_layout=None, mip_filter=MIP_FILTER,
+               block_format=None, container="dds", array_format=None, atlas=True):
+    """Packs a texture set, and the PBR maps saved next to it, into atlases with a JSON UV manifest.
+
+    Meant to run in a worker process, see AsyncEngine.in_process().
+
+    Saves ATLAS_NAME.png, ATLAS_NAME_<map>.png for each map and ATLAS_NAME.json in folder. The
+    manifest lists each tile's pixel rect and its UVs, with (0, 0) at the top left corner. The
+    mip chains of the atlases stop at atlas_max_mip_level(), below which tiles would bleed.
+    Without atlas only the texture arrays are saved, with an ARRAY_NAME.json manifest listing
+    the array files and each tile's layer.
+
+    Args:
+    - folder (str): The folder of the set.
+    - tiles (list): (name, path, image_bytes) of each texture, image_bytes may be None to read path.
+    - maps (tuple): Names from PBR_MAPS whose maps, e.g. "Texture0_normal.png", are packed too.
+    - gutter (int): The gutter width in pixels.
+    - mip_layout (str): Optional layout from MIP_LAYOUTS to also save the mip chain of each atlas in.
+    - mip_filter (str): The filter from MIP_FILTERS the mip levels are made with.
+    - block_format (str): Optional format from COLOR_FORMATS to also export each atlas in.
+    - container (str): The file exported atlases and texture arrays are saved in, "dds" or "ktx2".
+    - array_format (str): Optional format from COLOR_FORMATS to also save the set as a texture
+      array, one layer per texture with its mip chain. The maps use PBR_MAP_FORMATS.
+    - atlas (bool): Whether to save the atlases, False saves only the texture arrays.
+
+    Returns:
+    - list: The path of each file saved, the manifest last.
+    """
+    if not atlas and array_format is None:
+        return []
+    stem = os.path.join(folder, ATLAS_NAME if atlas else ARRAY_NAME)
+    pages = [(None, [image_array(image_bytes) if image_bytes is not None else read_map(path, None)
+                     for _, path, image_bytes in tiles])]
+    for name in maps:
+        pages.append((name, [read_map(f"{os.path.splitext(path)[0]}_{name}.png", name) for _, path, _ in tiles]))
+    paths = []
+    max_level = atlas_max_mip_level(gutter, mip_filter)
+    manifest = {"gutter": gutter, "origin": "top-left", "files": {}, "arrays": {}} if atlas else {"arrays": {}}
+    for name, pixels in pages:
+        # Colours are averaged in linear light, maps as data
+        colour = name is None
+        if atlas:
+            page_path = stem + (f"_{name}" if name else "") + ".png"
+            page, rects = build_atlas(pixels, gutter)
+            save_png(page_path, png_bytes(page))
+            paths.append(page_path)
+            manifest["files"][name or "color"] = os.path.basename(page_path)
+            page_format = block_format if colour else PBR_MAP_FORMATS[name]
+            paths += save_levels(page_path, page, mip_layout, mip_filter,
+                                 page_format if block_format is not None else None, container,
+                                 srgb=colour, normal=name == "normal", max_level=max_level)
+        if array_format is not None:
+            # Stack the layers in one buffer, then give each its own mip chain
+            stack = np.empty((len(pixels),) + pixels[0].shape, dtype=np.uint8)
+            for index, layer in enumerate(pixels):
+                stack[index] = layer
+            array_path = os.path.join(folder, ARRAY_NAME + (f"_{name}" if name else "") + ".png")
+            paths.append(save_compressed(array_path, [mip_chain(layer, mip_filter, srgb=colour, normal=name == "normal")
+                                                      for layer in stack],
+                                         array_format if colour else PBR_MAP_FORMATS[name], container, srgb=colour))
+            manifest["arrays"][name or "color"] = os.path.basename(paths[-1])
+    manifest["tiles"] = [{"name": name, "file": os.path.basename(path), "layer": index}
+                         for index, (name, path, _) in enumerate(tiles)]
+    if atlas:
+        atlas_height, atlas_width = page.shape[:2]
+        manifest["size"] = [atlas_width, atlas_height]
+        # Below this level filtering reaches the next tile, the saved chains stop here
+        manifest["max_mip_level"] = max_level
+        for tile, rect in zip(manifest["tiles"], rects):
+            tile["rect"] = list(rect)
+            tile["uv"] = [rect[0] / atlas_width, rect[1] / atlas_height,
+                          (rect[0] + rect[2]) / atlas_width, (rect[1] + rect[3]) / atlas_height]
+    with open(stem + ".json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    paths.append(stem + ".json")
+    return paths
+
+
+def read_map(path, name):
+    """Reads a saved PBR map.
+
+    Args:
+    - path (str): The map file.
+    - name (str): The map's name from PBR_MAPS, or None for a colour texture.
+
+    Returns:
+    - numpy.ndarray: uint8 pixels, RGB for colour textures and the normal map and grey otherwise,
+      as image_array() and derive_pbr_maps() make them.
+    """
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGB" if name in (None, "normal") else "L"))
+
+
+def normalize_payload(value):
+    """Normalizes a txt2img payload so equal requests hash the same.
+
+    Args:
+    - value: The payload or one of its values.
+
+    Returns:
+    - The normalized value. Whole floats become ints and strings are stripped.
+    """
+    if isinstance(value, dict):
+        return {key: normalize_payload(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_payload(item) for item in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+class TextureCache:
+    """Class that stores generated textures on disk by a hash of the request that made them.
+
+    Each entry is one PNG file named after the key. The least recently used entries are
+    removed when the cache grows past max_bytes.
+
+    Attributes:
+    - path (str): The cache folder.
+    - max_bytes (int): The largest size of the cache.
+    - hits (int): The number of lookups that found a texture.
+    - misses (int): The number of lookups that did not.
+
+    Methods:
+    - key(payload, checkpoint): Returns the cache key for a request.
+    - get(key): Returns the cached PNG for a key.
+    - put(key, data): Stores a PNG under a key.
+    """
+
+    def __init__(self, path, max_bytes=TEXTURE_CACHE_MAX_BYTES):
+        """Initializes the TextureCache object.
+
+        Args:
+        - path (str): The cache folder, created if it does not exist.
+        - max_bytes (int): The largest size of the cache.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        # Rebuild the LRU order from the file times, oldest first
+        entries = []
+        for entry in os.scandir(path):
+            if entry.is_file() and entry.name.endswith(".png"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        self._entries = collections.OrderedDict(
+            (key, size) for _, key, size in sorted(entries))
+        self._size = sum(self._entries.values())
+
+    @staticmethod
+    def key(payload, checkpoint):
+        """Returns the cache key for a request.
+
+        Args:
+        - payload (dict): The txt2img payload.
+        - checkpoint (str): The checkpoint title, which includes the model hash.
+
+        Returns:
+        - str: The hex SHA-256 of the normalized payload and checkpoint.
+        """
+        text = json.dumps({"payload": normalize_payload(payload), "checkpoint": checkpoint},
+                          sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        """Returns the path of the file for a key."""
+        return os.path.join(self.path, f"{key}.png")
+
+    def get(self, key):
+        """Returns the cached PNG for a key.
+
+        Args:
+        - key (str): The cache key.
+
+        Returns:
+        - bytes: The PNG file contents, or None if the key is not cached.
+        """
+        with self._lock:
+            cached = key in self._entries
+            if cached:
+                self._entries.move_to_end(key)
+        data = None
+        if cached:
+            try:
+                with open(self._file(key), "rb") as f:
+                    data = f.read()
+                # Mark the entry as used so the order survives a restart
+                os.utime(self._file(key))
+            except OSError:
+                data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Stores a PNG under a key, removing the least recently used entries if the cache is full.
+
+        Args:
+        - key (str): The cache key.
+        - data (bytes): The PNG file contents.
+        """
+        # Write to a temporary file and rename it so a crash never leaves half a PNG
+        fd, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._file(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        evicted = []
+        with self._lock:
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._file(old_key))
+            except OSError:
+                pass
+
+
+# Shared texture caches, one per cache folder
+_texture_caches = {}
+_texture_caches_lock = threading.Lock()
+
+
+def get_texture_cache():
+    """Returns the shared TextureCache for config.folder_path, creating it on first use.
+
+    Returns:
+    - TextureCache: The shared cache, or None if caching is turned off.
+    """
+    if not config.texture_cache:
+        return None
+    path = config.texture_cache_path()
+    with _texture_caches_lock:
+        if path not in _texture_caches:
+            _texture_caches[path] = TextureCache(path, config.texture_cache_max_bytes)
+        return _texture_caches[path]
+
+
+def is_texture_file(path):
+    """Checks if a file is a saved texture rather than a file made from one.
+
+    Args:
+    - path (str): The file.
+
+    Returns:
+    - bool: True for PNG files other than PBR maps, mip levels and atlases.
+    """
+    name, extension = os.path.splitext(os.path.basename(path))
+    if extension.lower() != ".png" or name == ATLAS_NAME or name.startswith(ATLAS_NAME + "_"):
+        return False
+    return not re.search(r"_(" + "|".join(PBR_MAPS) + r"|mip\d+)$", name)
+
+
+class HashIndex:
+    """Class that finds near-duplicate textures by the Hamming distance between their perceptual hashes.
+
+    Every texture saved under the folder is indexed the first time the index is used, and the
+    hashes are kept in an SQLite file with each file's size and time, so later runs only hash new
+    or changed files. The hashes are held as rows of 8 bytes in one NumPy array, so a lookup
+    XORs the query with every row at once and counts the differing bits with unpackbits.
+
+    Attributes:
+    - path (str): The SQLite file.
+    - folder (str): The folder whose textures are indexed.
+    - max_distance (int): The Hamming distance up to which two hashes count as duplicates.
+
+    Methods:
+    - scan(): Indexes the textures saved under folder that are new or changed.
+    - add(path, image_hash): Indexes or re-indexes one texture.
+    - remove(path): Drops one texture from the index.
+    - nearest(image_hash, exclude): Returns the indexed texture closest to a hash.
+    - check(path, image_hash, exclude): Returns the texture a new one duplicates, then indexes it.
+    """
+
+    def __init__(self, path, folder, max_distance=DEDUP_MAX_DISTANCE):
+        """Initializes the HashIndex object.
+
+        Args:
+        - path (str): The SQLite file, created if it does not exist.
+        - folder (str): The folder whose textures are indexed.
+        - max_distance (int): The Hamming distance up to which two hashes count as duplicates.
+        """
+        self.path = path
+        self.folder = folder
+        self.max_distance = max_distance
+        self._lock = threading.RLock()
+        self._scanned = False
+        # The indexed files, the row of each and the hashes, one row of 8 bytes per file
+        self._paths = []
+        self._rows = {}
+        self._hashes = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS hashes ("
+                       "path TEXT PRIMARY KEY, hash TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL)")
+
+    def _connect(self):
+        """Opens a connection to the SQLite file, one per call so threads never share one."""
+        import sqlite3
+        return contextlib.closing(sqlite3.connect(self.path, timeout=10, isolation_level=None))
+
+    def _put(self, path, image_hash):
+        """Sets the hash of a file in memory, growing the array when it is full."""
+        if self._hashes is None:
+            self._hashes = np.zeros((64, 8), dtype=np.uint8)
+        row = self._rows.get(path)
+        if row is None:
+            row = len(self._paths)
+            if row == len(self._hashes):
+                self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+            self._paths.append(path)
+            self._rows[path] = row
+        self._hashes[row] = np.frombuffer(image_hash.to_bytes(8, "big"), dtype=np.uint8)
+
+    def _drop(self, path):
+        """Drops a file from memory, moving the last row into its place."""
+        row = self._rows.pop(path, None)
+        if row is None:
+            return
+        last = self._paths.pop()
+        if last != path:
+            self._paths[row] = last
+            self._rows[last] = row
+            self._hashes[row] = self._hashes[len(self._paths)]
+
+    def scan(self):
+        """Indexes the textures saved under folder that are new or changed and forgets deleted ones.
+
+        Called by the first check() or nearest(). Decoding every texture of a large folder takes
+        a while the first time, so call it off the event loop.
+        """
+        with self._lock, self._connect() as db:
+            known = {path: (image_hash, size, mtime)
+                     for path, image_hash, size, mtime in db.execute("SELECT path, hash, size, mtime FROM hashes")}
+            found = set()
+            changed = []
+            for root, folders, files in os.walk(self.folder):
+                # Skip hidden folders such as the texture cache
+                folders[:] = [folder for folder in folders if not folder.startswith(".")]
+                for file in files:
+                    path = os.path.abspath(os.path.join(root, file))
+                    if not is_texture_file(path):
+                        continue
+                    try:
+                        stat = os.stat(path)
+                        entry = known.get(path)
+                        if entry is not None and entry[1:] == (stat.st_size, stat.st_mtime):
+                            image_hash = int(entry[0], 16)
+                        else:
+                            with open(path, "rb") as f:
+                                image_hash = perceptual_hash(image_array(f.read()))
+                            changed.append((path, f"{image_hash:016x}", stat.st_size, stat.st_mtime))
+                    except (OSError, ValueError):
+                        # Half written or not an image, it is indexed when it is saved
+                        continue
+                    found.add(path)
+                    self._put(path, image_hash)
+            db.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)", changed)
+            # Files that were deleted, including ones outside the folder the index was moved from
+            gone = [path for path in list(known) + self._paths if path not in found]
+            db.executemany("DELETE FROM hashes WHERE path = ?", [(path,) for path in gone])
+            for path in gone:
+                self._drop(path)
+            self._scanned = True
+
+    def add(self, path, image_hash):
+        """Indexes or re-indexes one texture.
+
+        Args:
+        - path (str): The saved texture.
+        - image_hash (int): Its perceptual_hash().
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            # Not saved yet, the next scan() hashes it again
+            size, mtime = -1, 0
+        with self._lock, self._connect() as db:
+            self._put(path, image_hash)
+            db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)", (path, f"{image_hash:016x}", size, mtime))
+
+    def remove(self, path):
+        """Drops one texture from the index.
+
+        Args:
+        - path (str): The texture.
+        """
+        path = os.path.abspath(path)
+        with self._lock, self._connect() as db:
+            self._drop(path)
+            db.execute("DELETE FROM hashes WHERE path = ?", (path,))
+
+    def nearest(self, image_hash, exclude=()):
+        """Returns the indexed texture closest to a hash.
+
+        Args:
+        - image_hash (int): The perceptual_hash() to look up.
+        - exclude (iterable): Textures to leave out, e.g. the ones the hash was made from.
+
+        Returns:
+        - tuple: (path, distance) of the closest texture, or None if no other texture is indexed.
+        """
+        query = np.frombuffer(image_hash.to_bytes(8, "big"), dtype=np.uint8)
+        with self._lock:
+            if not self._scanned:
+                self.scan()
+            count = len(self._paths)
+            if not count:
+                return None
+            distances = np.unpackbits(self._hashes[:count] ^ query, axis=1).sum(axis=1, dtype=np.int32)
+            for path in exclude:
+                row = self._rows.get(os.path.abspath(path))
+                if row is not None:
+                    distances[row] = 65
+            row = int(np.argmin(distances))
+            if distances[row] > 64:
+                return None
+            return self._paths[row], int(distances[row])
+
+    def check(self, path, image_hash, exclude=()):
+        """Returns the texture a new one duplicates, then indexes the new one.
+
+        Both happen under one lock, so of two duplicates saved at the same time the second is caught.
+
+        Args:
+        - path (str): The new texture.
+        - image_hash (int): Its perceptual_hash().
+        - exclude (iterable): Textures the new one may look like, e.g. its other variants.
+
+        Returns:
+        - str: The indexed texture within max_distance of the new one, or None if there is none.
+        """
+        with self._lock:
+            found = self.nearest(image_hash, [path, *exclude])
+            self.add(path, image_hash)
+        if found is not None and found[1] <= self.max_distance:
+            return found[0]
+        return None
+
+
+# Shared hash indexes, one per output folder
+_hash_indexes = {}
+_hash_indexes_lock = threading.Lock()
+
+
+def get_hash_index():
+    """Returns the shared HashIndex for config.folder_path, creating it on first use.
+
+    Returns:
+    - HashIndex: The shared index, or None if dedup is turned off.
+    """
+    if not config.dedup:
+        return None
+    path = config.hash_index_path()
+    with _hash_indexes_lock:
+        if path not in _hash_indexes:
+            _hash_indexes[path] = HashIndex(path, config.folder_path)
+        # The setting may change between runs
+        _hash_indexes[path].max_distance = config.dedup_max_distance
+        return _hash_indexes[path]
+
+
+class SDImageGenerator:
+    """Class that generates images using the Stable Diffusion model.
+
+    Attributes:
+    - file_name (str): The name of the output file.
+    - input (str): The input prompt for generating the image.
+    - client (SDClient): The client used to talk to the SD backend, or None to use the backend pool.
+    - active_client (SDClient): The client of the backend generating the image right now, if any.
+    - folder (str): The output folder, or None to use config.folder_path.
+    - seed (int): The seed, -1 for a random one.
+    - checkpoint (str): The SD checkpoint used to generate the image.
+    - cache (TextureCache): The cache of generated textures, or None to always generate.
+    - variants (int): The number of images made from the prompt in one batched request.
+    - profile (str): The name of the txt2img settings in SD_PROFILES.
+    - min_score (float): The tile score the best variant needs, or None to not score the images.
+    - retries (int): The number of times a texture that does not tile or is a duplicate is generated again.
+    - dedup (HashIndex): The index new textures are checked against, or None to not check them.
+    - source (str): The texture this one is meant to look like, never counted as its duplicate.
+    - cached (bool): Whether the last generate_image() call was served from the cache.
+    - progress (dict): The last progress SD reported for the image, see parse_progress().
+    - paths (list): The files saved by the last generate_image() call.
+    - images (list): The PNG bytes of each file in paths.
+    - seeds (list): The seed SD used for each file in paths, None where it is not known.
+    - scores (list): The tile score of each file in paths, empty when min_score is None.
+    - hashes (list): The perceptual_hash() of each file in paths, empty when dedup is None.
+    - duplicates (list): The saved texture each file in paths looks like, None where there is none.
+    - attempts (int): The number of times the last generate_image() call generated the texture.
+    - rejected (bool): Whether even the best attempt scored below min_score.
+    - duplicate (bool): Whether every variant of even the best attempt looks like a saved texture.
+
+    Methods:
+    - payload(): Returns the txt2img payload.
+    - file_names(): Returns the file name of each variant.
+    - refined(variant, profile): Returns a generator that renders one variant again with another profile.
+    - generate_image(can_swap, deadline, on_progress): Generates an image using the Stable Diffusion model.
+    - agenerate_image(can_swap, deadline, on_progress): Async version of generate_image().
+    - interrupt(): Asks the backend generating the image to stop.
+    """
+
+    def __init__(self, file_name, input, client=None, folder=None, seed=-1,
+                 checkpoint=SD_CHECKPOINT, cache=None, variants=1, profile=SD_PROFILE,
+                 min_score=None, retries=TILE_RETRIES, dedup=None, source=None):
+        """Initializes the SDImageGenerator object.
+
+        Args:
+        - file_name (str): The name of the output file.
+        - input (str): The input prompt for generating the image.
+        - client (SDClient): Optional client to use. Defaults to the least loaded backend in the shared pool.
+        - folder (str): Optional output folder. Defaults to config.folder_path.
+        - seed (int): The seed, -1 for a random one. Only fixed seeds can be served from the cache.
+        - checkpoint (str): The SD checkpoint used to generate the image.
+        - cache (TextureCache): Optional texture cache. Defaults to the shared cache for config.folder_path.
+        - variants (int): The number of images made from the prompt in one batched request. SD
+          gives them the seeds seed, seed + 1, ... and they are saved as file_name_v0, file_name_v1, ...
+        - profile (str): The name of the txt2img settings in SD_PROFILES.
+        - min_score (float): Optional tile score, see tile_scores(), the best variant needs. Each
+          score is stored in the PNG text under TILE_SCORE_KEY. Needs numpy and Pillow.
+        - retries (int): The number of times a texture scoring below min_score, or looking like
+          a texture already saved, is generated again.
+        - dedup (HashIndex): Optional index to check each image against. Defaults to the shared
+          index for config.folder_path when config.dedup is set. Needs numpy and Pillow.
+        - source (str): Optional texture this one is meant to look like, e.g. the draft it refines.
+        """
+        # Set the file name attribute
+        self.file_name = file_name
+        # Set the input attribute
+        self.input = input
+        # Set the client attribute
+        self.client = client
+        self.active_client = None
+        # Set the folder attribute
+        self.folder = folder
+        self.seed = seed
+        self.checkpoint = checkpoint
+        self.cache = cache if cache is not None else get_texture_cache()
+        self.variants = max(1, variants)
+        if profile not in SD_PROFILES:
+            raise ValueError(f"Unknown profile {profile!r}, expected one of {', '.join(SD_PROFILES)}")
+        self.profile = profile
+        self.min_score = min_score
+        self.retries = max(0, retries)
+        self.dedup = dedup if dedup is not None else get_hash_index()
+        self.source = source
+        self.cached = False
+        self.progress = None
+        self.paths = []
+        self.images = []
+        self.seeds = []
+        self.scores = []
+        self.hashes = []
+        self.duplicates = []
+        self.attempts = 0
+        self.rejected = False
+        self.duplicate = False
+
+    def payload(self):
+        """Returns the txt2img payload.
+
+        Returns:
+        - dict: The payload for the Stable Diffusion API request.
+        """
+        return {
+            "prompt": self.input,
+            "seed": self.seed,
+            # Variants are sampled together, which keeps the GPU far busier than one call each
+            "batch_size": self.variants,
+            "n_iter": 1,
+            # Steps, CFG scale, size and upscaling come from the profile
+            **SD_PROFILES[self.profile],
+            "tiling": True
+        }
+
+    def file_names(self):
+        """Returns the file name of each variant.
+
+        Returns:
+        - list: file_name for a single image, otherwise file_name_v0, file_name_v1, ...
+        """
+        if self.variants == 1:
+            return [self.file_name]
+        return [f"{self.file_name}_v{k}" for k in range(self.variants)]
+
+    def refined(self, variant=0, profile=SD_PROFILE):
+        """Returns a generator that renders one variant again with another profile, using the same seed.
+
+        Call after generate_image(), so the seed SD picked for a random seed is known.
+
+        Args:
+        - variant (int): The variant to render again.
+        - profile (str): The name of the txt2img settings in SD_PROFILES.
+
+        Returns:
+        - SDImageGenerator: The generator, saving to the variant's file name without DRAFT_SUFFIX.
+        """
+        file_name = self.file_name
+        if file_name.endswith(DRAFT_SUFFIX):
+            file_name = file_name[:-len(DRAFT_SUFFIX)]
+        if self.variants > 1:
+            file_name += f"_v{variant}"
+        seed = self.seeds[variant] if variant < len(self.seeds) and self.seeds[variant] is not None else -1
+        if seed == -1 and self.seed != -1:
+            seed = self.seed + variant
+        # Another seed would not be the same texture, so the refined image is scored but never retried
+        source = self.paths[variant] if variant < len(self.paths) else None
+        return SDImageGenerator(file_name, self.input, client=self.client, folder=self.folder, seed=seed,
+                                checkpoint=self.checkpoint, cache=self.cache, profile=profile,
+                                min_score=self.min_score, retries=0, dedup=self.dedup, source=source)
+
+    def _cache_key(self, payload, seed):
+        """Returns the cache key of one image, the same whether it was made alone or in a batch."""
+        return TextureCache.key(dict(payload, seed=seed, batch_size=1, n_iter=1), self.checkpoint)
+
+    def generate_image(self, can_swap=None, deadline=None, on_progress=None):
+        """Generates an image using the Stable Diffusion model.
+
+        Runs agenerate_image() on the shared AsyncEngine and waits for it.
+
+        Args:
+        - can_swap (callable): Optional can_swap(loaded_checkpoint) that says if a backend may be
+          switched away from its checkpoint, see BackendPool.acquire().
+        - deadline (Deadline): Optional deadline every request must finish by.
+        - on_progress (callable): Optional on_progress(progress) called from the event loop thread
+          with each progress update, see parse_progress().
+        """
+        get_engine().run_sync(self.agenerate_image(can_swap, deadline, on_progress))
+
+    async def agenerate_image(self, can_swap=None, deadline=None, on_progress=None,
+                              progress_interval=SD_PROGRESS_INTERVAL, previews=True):
+        """Generates an image using the Stable Diffusion model without blocking the event loop.
+
+        Args:
+        - can_swap (callable): Optional can_swap(loaded_checkpoint) that says if a backend may be
+          switched away from its checkpoint, see BackendPool.acquire().
+        - deadline (Deadline): Optional deadline every request must finish by.
+        - on_progress (callable): Optional on_progress(progress) called with each progress update,
+          see parse_progress(). SD is only polled for progress when this is set.
+        - progress_interval (float): Seconds between progress polls.
+        - previews (bool): Whether progress updates include the low resolution preview.
+
+        With min_score set, an attempt whose best variant scores below it is rejected and the
+        texture generated again with the next seed, up to retries times. With dedup set, so is an
+        attempt whose every variant looks like a texture already saved, e.g. when GPT named the
+        same material twice. If every attempt falls short the best one is kept and rejected or
+        duplicate is set.
+
+        Raises:
+        - asyncio.TimeoutError: If the deadline passes first. SD is told to stop the image.
+        """
+        deadline = deadline or Deadline()
+        # The progress poll settings passed on to _agenerate()
+        watch = (on_progress, progress_interval, previews)
+        self.rejected = False
+        self.duplicate = False
+        # Attempts are only retried when something can reject them
+        judged = self.min_score is not None or self.dedup is not None
+        best = None
+        for attempt in range(self.retries + 1 if judged else 1):
+            self.attempts = attempt + 1
+            # Fixed seeds move on by the same step each retry, so re-runs hit the cache
+            seed = -1 if self.seed == -1 else self.seed + attempt * TILE_RETRY_SEED_STEP
+            await self._agenerate_attempt(seed, can_swap, deadline, watch)
+            if not judged:
+                return
+            score = max(self.scores) if self.scores else 1.0
+            duplicate = bool(self.duplicates) and None not in self.duplicates
+            # A new texture beats any duplicate, then the one that tiles best wins
+            if best is None or (not duplicate, score) > best[0]:
+                best = ((not duplicate, score), self.paths, self.images, self.seeds, self.scores,
+                        self.hashes, self.duplicates)
+            tiles = self.min_score is None or score >= self.min_score
+            if tiles and not duplicate:
+                return
+            if duplicate:
+                print(f"{self.file_name}: looks like {self.duplicates[0]}")
+            else:
+                print(f"{self.file_name}: tile score {score:.2f} is below {self.min_score}")
+        # Every attempt was rejected, keep the best one
+        last_images = self.images
+        (new, score), self.paths, self.images, self.seeds, self.scores, self.hashes, self.duplicates = best
+        self.rejected = self.min_score is not None and score < self.min_score
+        self.duplicate = not new
+        if self.images is not last_images:
+            for path, image_bytes in zip(self.paths, self.images):
+                await get_engine().in_thread(save_png, path, image_bytes)
+            # The index holds the last attempt, put back the one that was kept
+            for path, image_hash in zip(self.paths, self.hashes):
+                await get_engine().in_thread(self.dedup.add, path, image_hash)
+
+    async def _agenerate_attempt(self, seed, can_swap, deadline, watch):
+        """Generates the images once with the given seed, from the cache if it has them.
+
+        Args:
+        - seed (int): The seed, -1 for a random one.
+        - can_swap (callable): See agenerate_image().
+        - deadline (Deadline): The deadline every request must finish by.
+        - watch (tuple): The (on_progress, progress_interval, previews) of agenerate_image().
+        """
+        engine = get_engine()
+        # Set the payload for the Stable Diffusion API request
+        payload = dict(self.payload(), seed=seed)
+
+        # Use the configured folder unless a folder was given
+        folder = self.folder or config.folder_path
+        paths = [os.path.join(folder, f"{file_name}.png") for file_name in self.file_names()]
+
+        # A random seed never gives the same image twice, so only fixed seeds are looked up
+        self.cached = False
+        if self.cache is not None and seed != -1:
+            images = [await engine.in_thread(self.cache.get, self._cache_key(payload, seed + k))
+                      for k in range(self.variants)]
+            # Only skip SD when every variant is cached
+            if None not in images:
+                self.cached = True
+                self.scores = []
+                if self.min_score is not None:
+                    images, self.scores = await engine.in_thread(self._scored, images)
+                for path, image_bytes in zip(paths, images):
+                    print(path, "(cached)")
+                    await engine.in_thread(save_png, path, image_bytes)
+                self.hashes, self.duplicates = [], []
+                if self.dedup is not None:
+                    self.hashes, self.duplicates = await engine.in_thread(self._deduplicated, paths, images)
+                self.paths, self.images = paths, images
+                self.seeds = [seed + k for k in range(self.variants)]
+                return
+
+        if self.client is not None:
+            await self._agenerate(self.client, payload, paths, deadline, watch)
+            return
+        # Send the image to the least loaded backend, moving on to the next if it is down
+        pool = get_backend_pool()
+        for attempt in range(len(pool.backends)):
+            try:
+                backend = pool.acquire(self.checkpoint, can_swap, probe=False)
+            except NoBackendError:
+                # Every backend is out, probe them off the event loop and try once more
+                await engine.in_thread(pool.probe_all)
+                backend = pool.acquire(self.checkpoint, can_swap, probe=False)
+            try:
+                await self._agenerate(backend.client, payload, paths, deadline, watch)
+            except Exception as e:
+                pool.release(backend, e)
+                if not is_backend_failure(e) or attempt == len(pool.backends) - 1:
+                    raise
+                continue
+            except BaseException:
+                # Cancelled, the backend is fine
+                pool.release(backend)
+                raise
+            pool.release(backend)
+            return
+
+    async def _agenerate(self, client, payload, paths, deadline, watch=(None, 0, False)):
+        """Generates the images on one backend and saves them.
+
+        Args:
+        - client (SDClient): The client of the backend.
+        - payload (dict): The txt2img payload.
+        - paths (list): The output file path of each variant.
+        - deadline (Deadline): The deadline every request must finish by.
+        - watch (tuple): The (on_progress, progress_interval, previews) of agenerate_image().
+        """
+        engine = get_engine()
+        sd_client = engine.sd_client(client)
+        # Wait for a free slot so the backend is never sent more jobs than it runs at once
+        slot = engine.backend_slot(client.base_url)
+        await deadline.wait_for(slot.acquire())
+        self.active_client = client
+        try:
+            # Sets the models to one trained on textures, skipped if it is already loaded
+            await sd_client.ensure_checkpoint(self.checkpoint, deadline)
+
+            # Poll the progress while SD works on the image
+            on_progress, progress_interval, previews = watch
+            watcher = None
+            if on_progress is not None and progress_interval:
+                watcher = asyncio.ensure_future(
+                    self._watch_progress(sd_client, on_progress, progress_interval, previews))
+            try:
+                # Send a POST request to generate the image using Stable Diffusion
+                r = await sd_client.post('/sdapi/v1/txt2img', payload, deadline)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                # The request is gone but SD would keep rendering, tell it to stop
+                sd_client.interrupt_soon()
+                raise
+            finally:
+                if watcher is not None:
+                    watcher.cancel()
+        finally:
+            self.active_client = None
+            slot.release()
+        # Decode and save the images off the event loop
+        await engine.in_thread(self._save_images, r, payload, paths)
+
+    async def _watch_progress(self, sd_client, on_progress, interval, previews):
+        """Polls the backend's progress until cancelled, passing each update to on_progress.
+
+        Args:
+        - sd_client (AsyncSDClient): The client of the backend generating the image.
+        - on_progress (callable): Called as on_progress(progress) with each update.
+        - interval (float): Seconds between polls.
+        - previews (bool): Whether to ask for the low resolution preview.
+        """
+        # Asking SD to skip the preview saves encoding and sending an image on every poll
+        params = {"skip_current_image": "false" if previews else "true"}
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                r = await sd_client.get('/sdapi/v1/progress', params=params)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # A missed poll is not worth failing the image for
+                continue
+            progress = parse_progress(r)
+            if progress is not None:
+                self.progress = progress
+                on_progress(progress)
+
+    def _save_images(self, r, payload, paths):
+        """Saves the images of a txt2img reply with their parameters and caches them.
+
+        Args:
+        - r (dict): The JSON reply from txt2img.
+        - payload (dict): The txt2img payload.
+        - paths (list): The output file path of each variant.
+        """
+        self.paths, self.images, self.seeds, self.scores = [], [], [], []
+        self.hashes, self.duplicates = [], []
+        # SD puts a grid of the whole batch first when it is set to return one
+        offset = max(0, len(r['images']) - len(paths))
+        images = []
+        for k in range(len(paths)):
+            index = offset + k
+            # Decode the image from base64
+            image_bytes = base64.b64decode(r['images'][index].split(",", 1)[0])
+            # Get the generation parameters locally instead of sending the image back to SD
+            parameters = image_parameters(r.get('info'), index, image_bytes)
+            # Add the info as text metadata without re-encoding the image
+            images.append(png_with_text(image_bytes, "parameters", parameters))
+        # Score the whole batch at once before anything is written
+        if self.min_score is not None:
+            images, self.scores = self._scored(images)
+        # Process each image in the response
+        for k, (path, image_bytes) in enumerate(zip(paths, images)):
+            # Save the image with the provided file_name
+            print(path)
+            save_png(path, image_bytes)
+            self.paths.append(path)
+            self.images.append(image_bytes)
+            # Cache it under the seed SD actually used, so asking for that seed again is free
+            seed = image_seed(r.get('info'), k)
+            self.seeds.append(seed)
+            if self.cache is not None and seed is not None:
+                self.cache.put(self._cache_key(payload, seed), image_bytes)
+        # Check once the files are saved, so the index records their final size and time
+        if self.dedup is not None:
+            self.hashes, self.duplicates = self._deduplicated(self.paths, self.images)
+
+    def _scored(self, images):
+        """Scores how well each image tiles and stores the score in its PNG text.
+
+        Scores already stored, e.g. in cached images, are read back instead.
+
+        Args:
+        - images (list): The PNG bytes of each variant.
+
+        Returns:
+        - tuple: (images, scores), the PNG bytes with the score added and the score of each.
+        """
+        try:
+            scores = [float(read_png_text(image_bytes, TILE_SCORE_KEY)) for image_bytes in images]
+            return images, scores
+        except (TypeError, ValueError):
+            pass
+        scores = [float(score) for score in tile_scores(np.stack([image_array(image_bytes) for image_bytes in images]))]
+        return [png_with_text(image_bytes, TILE_SCORE_KEY, f"{score:.3f}")
+                for image_bytes, score in zip(images, scores)], scores
+
+    def _deduplicated(self, paths, images):
+        """Checks each saved image against the hash index and indexes it.
+
+        The variants of one texture, and the texture it refines, are never counted as each other's duplicates.
+
+        Args:
+        - paths (list): The file of each variant.
+        - images (list): The PNG bytes of each variant.
+
+        Returns:
+        - tuple: (hashes, duplicates), the perceptual_hash() of each image and the saved texture
+          it looks like, or None where there is none.
+        """
+        exclude = paths + ([self.source] if self.source else [])
+        hashes = [perceptual_hash(image_array(image_bytes)) for image_bytes in images]
+        return hashes, [self.dedup.check(path, image_hash, exclude) for path, image_hash in zip(paths, hashes)]
+
+    def interrupt(self):
+        """Asks the backend generating the image to stop, if one is."""
+        client = self.active_client
+        if client is not None:
+            client.interrupt()
+
+
+class NameCache:
+    """Class that remembers the texture names GPT gave for each theme in an SQLite file.
+
+    Entries expire after ttl seconds and only the max_entries most recently used themes are kept.
+
+    Attributes:
+    - path (str): The SQLite file.
+    - ttl (float): Seconds an entry is reused.
+    - max_entries (int): The largest number of themes kept.
+
+    Methods:
+    - key(theme): Returns the cache key for a theme.
+    - get(theme, count): Returns the cached texture names for a theme.
+    - put(theme, texture_names): Stores the texture names for a theme.
+    - clear(): Removes every entry.
+    """
+
+    def __init__(self, path, ttl=NAME_CACHE_TTL, max_entries=NAME_CACHE_MAX_ENTRIES):
+        """Initializes the NameCache object.
+
+        Args:
+        - path (str): The SQLite file, created if it does not exist.
+        - ttl (float): Seconds an entry is reused.
+        - max_entries (int): The largest number of themes kept.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS names ("
+                       "key TEXT PRIMARY KEY, names TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)")
+
+    def _connect(self):
+        """Opens a connection to the SQLite file, one per call so threads never share one."""
+        import sqlite3
+        return contextlib.closing(sqlite3.connect(self.path, timeout=10, isolation_level=None))
+
+    @staticmethod
+    def key(theme):
+        """Returns the cache key for a theme.
+
+        Args:
+        - theme (str): The theme.
+
+        Returns:
+        - str: The key, which ignores case and spacing and includes the GPT model.
+        """
+        return GPT_ENGINE + ":" + " ".join(theme.lower().split())
+
+    def get(self, theme, count):
+        """Returns the cached texture names for a theme.
+
+        Args:
+        - theme (str): The theme.
+        - count (int): The number of names needed.
+
+        Returns:
+        - list: The first count names, or None if fewer are cached or the entry expired.
+        """
+        now = time.time()
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT names FROM names WHERE key = ? AND created > ?",
+                             (self.key(theme), now - self.ttl)).fetchone()
+            if row is None:
+                return None
+            texture_names = json.loads(row[0])
+            if len(texture_names) < count:
+                return None
+            db.execute("UPDATE names SET used = ? WHERE key = ?", (now, self.key(theme)))
+        return texture_names[:count]
+
+    def put(self, theme, texture_names):
+        """Stores the texture names for a theme, removing expired and least recently used entries.
+
+        Args:
+        - theme (str): The theme.
+        - texture_names (list): The texture names.
+        """
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)",
+                       (self.key(theme), json.dumps(texture_names), now, now))
+            db.execute("DELETE FROM names WHERE created <= ?", (now - self.ttl,))
+            db.execute("DELETE FROM names WHERE key NOT IN "
+                       "(SELECT key FROM names ORDER BY used DESC LIMIT ?)", (self.max_entries,))
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM names")
+
+
+# Shared texture name caches, one per SQLite file
+_name_caches = {}
+_name_caches_lock = threading.Lock()
+
+
+def get_name_cache():
+    """Returns the shared NameCache for config.name_cache_path, creating it on first use.
+
+    Returns:
+    - NameCache: The shared cache, or None if caching is turned off.
+    """
+    if not config.name_cache:
+        return None
+    with _name_caches_lock:
+        if config.name_cache_path not in _name_caches:
+            _name_caches[config.name_cache_path] = NameCache(config.name_cache_path)
+        return _name_caches[config.name_cache_path]
+
+
+def clean_texture_name(text):
+    """Cleans up a material name returned by GPT.
+
+    Args:
+    - text (str): The raw name, e.g. "\\n\\n1. Rusty metal."
+
+    Returns:
+    - str: The cleaned name, or an empty string if nothing usable is left.
+    """
+    # Remove list numbering, bullets, quotes and trailing punctuation
+    text = re.sub(r"^\s*(?:\d+[.)]|[-*\u2022])\s*", "", str(text))
+    text = text.strip().strip("\"'`").strip().rstrip(".,;:")
+    # Names longer than a few words are sentences, not materials
+    if not text or len(text) > 40 or "\n" in text:
+        return ""
+    return text
+
+
+def parse_texture_names(text):
+    """Parses a list of material names from a GPT reply.
+
+    The reply is expected to be a JSON list, but plain lines or comma separated names are
+    also accepted. Names are cleaned and duplicates are removed, ignoring case.
+
+    Args:
+    - text (str): The GPT reply.
+
+    Returns:
+    - list: The unique material names in the order GPT gave them.
+    """
+    names = None
+    # Use the first JSON list in the reply
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        try:
+            names = json.loads(text[start:end + 1])
+        except ValueError:
+            names = None
+    if not isinstance(names, list):
+        # Fall back to one name per line, or a comma separated line
+        lines = [line for line in text.strip().splitlines() if line.strip()]
+        names = lines if len(lines) > 1 else text.split(",")
+    texture_names = []
+    seen = set()
+    for name in names:
+        if not isinstance(name, str):
+            continue
+        name = clean_texture_name(name)
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            texture_names.append(name)
+    return texture_names
+
+
+class GPTGenerator:
+    """Class that generates texture names using the GPT-3 model.
+
+    Attributes:
+    - user_input_var (str): The user input variable.
+    - user_key_var (str): The user key variable.
+    - count (int): The number of texture names to generate.
+    - batched (bool): Whether to ask for all names in one request.
+    - folder (str): The output folder for the images, or None to use config.folder_path.
+    - seed (int): The seed of the first texture, or None for random seeds.
+    - fresh (bool): Whether to always ask GPT instead of reusing cached names for the theme.
+    - checkpoint (str): The SD checkpoint used for the images.
+    - variants (int): The number of images made for each texture name.
+    - profile (str): The name of the txt2img settings in SD_PROFILES.
+    - min_score (float): The tile score each texture needs, or None to not score them.
+    - retries (int): The number of times a texture that does not tile is generated again.
+
+    Methods:
+    - ask_gpt(text): Sends a text prompt to the GPT-3 model and returns the generated response.
+    - ask_texture_name(texture_names): Asks GPT for one texture name that is not already in the list.
+    - batch_texture_names(): Asks GPT for all texture names in one request.
+    - iter_texture_names(): Yields the texture names.
+    - aiter_texture_names(deadline): Yields the texture names as soon as each one is known.
+    - texture_names(): Generates the texture names without generating any images.
+
+    Each method above has an async version with an "a" prefix that takes a deadline,
+    the sync methods run it on the shared AsyncEngine.
+    - image_generator(index, texture_name): Returns the SDImageGenerator for a texture.
+    - generate_texture_names(): Generates texture names and their images.
+    """
+
+    def __init__(self, user_input_var, user_key_var, count=TEXTURE_COUNT, batched=True, folder=None,
+                 seed=None, fresh=False, checkpoint=SD_CHECKPOINT, variants=1, profile=SD_PROFILE,
+                 min_score=None, retries=TILE_RETRIES):
+        """Initializes the GPTGenerator object.
+
+        Args:
+        - user_input_var (str): The user input variable.
+        - user_key_var (str): The user key variable.
+        - count (int): The number of texture names to generate.
+        - batched (bool): Whether to ask for all names in one request.
+        - folder (str): Optional output folder for the images. Defaults to config.folder_path.
+        - seed (int): Optional seed of the first texture, each next texture adds one. Defaults to random seeds.
+        - fresh (bool): Whether to always ask GPT instead of reusing cached names for the theme.
+        - checkpoint (str): The SD checkpoint used for the images.
+        - variants (int): The number of images made for each texture name, in one batched request.
+        - profile (str): The name of the txt2img settings in SD_PROFILES. Drafts are saved with DRAFT_SUFFIX.
+        - min_score (float): Optional tile score each texture needs, see SDImageGenerator.
+        - retries (int): The number of times a texture scoring below min_score is generated again.
+        """
+        self.user_input_var = user_input_var
+        self.user_key_var = user_key_var
+        self.count = count
+        self.batched = batched
+        self.folder = folder
+        self.seed = seed
+        self.fresh = fresh
+        self.checkpoint = checkpoint
+        self.variants = max(1, variants)
+        self.profile = profile
+        self.min_score = min_score
+        self.retries = retries
+
+    def ask_gpt(self, text, max_tokens=150):
+        """Sends a text prompt to the GPT-3 model and returns the generated response.
+
+        Runs aask_gpt() on the shared AsyncEngine and waits for it.
+
+        Args:
+        - text (str): The prompt text.
+        - max_tokens (int): The maximum length of the response.
+
+        Returns:
+        - str: The generated response from the GPT-3 model.
+        """
+        return get_engine().run_sync(self.aask_gpt(text, max_tokens))
+
+    async def aask_gpt(self, text, max_tokens=150, deadline=None):
+        """Async version of ask_gpt().
+
+        Args:
+        - text (str): The prompt text.
+        - max_tokens (int): The maximum length of the response.
+        - deadline (Deadline): Optional deadline the request must finish by.
+
+        Returns:
+        - str: The generated response from the GPT-3 model.
+
+        Raises:
+        - asyncio.TimeoutError: If GPT does not answer within GPT_TIMEOUT seconds or the deadline passes.
+        """
+        deadline = deadline or Deadline()
+        # Send a text prompt to the GPT-3 model, giving up after GPT_TIMEOUT seconds
+        response = await deadline.wait_for(openai.Completion.acreate(
+            engine=GPT_ENGINE,
+            prompt=text,
+            temperature=0.6,
+            max_tokens=max_tokens
+        ), GPT_TIMEOUT)
+        # Return the generated response from the GPT-3 model
+        return response.choices[0].text
+
+    def ask_texture_name(self, texture_names):
+        """Asks GPT for one texture name that is not already in the list.
+
+        Args:
+        - texture_names (list): The texture names generated so far.
+
+        Returns:
+        - str: The new texture name, or None if GPT gave no usable new name.
+        """
+        return get_engine().run_sync(self.aask_texture_name(texture_names))
+
+    async def aask_texture_name(self, texture_names, deadline=None):
+        """Async version of ask_texture_name().
+
+        Args:
+        - texture_names (list): The texture names generated so far.
+        - deadline (Deadline): Optional deadline the request must finish by.
+
+        Returns:
+        - str: The new texture name, or None if GPT gave no usable new name in NAME_RETRIES + 1 tries.
+        """
+        # The prompt text that is sent to GPT
+        prompt = f"only reply with a one word answer. Name a single material used in {self.user_input_var}"
+        # Add previously generated texture names each prompt sent to GPT to stop it from makeing duplicate texstures
+        if texture_names:
+            prompt += f" other than these {texture_names}"
+        seen = {texture_name.lower() for texture_name in texture_names}
+        for _ in range(NAME_RETRIES + 1):
+            # Use the aask_gpt method to generate a texture name based on the prompt
+            texture_name = clean_texture_name(await self.aask_gpt(prompt, deadline=deadline))
+            # Sentences and names already in the list are asked for again
+            if texture_name and texture_name.lower() not in seen:
+                return texture_name
+        return None
+
+    def batch_texture_names(self):
+        """Asks GPT for all texture names in one request.
+
+        Returns:
+        - list: The unique texture names GPT returned, which may be fewer than count.
+        """
+        return get_engine().run_sync(self.abatch_texture_names())
+
+    async def abatch_texture_names(self, deadline=None):
+        """Async version of batch_texture_names().
+
+        Args:
+        - deadline (Deadline): Optional deadline the request must finish by.
+
+        Returns:
+        - list: The unique texture names GPT returned, which may be fewer than count.
+        """
+        prompt = (f"Reply only with a JSON list of {self.count} different one word names of "
+                  f"materials used in {self.user_input_var}. Example: [\"Wood\", \"Steel\"]")
+        # Allow roughly ten tokens per name plus the list syntax
+        reply = await self.aask_gpt(prompt, max_tokens=max(150, 10 * self.count + 20), deadline=deadline)
+        return parse_texture_names(reply)[:self.count]
+
+    def iter_texture_names(self):
+        """Yields the texture names.
+
+        The names are only yielded once all are known, use aiter_texture_names() from
+        asyncio code to get each one as soon as it is known.
+
+        Yields:
+        - str: The next texture name.
+        """
+        yield from self.texture_names()
+
+    async def aiter_texture_names(self, deadline=None):
+        """Yields the texture names as soon as each one is known.
+
+        Fewer than count names are yielded when GPT keeps repeating names or replying with
+        sentences, and such a short list is not stored in the name cache.
+
+        Args:
+        - deadline (Deadline): Optional deadline every request must finish by.
+
+        Yields:
+        - str: The next texture name.
+        """
+        engine = get_engine()
+        # Reuse the names from an earlier run of the same theme
+        name_cache = None if self.fresh else get_name_cache()
+        if name_cache is not None:
+            cached_names = await engine.in_thread(name_cache.get, self.user_input_var, self.count)
+            if cached_names is not None:
+                for texture_name in cached_names:
+                    yield texture_name
+                return
+        texture_names = []
+        if self.batched:
+            # Get all the names in one request
+            for texture_name in await self.abatch_texture_names(deadline):
+                texture_names.append(texture_name)
+                yield texture_name
+        # Ask one at a time only for the slots the batch did not fill
+        while len(texture_names) < self.count:
+            texture_name = await self.aask_texture_name(texture_names, deadline)
+            if texture_name is None:
+                # GPT ran out of materials, a short list is not worth caching
+                print(f"{self.user_input_var}: only {len(texture_names)} of {self.count} texture names found")
+                return
+            texture_names.append(texture_name)
+            yield texture_name
+        if name_cache is not None:
+            await engine.in_thread(name_cache.put, self.user_input_var, texture_names)
+
+    def texture_names(self):
+        """Generates the texture names without generating any images.
+
+        Returns:
+        - list: A list of generated texture names.
+        """
+        return get_engine().run_sync(self.atexture_names())
+
+    async def atexture_names(self, deadline=None):
+        """Async version of texture_names().
+
+        Args:
+        - deadline (Deadline): Optional deadline every request must finish by.
+
+        Returns:
+        - list: A list of generated texture names.
+        """
+        return [texture_name async for texture_name in self.aiter_texture_names(deadline)]
+
+    def image_generator(self, index, texture_name):
+        """Returns the SDImageGenerator for a texture.
+
+        Args:
+        - index (int): The position of the texture in the set.
+        - texture_name (str): The texture name.
+
+        Returns:
+        - SDImageGenerator: The generator that renders the texture.
+        """
+        # Each texture's variants use the seeds after its first, so leave room for them
+        seed = -1 if self.seed is None else self.seed + index * self.variants
+        # Keep drafts apart from the final textures they may be refined into
+        file_name = f"Texture{index}" + (DRAFT_SUFFIX if self.profile == "draft" else "")
+        return SDImageGenerator(file_name, "PBR, " + texture_name, folder=self.folder, seed=seed,
+                                checkpoint=self.checkpoint, variants=self.variants, profile=self.profile,
+                                min_score=self.min_score, retries=self.retries)
+
+    def generate_texture_names(self):
+        """Generates texture names using the GPT-3 model.
+
+        Returns:
+        - list: A list of generated texture names.
+        """
+        # Render each image while GPT is still naming the next textures
+        texture_names = TexturePipeline().run([self])[0]
+
+        # Return the list of generated texture names
+        return texture_names
+
+
+class CheckpointQueue:
+    """Class that queues SD jobs grouped by the checkpoint they need, for use on one event loop.
+
+    get() hands out jobs for checkpoints that are already loaded on a backend with a free
+    slot first, so jobs for another checkpoint wait until a backend can be switched instead
+    of making the backends switch back and forth. A backend that may be switched goes to a
+    checkpoint no backend has loaded before a second backend is switched to one that is.
+
+    A bounded queue runs dry of a checkpoint between puts, so until close() a checkpoint
+    stays wanted while it is among the last maxsize jobs put, not just while jobs are queued.
+
+    Attributes:
+    - maxsize (int): The number of jobs that may wait before put() waits.
+    - pool (BackendPool): The pool whose loaded checkpoints decide the order.
+
+    Methods:
+    - put(job, checkpoint): Adds a job, waiting while the queue is full.
+    - get(): Removes and returns the next job, waiting while the queue is empty.
+    - pending(checkpoint): Returns the number of queued jobs for a checkpoint.
+    - can_swap(checkpoint): Checks if a backend may be switched away from a checkpoint.
+    - close(): Tells get() to return None once the queue is empty.
+    """
+
+    def __init__(self, maxsize, pool):
+        """Initializes the CheckpointQueue object.
+
+        Args:
+        - maxsize (int): The number of jobs that may wait before put() waits.
+        - pool (BackendPool): The pool whose loaded checkpoints decide the order.
+        """
+        self.maxsize = maxsize
+        self.pool = pool
+        self._groups = collections.OrderedDict()
+        self._size = 0
+        self._closed = False
+        # The checkpoints of the last maxsize jobs put, which are likely to be put again
+        self._recent = collections.deque(maxlen=max(1, maxsize))
+        self._condition = asyncio.Condition()
+
+    async def put(self, job, checkpoint):
+        """Adds a job, waiting while the queue is full.
+
+        Args:
+        - job: The job.
+        - checkpoint (str): The checkpoint the job needs.
+        """
+        async with self._condition:
+            while self._size >= self.maxsize:
+                await self._condition.wait()
+            self._groups.setdefault(checkpoint, collections.deque()).append(job)
+            self._recent.append(checkpoint)
+            self._size += 1
+            self._condition.notify_all()
 
-# URL for Stable Diffusion (SD) model API
-SD_URL = "http://127.0.0.1:7860"
+    async def get(self):
+        """Removes and returns the next job, waiting while the queue is empty.
 
-# Create a folder path for storing generated images
-folder_path = os.path.join(os.path.expanduser("~"), "Smart-Tile-Maker")
-if not os.path.exists(folder_path):
-    os.makedirs(folder_path)
+        Returns:
+        - The job, or None once the queue is closed and empty.
+        """
+        async with self._condition:
+            while self._size == 0:
+                if self._closed:
+                    return None
+                await self._condition.wait()
+            slots = self.pool.loaded_checkpoints()
+            checkpoints = list(self._groups)
+            loaded = [c for c in checkpoints if any(same_checkpoint(l, c) for l in slots)]
+            unloaded = [c for c in checkpoints if c not in loaded]
+            # An idle backend that may be switched is better spent on a checkpoint no backend has
+            switchable = unloaded and any(c is None or self.can_swap(c) for c in self.pool.idle_checkpoints())
+            # Jobs whose checkpoint has a free loaded backend, then the biggest group without a
+            # backend when one can be switched for it, then jobs whose checkpoint is loaded
+            # somewhere, then the biggest group since it is worth a switch
+            checkpoint = (next((c for c in loaded
+                                if any(slots[l] for l in slots if same_checkpoint(l, c))), None)
+                          or (max(unloaded, key=lambda c: len(self._groups[c])) if switchable else None)
+                          or next(iter(loaded), None)
+                          or max(checkpoints, key=lambda c: len(self._groups[c])))
+            group = self._groups[checkpoint]
+            job = group.popleft()
+            if not group:
+                del self._groups[checkpoint]
+            self._size -= 1
+            self._condition.notify_all()
+            return job
 
-# Set the API key for OpenAI
-key = ""
-# Check if the OpenAI API key is provided as an environment variable
-if "OPENAI_API_KEY" in os.environ:
-    # Set key type as "OS_KEY" if environment variable is present
-    key = "OS_KEY"
-    # Set OpenAI API key from environment variable
-    openai.api_key = os.environ["OPENAI_API_KEY"]
-else:
-    # Set key type as "USER_KEY" if environment variable is not present
-    key = "USER_KEY"
+    def pending(self, checkpoint):
+        """Returns the number of queued jobs for a checkpoint.
 
+        Args:
+        - checkpoint (str): The checkpoint title.
 
-class SDImageGenerator:
-    """Class that generates images using the Stable Diffusion model.
+        Returns:
+        - int: The number of queued jobs that need the checkpoint.
+        """
+        return sum(len(group) for queued, group in self._groups.items()
+                   if same_checkpoint(queued, checkpoint))
+
+    def can_swap(self, checkpoint):
+        """Checks if a backend may be switched away from a checkpoint, i.e. no job needs it.
+
+        Args:
+        - checkpoint (str): The checkpoint loaded on the backend.
+
+        Returns:
+        - boolean: True if no queued job needs the checkpoint and, until the queue is closed,
+          none of the last maxsize jobs put did.
+        """
+        if self.pending(checkpoint):
+            return False
+        return self._closed or not any(same_checkpoint(recent, checkpoint) for recent in self._recent)
+
+    async def close(self):
+        """Tells get() to return None once the queue is empty."""
+        async with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class TexturePipeline:
+    """Class that overlaps GPT name generation with SD image generation.
+
+    Runs as coroutines on an event loop: GPT tasks push each texture name onto a bounded queue
+    as soon as it is known and SD tasks render them from the queue. A full queue pauses the GPT
+    tasks until SD catches up. The queue groups jobs by checkpoint so backends are only switched
+    once their queue drains. All tasks run in one TaskGroup, so cancelling the run cancels
+    every request in flight.
+
+    With a refine callable, textures rendered with a cheaper profile such as "draft" are offered
+    to refine() once they are saved. After every draft is done, the ones it picks are rendered
+    again with refine_profile and the same seed.
+
+    Finished textures are post-processed on the engine's worker processes while SD moves on to
+    the next image: with pbr_maps set their PBR maps are derived, with mips set their mip
+    chains are built, and with compress set they are exported block compressed for the GPU.
+    With atlas set, once every texture is done each theme's set is packed into one atlas, and
+    with array set into a texture array, see save_atlas().
+
+    Every texture ends with a status in statuses: "done", "rejected" when it was saved but
+    still scored below its min_score after every retry, "duplicate" when it still looked like a
+    texture already saved, see HashIndex, "error", "timeout" when the run's
+    deadline or its own job_timeout passed, or "cancelled" when cancel() or cancel_texture()
+    stopped it. SD is told to stop any image whose request was abandoned. A draft whose
+    variants refine() picked ends as "refined", and each picked variant gets its own status.
 
     Attributes:
-    - file_name (str): The name of the output file.
-    - input (str): The input prompt for generating the image.
+    - gpt_workers (int): The number of GPTGenerators naming textures at the same time.
+    - sd_workers (int): The number of images being generated at the same time.
+    - queue_size (int): The number of named textures that may wait for SD.
+    - on_progress (callable): Optional callback called as on_progress(stage, theme_index, texture_index, value).
+    - progress_interval (float): Seconds between polls of SD's progress, 0 to not poll.
+    - previews (bool): Whether SD progress updates include the low resolution preview.
+    - job_timeout (float): Seconds each image may take, or None for no limit.
+    - refine (callable): Optional refine(sd_generator, variant) that says if a draft is rendered again.
+    - refine_profile (str): The profile drafts picked by refine() are rendered again with.
+    - pbr_maps (tuple): The PBR maps saved next to each finished texture, see save_pbr_maps().
+    - mips (str): The layout the mip chain of each finished texture is saved in, or None for no mips.
+    - mip_filter (str): The filter the mip levels are made with.
+    - compress (str): The block format finished textures are exported in, or None to not export them.
+    - container (str): The file the exported textures are saved in, "dds" or "ktx2".
+    - atlas (bool): Whether each theme's finished textures are packed into an atlas.
+    - array (bool): Whether each theme's finished textures are also saved as a texture array.
+    - gutter (int): The gutter around each tile of an atlas, in pixels.
+    - cancelled (bool): Whether cancel() has been called.
+    - swaps (int): The number of checkpoint switches during the last run.
+    - results (list): The texture names found so far for each GPTGenerator.
+    - statuses (dict): The status of each texture by (theme_index, texture_index), and of each
+      variant rendered again by (theme_index, texture_index, variant). Errors naming a theme are
+      recorded under (theme_index, None).
 
     Methods:
-    - generate_image(): Generates an image using the Stable Diffusion model.
+    - run(gpt_generators, deadline): Generates the textures for each GPTGenerator.
+    - arun(gpt_generators, deadline): Async version of run().
+    - cancel(): Stops the run, dropping queued textures and interrupting the ones being generated.
+    - cancel_texture(theme_index, texture_index, variant): Stops one texture, dropping it if queued or interrupting it.
+    - status_counts(): Returns the number of textures with each status.
     """
 
-    def __init__(self, file_name, input):
-        """Initializes the SDImageGenerator object.
+    def __init__(self, gpt_workers=GPT_WORKERS, sd_workers=None,
+                 queue_size=SD_QUEUE_SIZE, on_progress=None,
+                 progress_interval=SD_PROGRESS_INTERVAL, previews=True, job_timeout=None,
+                 refine=None, refine_profile=SD_PROFILE, pbr_maps=(), mips=None, mip_filter=MIP_FILTER,
+                 compress=None, container="dds", atlas=False, array=False, gutter=ATLAS_GUTTER):
+        """Initializes the TexturePipeline object.
 
         Args:
-        - file_name (str): The name of the output file.
-        - input (str): The input prompt for generating the image.
+        - gpt_workers (int): The number of GPTGenerators naming textures at the same time.
+        - sd_workers (int): The number of images being generated at the same time.
+          Defaults to SD_WORKERS for each backend in the shared pool.
+        - queue_size (int): The number of named textures that may wait for SD.
+        - on_progress (callable): Optional callback called as on_progress(stage, theme_index, texture_index, value).
+          stage is "name", "draft", "image", "rejected", "duplicate", "pbr", "mips", "export", "timeout"
+          or "cancelled" with the texture name as value, "atlas" with texture_index None and the path of the
+          atlas manifest, or of the array manifest when only arrays are saved,
+          "progress" with the dict from parse_progress() while SD works on the image, or "error"
+          with the exception. It is called from the event loop thread.
+        - progress_interval (float): Seconds between polls of SD's progress, 0 to not poll.
+        - previews (bool): Whether SD progress updates include the low resolution preview.
+        - job_timeout (float): Optional seconds each image may take once SD starts on it.
+        - refine (callable): Optional refine(sd_generator, variant) called from a worker thread for
+          each saved variant of a texture whose profile is not refine_profile. Returns True to
+          render the variant again with refine_profile, reusing its seed.
+        - refine_profile (str): The profile drafts picked by refine() are rendered again with.
+        - pbr_maps (tuple): Names from PBR_MAPS to derive and save next to each finished texture.
+          Needs numpy and Pillow.
+        - mips (str): Optional layout from MIP_LAYOUTS to save the mip chain of each finished
+          texture and of its PBR maps in, see save_mip_levels(). Needs numpy and Pillow.
+        - mip_filter (str): The filter from MIP_FILTERS the mip levels are made with.
+        - compress (str): Optional format from COLOR_FORMATS to export each finished texture in,
+          with its whole mip chain. Its PBR maps are exported in PBR_MAP_FORMATS. Needs numpy and Pillow.
+        - container (str): The file exported textures are saved in, "dds" or "ktx2".
+        - atlas (bool): Whether to pack each theme's finished textures, with their PBR maps, into
+          one atlas once every texture is done, see save_atlas(). It gets mips and is exported
+          like the textures. Needs numpy and Pillow.
+        - array (bool): Whether to also save each theme's finished textures as a texture array
+          in container, in compress or "bc7". Without atlas only the arrays are saved. Needs numpy and Pillow.
+        - gutter (int): The gutter around each tile of an atlas, in pixels.
         """
-        # Set the file name attribute
-        self.file_name = file_name
-        # Set the input attribute
-        self.input = input
+        self.gpt_workers = max(1, gpt_workers)
+        self.sd_workers = max(1, sd_workers or SD_WORKERS * len(get_backend_pool().backends))
+        self.queue_size = max(1, queue_size)
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.previews = previews
+        self.job_timeout = job_timeout
+        self.refine = refine
+        self.refine_profile = refine_profile
+        self.pbr_maps = tuple(pbr_maps)
+        self.mips = mips
+        self.mip_filter = mip_filter
+        self.compress = compress
+        self.container = container
+        self.atlas = atlas
+        self.array = array
+        self.gutter = gutter
+        self.swaps = 0
+        self.results = []
+        self.statuses = {}
+        self._cancel_event = threading.Event()
+        # The task running arun() and its loop, so cancel() can reach it from any thread
+        self._task = None
+        self._loop = None
+        # The task of each image being generated and the textures cancel_texture() was called for,
+        # by status key
+        self._job_tasks = {}
+        self._cancelled_jobs = set()
+        self._jobs_lock = threading.Lock()
 
-    def generate_image(self):
-        """Generates an image using the Stable Diffusion model."""
-        # Set the payload for the Stable Diffusion API request
-        payload = {
-            "prompt": self.input,
-            "seed": -1,
-            "batch_size": 1,
-            "n_iter": 1,
-            "steps": 20,
-            "cfg_scale": 7,
-            "width": 512,
-            "height": 512,
-            "tiling": True
-        }
+    @property
+    def cancelled(self):
+        """Whether cancel() has been called."""
+        return self._cancel_event.is_set()
 
-        # Use the global folder_path variable
-        global folder_path
-        # Use the global SD_URL variable
-        global SD_URL
+    def cancel(self):
+        """Stops the run, dropping queued textures and interrupting the ones being generated.
 
-        # Sets the models to one trained on textures
-        option_payload = {
-            "sd_model_checkpoint": "TextureDiffusion_10.ckpt [ded387e0f3]"
-        }
+        Safe to call from any thread.
+        """
+        self._cancel_event.set()
+        task, loop = self._task, self._loop
+        # Cancelling the task cancels every GPT and SD request it is waiting on,
+        # each abandoned image also tells SD to stop
+        if task is not None:
+            loop.call_soon_threadsafe(task.cancel)
 
-        # Send a POST request to set the options for Stable Diffusion
-        response = requests.post(
-            url=f'{SD_URL}/sdapi/v1/options', json=option_payload)
-        # Send a POST request to generate the image using Stable Diffusion
-        response = requests.post(
-            url=f'{SD_URL}/sdapi/v1/txt2img', json=payload)
-        # Convert the response to JSON format
-        r = response.json()
-        # Process each image in the response
-        for i in r['images']:
-            # Open the image and decode it from base64
-            image = Image.open(io.BytesIO(base64.b64decode(i.split(",", 1)[0])))
-            # Prepare the payload for PNG info request
-            png_payload = {
-                "image": "data:image/png;base64," + i
-            }
-            # Send a POST request to obtain PNG info for the image
-            response2 = requests.post(
-                url=f'{SD_URL}/sdapi/v1/png-info', json=png_payload)
-
-            # Create a PNG info object
-            pnginfo = PngImagePlugin.PngInfo()
-            # Add the obtained info as text metadata to the image
-            pnginfo.add_text("parameters", response2.json()["info"])
-            # Save the image with the provided file_name and PNG info
-            print(os.path.join(folder_path, f"{self.file_name}.png"))
-            image.save(rf"{os.path.join(folder_path, f'{self.file_name}.png')}", pnginfo=pnginfo)
+    def cancel_texture(self, theme_index, texture_index, variant=None):
+        """Stops one texture, dropping it if queued or interrupting it if being generated.
 
+        Safe to call from any thread.
 
-class GPTGenerator:
-    """Class that generates texture names using the GPT-3 model.
+        Args:
+        - theme_index (int): The theme the texture belongs to.
+        - texture_index (int): The position of the texture.
+        - variant (int): Optional variant being rendered again to stop on its own.
+          Without it the texture and every variant of it are stopped.
+        """
+        key = (theme_index, texture_index) if variant is None else (theme_index, texture_index, variant)
+        with self._jobs_lock:
+            self._cancelled_jobs.add(key)
+            tasks = [task for job_key, task in self._job_tasks.items() if job_key[:len(key)] == key]
+        for task in tasks:
+            self._loop.call_soon_threadsafe(task.cancel)
+
+    def _is_cancelled(self, key):
+        """Checks if cancel_texture() was called for a job or for its whole texture."""
+        return key in self._cancelled_jobs or key[:2] in self._cancelled_jobs
+
+    def status_counts(self):
+        """Returns the number of textures with each status.
+
+        Returns:
+        - dict: The number of textures for each status.
+        """
+        counts = {}
+        for status in list(self.statuses.values()):
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def _notify(self, stage, theme_index, texture_index, value):
+        """Calls the progress callback if one is set."""
+        if self.on_progress is not None:
+            self.on_progress(stage, theme_index, texture_index, value)
+
+    def run(self, gpt_generators, deadline=None):
+        """Generates the textures for each GPTGenerator.
+
+        Runs arun() on the shared AsyncEngine and waits for it.
+
+        Args:
+        - gpt_generators (list): The GPTGenerator for each theme.
+        - deadline (Deadline): Optional deadline every request of the run must finish by.
+
+        Returns:
+        - list: The list of texture names for each GPTGenerator. After cancel() only the names found so far are returned.
+
+        Raises:
+        - Exception: The first error from any stage, after every other texture has finished.
+        - KeyboardInterrupt: After the run has been cancelled and has wound down.
+        """
+        future = get_engine().submit(self.arun(gpt_generators, deadline))
+        try:
+            return future.result()
+        except KeyboardInterrupt:
+            # Stop the requests in flight and let every status be recorded before passing Ctrl+C on
+            self.cancel()
+            future.result()
+            raise
+
+    async def arun(self, gpt_generators, deadline=None):
+        """Async version of run().
+
+        Args:
+        - gpt_generators (list): The GPTGenerator for each theme.
+        - deadline (Deadline): Optional deadline every request of the run must finish by.
+          Textures that are not done by then end with the "timeout" status.
+
+        Returns:
+        - list: The list of texture names for each GPTGenerator. After cancel() only the names found so far are returned.
+
+        Raises:
+        - Exception: The first error from any stage, after every other texture has finished.
+          A timeout is raised as asyncio.TimeoutError.
+        """
+        deadline = deadline or Deadline()
+        results = self.results = [[] for _ in gpt_generators]
+        statuses = self.statuses = {}
+        errors = []
+        # Named textures waiting for an SD task, grouped by checkpoint
+        pool = get_backend_pool()
+        jobs = CheckpointQueue(self.queue_size, pool)
+        swaps_before = pool.swaps()
+        # Themes being named by GPT at the same time
+        gpt_slots = asyncio.Semaphore(self.gpt_workers)
+        # Drafts picked by refine(), rendered again once every draft is done
+        refine_jobs = []
+        # (texture_index, name, path, image_bytes) of each post-processed variant, by theme
+        finished = collections.defaultdict(list)
+        engine = get_engine()
+
+        async def produce(theme_index):
+            """Names the textures of one theme and queues them for SD."""
+            gpt_generator = gpt_generators[theme_index]
+            async with gpt_slots:
+                try:
+                    texture_index = 0
+                    async for texture_name in gpt_generator.aiter_texture_names(deadline):
+                        results[theme_index].append(texture_name)
+                        self._notify("name", theme_index, texture_index, texture_name)
+                        sd_generator = gpt_generator.image_generator(texture_index, texture_name)
+                        statuses[(theme_index, texture_index)] = "queued"
+                        # Waits while SD is behind
+                        await jobs.put((theme_index, texture_index, texture_name, sd_generator, None),
+                                       sd_generator.checkpoint)
+                        texture_index += 1
+                except asyncio.TimeoutError as e:
+                    errors.append(e)
+                    statuses[(theme_index, None)] = "timeout"
+                    self._notify("timeout", theme_index, None, None)
+                except Exception as e:
+                    errors.append(e)
+                    statuses[(theme_index, None)] = "error"
+                    self._notify("error", theme_index, None, e)
+
+        async def postprocess(key, texture_name, sd_generator):
+            """Derives the files made from a finished texture on the worker processes."""
+            theme_index, texture_index = key[:2]
+            try:
+                work = []
+                # The PNG bytes are still in memory, so the workers never read them back
+                container = self.container if self.compress is not None else None
+                for path, image_bytes in zip(sd_generator.paths, sd_generator.images):
+                    if self.pbr_maps:
+                        work.append(engine.in_process(save_pbr_maps, path, image_bytes, self.pbr_maps,
+                                                      self.mips, self.mip_filter, container))
+                    # One chain serves both the uncompressed levels and the export
+                    if self.mips is not None or self.compress is not None:
+                        work.append(engine.in_process(save_mips, path, image_bytes, self.mips, self.mip_filter,
+                                                      self.compress, self.container))
+                await asyncio.gather(*work)
+                if self.pbr_maps:
+                    self._notify("pbr", theme_index, texture_index, texture_name)
+                if self.mips is not None:
+                    self._notify("mips", theme_index, texture_index, texture_name)
+                if self.compress is not None:
+                    self._notify("export", theme_index, texture_index, texture_name)
+                for path, image_bytes in zip(sd_generator.paths, sd_generator.images):
+                    finished[theme_index].append((texture_index, os.path.splitext(os.path.basename(path))[0],
+                                                  path, image_bytes))
+            except Exception as e:
+                errors.append(e)
+                statuses[key] = "error"
+                self._notify("error", theme_index, texture_index, e)
+
+        async def pack(theme_index):
+            """Packs the finished textures of one theme into atlases and texture arrays on a worker process."""
+            try:
+                tiles = [tile[1:] for tile in sorted(finished[theme_index], key=lambda tile: tile[0])]
+                folder = os.path.dirname(tiles[0][1])
+                array_format = (self.compress or "bc7") if self.array else None
+                paths = await engine.in_process(save_atlas, folder, tiles, self.pbr_maps, self.gutter, self.mips,
+                                                self.mip_filter, self.compress, self.container, array_format,
+                                                self.atlas)
+                self._notify("atlas", theme_index, None, paths[-1])
+            except Exception as e:
+                errors.append(e)
+                statuses[(theme_index, None)] = "error"
+                self._notify("error", theme_index, None, e)
+
+        async def consume(jobs):
+            """Generates the queued images until the queue is closed and empty."""
+            while True:
+                job = await jobs.get()
+                # None tells the task there is nothing left to do
+                if job is None:
+                    return
+                theme_index, texture_index, texture_name, sd_generator, variant = job
+                # Each variant rendered again has its own status and task
+                key = (theme_index, texture_index) if variant is None else (theme_index, texture_index, variant)
+                # Drop the textures cancelled while they were queued
+                if self._is_cancelled(key):
+                    statuses[key] = "cancelled"
+                    self._notify("cancelled", theme_index, texture_index, texture_name)
+                    continue
+                # Pass SD's progress on only if someone is listening
+                if self.on_progress is not None:
+                    def on_image_progress(progress, theme_index=theme_index, texture_index=texture_index):
+                        self._notify("progress", theme_index, texture_index, progress)
+                else:
+                    on_image_progress = None
+                # Run the image as its own task so cancel_texture() can stop just this one
+                task = asyncio.ensure_future(sd_generator.agenerate_image(
+                    can_swap=jobs.can_swap, deadline=deadline.sooner(self.job_timeout),
+                    on_progress=on_image_progress, progress_interval=self.progress_interval,
+                    previews=self.previews))
+                with self._jobs_lock:
+                    self._job_tasks[key] = task
+                    cancelled = self._is_cancelled(key)
+                if cancelled:
+                    task.cancel()
+                statuses[key] = "running"
+                try:
+                    await task
+                    statuses[key] = "done"
+                    if sd_generator.duplicate:
+                        # Saved for the artist to judge, but not worth any more work
+                        statuses[key] = "duplicate"
+                        self._notify("duplicate", theme_index, texture_index, texture_name)
+                    elif sd_generator.rejected:
+                        # Saved, but not worth refining
+                        statuses[key] = "rejected"
+                        self._notify("rejected", theme_index, texture_index, texture_name)
+                    elif self.refine is not None and sd_generator.profile != self.refine_profile:
+                        self._notify("draft", theme_index, texture_index, texture_name)
+                        for variant in range(len(sd_generator.paths)):
+                            if await engine.in_thread(self.refine, sd_generator, variant):
+                                statuses[key] = "refined"
+                                statuses[(theme_index, texture_index, variant)] = "queued"
+                                refine_jobs.append((theme_index, texture_index, texture_name,
+                                                    sd_generator.refined(variant, self.refine_profile), variant))
+                    else:
+                        self._notify("image", theme_index, texture_index, texture_name)
+                        post.create_task(postprocess(key, texture_name, sd_generator))
+                except asyncio.CancelledError:
+                    # Only a cancel_texture() is handled here, a cancelled run is passed on
+                    if self.cancelled or not task.cancelled() or not self._is_cancelled(key):
+                        raise
+                    statuses[key] = "cancelled"
+                    self._notify("cancelled", theme_index, texture_index, texture_name)
+                except asyncio.TimeoutError as e:
+                    errors.append(e)
+                    statuses[key] = "timeout"
+                    self._notify("timeout", theme_index, texture_index, texture_name)
+                except Exception as e:
+                    errors.append(e)
+                    statuses[key] = "error"
+                    self._notify("error", theme_index, texture_index, e)
+                finally:
+                    with self._jobs_lock:
+                        self._job_tasks.pop(key, None)
+
+        # Set the task before checking for a cancel, so a cancel() from another thread is never missed
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        try:
+            if self.cancelled:
+                return results
+            # Post-processing outlives the SD tasks, leaving the block waits for it
+            async with TaskGroup() as post:
+                async with TaskGroup() as consumers:
+                    for _ in range(self.sd_workers):
+                        consumers.create_task(consume(jobs))
+                    async with TaskGroup() as producers:
+                        for theme_index in range(len(gpt_generators)):
+                            producers.create_task(produce(theme_index))
+                    # Every name is queued, let each SD task finish the queue
+                    await jobs.close()
+                # Render the picked drafts again at full quality
+                if refine_jobs:
+                    jobs = CheckpointQueue(len(refine_jobs), pool)
+                    for job in refine_jobs:
+                        await jobs.put(job, job[3].checkpoint)
+                    await jobs.close()
+                    async with TaskGroup() as consumers:
+                        for _ in range(self.sd_workers):
+                            consumers.create_task(consume(jobs))
+            # Every texture and its maps are saved, pack each set
+            if (self.atlas or self.array) and not self.cancelled:
+                async with TaskGroup() as packers:
+                    for theme_index in sorted(finished):
+                        packers.create_task(pack(theme_index))
+        except asyncio.CancelledError:
+            # cancel() returns what was found so far, any other cancel is passed on
+            if not self.cancelled:
+                raise
+            return results
+        finally:
+            self._task = None
+            self.swaps = pool.swaps() - swaps_before
+            # Textures that were queued or being generated when the run stopped
+            for key, status in statuses.items():
+                if status in ("queued", "running"):
+                    statuses[key] = "cancelled"
+
+        if errors:
+            raise errors[0]
+        return results
+
+
+# Message shown when the OpenAI check fails, with the error name added
+OPENAI_PROBLEM = "There was an error connecting to Open AI. Make sure you enter a valid key click 'Get help' to learn how to get one \n"
+
+
+class Preflight:
+    """Class that checks the output folder, SD and the OpenAI key before a generation starts.
+
+    The checks run at the same time with short timeouts. SD and OpenAI checks that pass are
+    trusted for ttl seconds, so a click soon after a passed check starts at once. Failed checks
+    are always run again, so fixing the problem and clicking again works.
 
     Attributes:
-    - user_input_var (str): The user input variable.
-    - user_key_var (str): The user key variable.
+    - ttl (float): Seconds a passed check is trusted.
+    - timeout (float): Seconds each check may take.
 
     Methods:
-    - ask_gpt(text): Sends a text prompt to the GPT-3 model and returns the generated response.
-    - generate_texture_names(): Generates texture names using the GPT-3 model.
+    - check_folder(folder): Checks that the output folder exists and can be written to.
+    - check_sd(sd_urls): Checks that at least one SD backend is running.
+    - check_openai(api_key): Checks that OpenAI accepts the key.
+    - run(folder, sd_urls, api_key): Runs every check and returns the first problem.
+    - revalidate(folder, sd_urls, api_key): Runs every check in the background to warm the cache.
     """
 
-    def __init__(self, user_input_var, user_key_var):
-        """Initializes the GPTGenerator object.
+    def __init__(self, ttl=PREFLIGHT_TTL, timeout=PREFLIGHT_TIMEOUT):
+        """Initializes the Preflight object.
 
         Args:
-        - user_input_var (str): The user input variable.
-        - user_key_var (str): The user key variable.
+        - ttl (float): Seconds a passed check is trusted.
+        - timeout (float): Seconds each check may take.
         """
-        self.user_input_var = user_input_var
-        self.user_key_var = user_key_var
+        self.ttl = ttl
+        self.timeout = timeout
+        # Time each (check, target) last passed
+        self._passed = {}
+        self._lock = threading.Lock()
 
-    def ask_gpt(self, text):
-        """Sends a text prompt to the GPT-3 model and returns the generated response.
+    def _cached(self, check):
+        """Checks if a check passed less than ttl seconds ago."""
+        with self._lock:
+            return time.monotonic() - self._passed.get(check, -self.ttl) < self.ttl
+
+    def _pass(self, check):
+        """Records that a check passed."""
+        with self._lock:
+            self._passed[check] = time.monotonic()
+
+    def check_folder(self, folder):
+        """Checks that the output folder exists and can be written to.
 
         Args:
-        - text (str): The prompt text.
+        - folder (str): The output folder.
 
         Returns:
-        - str: The generated response from the GPT-3 model.
+        - str: The problem, or None if the folder is fine.
         """
-        # Send a text prompt to the GPT-3 model
-        response = openai.Completion.create(
-            engine="text-davinci-003",
-            prompt=text,
-            temperature=0.6,
-            max_tokens=150
-        )
-        # Return the generated response from the GPT-3 model
-        return response.choices[0].text
+        # The folder can be removed at any time, so this cheap check is never cached
+        if not os.path.isdir(folder):
+            return "The folder you selected dose not exsist. Try selecting a diffrent folder"
+        if not os.access(folder, os.W_OK):
+            return "The folder you selected can not be written to. Try selecting a different folder"
+        return None
 
-    def generate_texture_names(self):
-        """Generates texture names using the GPT-3 model.
+    def check_sd(self, sd_urls):
+        """Checks that at least one SD backend is running.
+
+        Args:
+        - sd_urls (list): The URLs of the SD backends.
 
         Returns:
-        - list: A list of generated texture names.
+        - str: The problem, or None if a backend answered.
         """
-        # Initialize an empty list to store the generated texture names
-        texture_names = []
-        # loop 5 times to generate 5 texture names using the GPT-3 model
-        for i in range(5):
-            # The prompt text that is sent to GPT
-            prompt = f"only reply with a one word answer. Name a single material used in {self.user_input_var}"
-            # Add previously generated texture names each prompt sent to GPT to stop it from makeing duplicate texstures
-            if i > 0:
-                prompt += f" other than these {texture_names[:i]}"
-            # Use the ask_gpt method to generate a texture name based on the prompt
-            texture_names.append(self.ask_gpt(prompt))
-            # Generate an image using the SDImageGenerator class
-            sd_generator = SDImageGenerator(f"Texture{i}", "PBR, " + texture_names[i])
-            sd_generator.generate_image()
+        check = ("sd", tuple(sd_urls))
+        if self._cached(check):
+            return None
+        # Probing also puts backends that answer back in the pool
+        if get_backend_pool(sd_urls).probe_all() == 0:
+            return "Faild to connect to SD. Make sure you have it running on your computor"
+        self._pass(check)
+        return None
+
+    def check_openai(self, api_key):
+        """Checks that OpenAI accepts the key.
+
+        Looking up the GPT model is free, unlike a completion, and fails the same way for a bad key.
+
+        Args:
+        - api_key (str): The OpenAI key.
+
+        Returns:
+        - str: The problem, or None if the key works.
+        """
+        if not api_key:
+            return OPENAI_PROBLEM + "(AuthenticationError)"
+        check = ("openai", hashlib.sha256(api_key.encode("utf-8")).hexdigest())
+        if self._cached(check):
+            return None
+        try:
+            openai.Model.retrieve(GPT_ENGINE, api_key=api_key, request_timeout=self.timeout)
+        except openai.error.InvalidRequestError:
+            # The key was accepted, the model just could not be looked up
+            pass
+        except openai.error.RateLimitError:
+            return OPENAI_PROBLEM + "You are out of creditds you can get more from OpenAI\n(RateLimitError)"
+        except (openai.error.APIConnectionError, openai.error.Timeout):
+            return OPENAI_PROBLEM + "(APIConnectionError)"
+        except openai.error.AuthenticationError:
+            return OPENAI_PROBLEM + "(AuthenticationError)"
+        except openai.error.OpenAIError:
+            return OPENAI_PROBLEM + "(APIError)"
+        self._pass(check)
+        return None
+
+    def run(self, folder, sd_urls, api_key):
+        """Runs every check at the same time and returns the first problem.
+
+        Args:
+        - folder (str): The output folder.
+        - sd_urls (list): The URLs of the SD backends.
+        - api_key (str): The OpenAI key.
+
+        Returns:
+        - str: The first problem in the order folder, SD, OpenAI, or None if every check passed.
+        """
+        checks = [(self.check_folder, folder), (self.check_sd, sd_urls), (self.check_openai, api_key)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(checks)) as executor:
+            futures = [executor.submit(check, target) for check, target in checks]
+            problems = [future.result() for future in futures]
+        return next((problem for problem in problems if problem), None)
+
+    def revalidate(self, folder, sd_urls, api_key):
+        """Runs every check in the background so the next run() can use the cached results.
+
+        Args:
+        - folder (str): The output folder.
+        - sd_urls (list): The URLs of the SD backends.
+        - api_key (str): The OpenAI key.
+
+        Returns:
+        - threading.Thread: The background thread.
+        """
+        thread = threading.Thread(target=self.run, args=(folder, sd_urls, api_key), daemon=True)
+        thread.start()
+        return thread
+
+
+# The shared preflight checks
+preflight = Preflight()
+
+
+def read_themes(path):
+    """Reads the themes for a batch run, one per line.
+
+    A line can name the SD checkpoint for its theme after a "|", e.g.
+    "zombie apocalypse | TextureDiffusion_10.ckpt [ded387e0f3]".
+    Blank lines and lines starting with "#" are skipped.
+
+    Args:
+    - path (str): The themes file, or "-" to read from standard input.
+
+    Returns:
+    - list: A (theme, checkpoint) tuple for each theme, checkpoint is None if the line has none.
+    """
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    themes = []
+    for line in lines:
+        if not line.strip() or line.strip().startswith("#"):
+            continue
+        theme, _, checkpoint = line.partition("|")
+        themes.append((theme.strip(), checkpoint.strip() or None))
+    return themes
+
+
+def theme_folder_name(theme, used):
+    """Returns a unique, file system safe folder name for a theme.
+
+    Args:
+    - theme (str): The theme.
+    - used (set): The folder names already taken, updated with the new name.
+
+    Returns:
+    - str: The folder name.
+    """
+    name = re.sub(r"[^\w\-]+", "_", theme).strip("_")[:60] or "generic"
+    unique = name
+    number = 2
+    while unique.lower() in used:
+        unique = f"{name}_{number}"
+        number += 1
+    used.add(unique.lower())
+    return unique
+
+
+def run_batch(argv):
+    """Generates texture sets for many themes without starting the GUI.
+
+    Usage: main.py batch themes.txt --per-theme 8 --out DIR
+
+    Args:
+    - argv (list): The command line arguments after "batch".
+
+    Returns:
+    - int: The exit code, 0 if every texture was generated.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="main.py batch",
+                                     description="Generate texture sets for every theme in a file without the GUI.")
+    parser.add_argument("themes", help='file with one theme per line, or "-" for standard input. '
+                                       'Add "| checkpoint" to a line to use another SD checkpoint for that theme')
+    parser.add_argument("--per-theme", type=int, default=TEXTURE_COUNT,
+                        help="number of textures for each theme (default: %(default)s)")
+    parser.add_argument("--out", default=config.folder_path,
+                        help="output folder, each theme gets a sub folder (default: %(default)s)")
+    parser.add_argument("--key", default=None,
+                        help="OpenAI key (default: the OPENAI_API_KEY environment variable)")
+    parser.add_argument("--gpt-workers", type=int, default=4,
+                        help="themes named by GPT at the same time (default: %(default)s)")
+    parser.add_argument("--sd-url", action="append", default=None,
+                        help="SD backend URL, repeat for several backends (default: SD_URLS or " + SD_URL + ")")
+    parser.add_argument("--sd-workers", type=int, default=None,
+                        help=f"images requested from SD at the same time (default: {SD_WORKERS} per backend)")
+    parser.add_argument("--progress-interval", type=float, default=SD_PROGRESS_INTERVAL,
+                        help="seconds between SD progress reports, 0 to turn them off (default: %(default)s)")
+    parser.add_argument("--variants", type=int, default=1,
+                        help="images made for each texture in one batched SD request, saved as TextureN_vK (default: %(default)s)")
+    parser.add_argument("--profile", choices=list(SD_PROFILES), default=SD_PROFILE,
+                        help='SD settings for every texture, "draft" saves quick TextureN_draft files '
+                             'to finish later with "main.py refine" (default: %(default)s)')
+    parser.add_argument("--min-score", type=float, nargs="?", const=TILE_MIN_SCORE, default=None,
+                        help=f"score how well each texture tiles (0 to 1) and generate it again with a new seed "
+                             f"when it scores below this, needs numpy and Pillow (default: off, {TILE_MIN_SCORE} if given without a value)")
+    parser.add_argument("--retries", type=int, default=TILE_RETRIES,
+                        help="times a texture below --min-score or caught by --dedup is generated again (default: %(default)s)")
+    parser.add_argument("--dedup", type=int, nargs="?", const=DEDUP_MAX_DISTANCE, default=None,
+                        help=f"generate a texture again with a new seed when its perceptual hash is within this many bits "
+                             f"(of 64) of a texture already in the output folder or run, needs numpy and Pillow "
+                             f"(default: off, {DEDUP_MAX_DISTANCE} if given without a value)")
+    parser.add_argument("--refine", action="store_true",
+                        help="with --profile draft, render every draft variant that reaches --min-score again at the final profile")
+    parser.add_argument("--pbr", action="store_true",
+                        help="save height, normal, roughness and AO maps next to each texture, needs numpy and Pillow")
+    parser.add_argument("--mips", choices=MIP_LAYOUTS, default=None,
+                        help='save the mip chain of each texture and map, "files" as TextureN_mipK.png or '
+                             '"dds" as one uncompressed TextureN.dds, needs numpy and Pillow (default: no mips)')
+    parser.add_argument("--mip-filter", choices=MIP_FILTERS, default=MIP_FILTER,
+                        help="filter the mip levels are made with (default: %(default)s)")
+    parser.add_argument("--compress", choices=COLOR_FORMATS, default=None,
+                        help="also export each texture block compressed with its mip chain as TextureN_<format>.dds, "
+                             "PBR maps use BC5 for normals and BC4 otherwise (default: no export)")
+    parser.add_argument("--container", choices=CONTAINERS, default="dds",
+                        help="file the exported textures are saved in (default: %(default)s)")
+    parser.add_argument("--atlas", action="store_true",
+                        help=f"pack each theme's textures and PBR maps into {ATLAS_NAME}.png with a {ATLAS_NAME}.json "
+                             "UV manifest, with mips and export like the textures, needs numpy and Pillow")
+    parser.add_argument("--array", action="store_true",
+                        help="save each theme's textures as one texture array in --container, "
+                             "in the --compress format or BC7")
+    parser.add_argument("--gutter", type=int, default=ATLAS_GUTTER,
+                        help="pixels of wrapped edge around each atlas tile (default: %(default)s)")
+    parser.add_argument("--job-timeout", type=float, default=None,
+                        help="seconds each image may take before it is stopped (default: no limit)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="seconds the whole run may take before every unfinished texture is stopped (default: no limit)")
+    parser.add_argument("--queue-size", type=int, default=SD_QUEUE_SIZE,
+                        help="named textures that may wait for SD (default: %(default)s)")
+    parser.add_argument("--checkpoint", default=SD_CHECKPOINT,
+                        help="SD checkpoint for themes that do not name one (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of each theme's first texture, so re-runs can be served from the cache (default: random)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always generate, never reuse cached textures")
+    parser.add_argument("--fresh-names", action="store_true",
+                        help="always ask GPT, never reuse texture names cached for a theme")
+    parser.add_argument("--cache-size-mb", type=int, default=TEXTURE_CACHE_MAX_BYTES // (1024 * 1024),
+                        help="largest size of the texture cache in the output folder (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    config.folder_path = args.out
+    config.texture_cache = not args.no_cache
+    config.texture_cache_max_bytes = args.cache_size_mb * 1024 * 1024
+    config.dedup = args.dedup is not None
+    if config.dedup:
+        config.dedup_max_distance = args.dedup
+    config.load()
+    if args.sd_url:
+        config.sd_urls = args.sd_url
+    if args.key:
+        openai.api_key = args.key
+    if not openai.api_key:
+        parser.error("no OpenAI key, set OPENAI_API_KEY or pass --key")
+    themes = read_themes(args.themes)
+    if not themes:
+        parser.error(f"no themes found in {args.themes}")
+    os.makedirs(args.out, exist_ok=True)
+    problem = preflight.run(args.out, config.sd_urls, openai.api_key)
+    if problem:
+        print(problem, file=sys.stderr)
+        return 2
+
+    # Give each theme its own folder so the Texture files do not overwrite each other
+    used = set()
+    gpt_generators = []
+    for theme, checkpoint in themes:
+        folder = os.path.join(args.out, theme_folder_name(theme, used))
+        os.makedirs(folder, exist_ok=True)
+        gpt_generators.append(GPTGenerator(theme, openai.api_key, count=args.per_theme, folder=folder,
+                                           seed=args.seed, fresh=args.fresh_names,
+                                           checkpoint=checkpoint or args.checkpoint, variants=args.variants,
+                                           profile=args.profile, min_score=args.min_score, retries=args.retries))
+
+    def refine(sd_generator, variant):
+        """Picks the draft variants that tile well enough, or all of them when nothing is scored."""
+        return not sd_generator.scores or sd_generator.scores[variant] >= args.min_score
+
+    def report(stage, theme_index, texture_index, value):
+        """Prints the progress of one texture."""
+        texture = "" if texture_index is None else f" Texture{texture_index}"
+        if stage == "progress":
+            eta = "" if value["eta"] is None else f", {value['eta']:.1f}s left"
+            value = f"step {value['step']}/{value['steps']}{eta}"
+        print(f"[{theme_index + 1}/{len(themes)}] {themes[theme_index][0]}{texture}: {stage} {value}", flush=True)
+
+    # The terminal cannot show the previews, so SD is asked to leave them out
+    pipeline = TexturePipeline(gpt_workers=args.gpt_workers, sd_workers=args.sd_workers,
+                               queue_size=args.queue_size, on_progress=report,
+                               progress_interval=args.progress_interval, previews=False,
+                               job_timeout=args.job_timeout, refine=refine if args.refine else None,
+                               pbr_maps=PBR_MAPS if args.pbr else (), mips=args.mips, mip_filter=args.mip_filter,
+                               compress=args.compress, container=args.container,
+                               atlas=args.atlas, array=args.array, gutter=args.gutter)
+    start = time.perf_counter()
+    try:
+        pipeline.run(gpt_generators, deadline=Deadline(args.timeout))
+    except KeyboardInterrupt:
+        # The run was cancelled and every status recorded
+        pass
+    except Exception:
+        # Every error was already reported as it happened
+        pass
+    elapsed = time.perf_counter() - start
+
+    # Print the throughput summary
+    statuses = pipeline.status_counts()
+    # Each refined draft is counted by the variants rendered again from it instead
+    variants = sum(1 for key in pipeline.statuses if len(key) == 3)
+    total = len(themes) * args.per_theme + variants - statuses.get("refined", 0)
+    done = statuses.get("done", 0)
+    print(f"Generated {done}/{total} textures for {len(themes)} themes in {elapsed:.1f}s, "
+          f"{statuses.get('rejected', 0)} not tiling, {statuses.get('duplicate', 0)} duplicates, {statuses.get('error', 0)} errors, {statuses.get('timeout', 0)} timed out, "
+          f"{statuses.get('cancelled', 0)} cancelled")
+    if done:
+        print(f"Throughput: {done / elapsed * 60:.1f} textures/min, {elapsed / done:.2f}s per texture")
+    print(f"Checkpoint swaps: {pipeline.swaps}")
+    for backend in get_backend_pool().stats():
+        print(f"SD backend {backend['url']}: {backend['started']} images, {backend['swaps']} swaps"
+              + ("" if backend["healthy"] else " (not answering)"))
+    cache = get_texture_cache()
+    if cache is not None:
+        print(f"Texture cache: {cache.hits} hits, {cache.misses} misses")
+    return 0 if done == total else 1
+
+
+def run_refine(argv):
+    """Renders draft textures again at full quality with the seed and prompt stored in each file.
+
+    Usage: main.py refine out/Wood/Texture0_draft.png out/Wood/Texture3_draft.png --profile hires
+
+    Args:
+    - argv (list): The command line arguments after "refine".
+
+    Returns:
+    - int: The exit code, 0 if every texture was rendered again.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="main.py refine",
+                                     description="Render picked draft textures again at full quality.")
+    parser.add_argument("files", nargs="+", help="draft PNG files, each is saved again without the _draft suffix")
+    parser.add_argument("--profile", choices=list(SD_PROFILES), default=SD_PROFILE,
+                        help="SD settings to render with (default: %(default)s)")
+    parser.add_argument("--sd-url", action="append", default=None,
+                        help="SD backend URL, repeat for several backends (default: SD_URLS or " + SD_URL + ")")
+    parser.add_argument("--checkpoint", default=SD_CHECKPOINT,
+                        help="SD checkpoint the drafts were made with (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    config.load()
+    if args.sd_url:
+        config.sd_urls = args.sd_url
+
+    # Read the prompt and seed SD stored in each draft
+    sd_generators = []
+    for path in args.files:
+        try:
+            with open(path, "rb") as f:
+                parameters = parse_parameters(read_png_text(f.read()) or "")
+            seed = int(parameters["Seed"])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"{path}: no SD parameters to refine from ({e})", file=sys.stderr)
+            return 2
+        # Texture0_draft.png becomes Texture0.png and Texture0_draft_v1.png becomes Texture0_v1.png
+        file_name = re.sub(re.escape(DRAFT_SUFFIX) + r"(?=(_v\d+)?$)", "",
+                           os.path.splitext(os.path.basename(path))[0])
+        sd_generators.append(SDImageGenerator(file_name, parameters["prompt"], folder=os.path.dirname(path),
+                                              seed=seed, checkpoint=args.checkpoint, profile=args.profile))
+
+    async def refine_all():
+        """Renders every draft at once, the backend slots decide how many SD works on."""
+        return await asyncio.gather(*(sd_generator.agenerate_image(previews=False)
+                                      for sd_generator in sd_generators), return_exceptions=True)
+
+    failed = 0
+    for path, result in zip(args.files, get_engine().run_sync(refine_all())):
+        if isinstance(result, BaseException):
+            failed += 1
+            print(f"{path}: {result}", file=sys.stderr)
+    print(f"Refined {len(args.files) - failed}/{len(args.files)} textures")
+    return 0 if not failed else 1
+
+
+def run_pbr(argv):
+    """Derives PBR maps for textures that are already saved, using every core.
+
+    Usage: main.py pbr out/Wood/*.png --maps normal roughness
+
+    Args:
+    - argv (list): The command line arguments after "pbr".
+
+    Returns:
+    - int: The exit code, 0 if the maps of every texture were saved.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="main.py pbr",
+                                     description="Save height, normal, roughness and AO maps next to textures.")
+    parser.add_argument("files", nargs="+", help="texture PNG files, e.g. Texture0.png saves Texture0_normal.png")
+    parser.add_argument("--maps", nargs="+", choices=PBR_MAPS, default=list(PBR_MAPS),
+                        help="maps to save (default: all)")
+    parser.add_argument("--mips", choices=MIP_LAYOUTS, default=None,
+                        help="also save the mip chain of each map, see main.py batch --help (default: no mips)")
+    parser.add_argument("--mip-filter", choices=MIP_FILTERS, default=MIP_FILTER,
+                        help="filter the mip levels are made with (default: %(default)s)")
+    args = parser.parse_args(argv)
+    # Skip maps from an earlier run that the shell pattern picked up
+    suffixes = tuple(f"_{name}.png" for name in PBR_MAPS)
+    files = [path for path in args.files if not path.endswith(suffixes) and not re.search(r"_mip\d+\.png$", path)]
+
+    async def derive_all():
+        """Derives the maps of every texture at once, one worker process per core."""
+        engine = get_engine()
+        return await asyncio.gather(*(engine.in_process(save_pbr_maps, path, None, tuple(args.maps),
+                                                        args.mips, args.mip_filter)
+                                      for path in files), return_exceptions=True)
+
+    failed = 0
+    for path, result in zip(files, get_engine().run_sync(derive_all())):
+        if isinstance(result, BaseException):
+            failed += 1
+            print(f"{path}: {result}", file=sys.stderr)
+    print(f"Saved PBR maps for {len(files) - failed}/{len(files)} textures")
+    return 0 if not failed else 1
+
+
+def run_mips(argv):
+    """Builds the mip chains of textures that are already saved, using every core.
+
+    Usage: main.py mips out/Wood/*.png --layout dds
+
+    Args:
+    - argv (list): The command line arguments after "mips".
+
+    Returns:
+    - int: The exit code, 0 if the mips of every texture were saved.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="main.py mips",
+                                     description="Save the full mip chain of textures with filters that keep them tiling.")
+    parser.add_argument("files", nargs="+", help="texture PNG files")
+    parser.add_argument("--layout", choices=MIP_LAYOUTS, default="files",
+                        help='"files" saves TextureN_mipK.png, "dds" one uncompressed TextureN.dds (default: %(default)s)')
+    parser.add_argument("--filter", choices=MIP_FILTERS, default=MIP_FILTER,
+                        help="filter the mip levels are made with (default: %(default)s)")
+    args = parser.parse_args(argv)
+    # Skip levels from an earlier run that the shell pattern picked up
+    files = [path for path in args.files if not re.search(r"_mip\d+\.png$", path)]
+
+    async def build_all():
+        """Builds the chains of every texture at once, one worker process per core."""
+        engine = get_engine()
+        return await asyncio.gather(*(engine.in_process(save_mips, path, None, args.layout, args.filter)
+                                      for path in files), return_exceptions=True)
+
+    failed = 0
+    for path, result in zip(files, get_engine().run_sync(build_all())):
+        if isinstance(result, BaseException):
+            failed += 1
+            print(f"{path}: {result}", file=sys.stderr)
+    print(f"Saved mips for {len(files) - failed}/{len(files)} textures")
+    return 0 if not failed else 1
+
+
+def run_export(argv):
+    """Exports saved textures and PBR maps block compressed with their mip chains, using every core.
+
+    Usage: main.py export out/Wood/*.png --format bc7 --container ktx2
+
+    Args:
+    - argv (list): The command line arguments after "export".
+
+    Returns:
+    - int: The exit code, 0 if every texture was exported.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="main.py export",
+                                     description="Export textures in GPU block compressed formats for game engines.")
+    parser.add_argument("files", nargs="+", help='PNG files, e.g. Texture0.png saves Texture0_bc7.dds. Files ending '
+                                                 'in _normal.png use BC5 and other PBR maps BC4')
+    parser.add_argument("--format", choices=COLOR_FORMATS, default="bc7",
+                        help="format of colour textures (default: %(default)s)")
+    parser.add_argument("--container", choices=CONTAINERS, default="dds",
+                        help="file the textures are saved in (default: %(default)s)")
+    parser.add_argument("--mip-filter", choices=MIP_FILTERS, default=MIP_FILTER,
+                        help="filter the mip levels are made with (default: %(default)s)")
+    args = parser.parse_args(argv)
+    # Mip levels saved as PNG are already in each texture's chain
+    files = [path for path in args.files if not re.search(r"_mip\d+\.png$", path)]
+
+    async def export_all():
+        """Exports every file at once, one worker process per core."""
+        engine = get_engine()
+        return await asyncio.gather(*(engine.in_process(export_file, path, args.format, args.container,
+                                                        args.mip_filter) for path in files),
+                                    return_exceptions=True)
+
+    failed = 0
+    for path, result in zip(files, get_engine().run_sync(export_all())):
+        if isinstance(result, BaseException):
+            failed += 1
+            print(f"{path}: {result}", file=sys.stderr)
+    print(f"Exported {len(files) - failed}/{len(files)} textures")
+    return 0 if not failed else 1
+
+
+def run_atlas(argv):
+    """Packs saved textures into one atlas per folder, with their PBR maps and a UV manifest.
+
+    Usage: main.py atlas out/Wood/Texture*.png --pbr --array --compress bc7
+
+    Args:
+    - argv (list): The command line arguments after "atlas".
+
+    Returns:
+    - int: The exit code, 0 if every atlas was saved.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="main.py atlas",
+                                     description="Pack texture sets into tiling-safe atlases and texture arrays.")
+    parser.add_argument("files", nargs="+", help=f"PNG textures of the same size, the ones in each folder are packed "
+                                                 f"into {ATLAS_NAME}.png and {ATLAS_NAME}.json in that folder")
+    parser.add_argument("--gutter", type=int, default=ATLAS_GUTTER,
+                        help="pixels of wrapped edge around each tile (default: %(default)s)")
+    parser.add_argument("--pbr", action="store_true",
+                        help=f"also pack the PBR maps saved next to each texture into {ATLAS_NAME}_<map>.png")
+    parser.add_argument("--mips", choices=MIP_LAYOUTS, default=None,
+                        help="save the mip chain of each atlas (default: no mips)")
+    parser.add_argument("--mip-filter", choices=MIP_FILTERS, default=MIP_FILTER,
+                        help="filter the mip levels are made with (default: %(default)s)")
+    parser.add_argument("--compress", choices=COLOR_FORMATS, default=None,
+                        help="also export each atlas block compressed with its mip chain (default: no export)")
+    parser.add_argument("--container", choices=CONTAINERS, default="dds",
+                        help="file exported atlases and texture arrays are saved in (default: %(default)s)")
+    parser.add_argument("--array", action="store_true",
+                        help="also save each folder's textures as one texture array, in the --compress format or BC7")
+    args = parser.parse_args(argv)
+    folders = {}
+    for path in args.files:
+        # Leave out the files made from textures, including earlier atlases
+        if is_texture_file(path):
+            folders.setdefault(os.path.dirname(path), []).append((os.path.splitext(os.path.basename(path))[0], path, None))
+    array_format = (args.compress or "bc7") if args.array else None
+    maps = PBR_MAPS if args.pbr else ()
+
+    async def pack_all():
+        """Packs every folder at once, one worker process per core."""
+        engine = get_engine()
+        return await asyncio.gather(*(engine.in_process(save_atlas, folder, tiles, maps, args.gutter, args.mips,
+                                                        args.mip_filter, args.compress, args.container, array_format)
+                                      for folder, tiles in folders.items()),
+                                    return_exceptions=True)
+
+    failed = 0
+    for (folder, tiles), result in zip(folders.items(), get_engine().run_sync(pack_all())):
+        if isinstance(result, BaseException):
+            failed += 1
+            print(f"{folder or '.'}: {result}", file=sys.stderr)
+        else:
+            print(f"{result[-1]}: {len(tiles)} textures")
+    print(f"Packed {len(folders) - failed}/{len(folders)} atlases")
+    return 0 if not failed else 1
 
-        # Return the list of generated texture names
-        return texture_names
 
 # Create the UI for user input
 if __name__ == "__main__":
     """Entry point of the program that launches the graphical user interface (GUI) application
     for generating texture names and images. It creates the main window, sets up the user interface
     components, and handles the generation of textures based on user input.
+
+    Run "main.py batch themes.txt" to generate textures for many themes without the GUI,
+    "main.py refine FILE..." to render picked drafts again at full quality,
+    "main.py pbr FILE..." to derive PBR maps, "main.py mips FILE..." to build
+    mip chains, "main.py export FILE..." to block compress saved textures and
+    "main.py atlas FILE..." to pack them into an atlas.
     """
+    # Run the headless batch mode without ever importing PyQt5
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(run_batch(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "refine":
+        sys.exit(run_refine(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "pbr":
+        sys.exit(run_pbr(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "mips":
+        sys.exit(run_mips(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        sys.exit(run_export(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "atlas":
+        sys.exit(run_atlas(sys.argv[2:]))
+
+    from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QFormLayout,
+                                 QLineEdit, QPushButton, QGroupBox, QFileDialog,
+                                 QMainWindow, QMessageBox, QVBoxLayout, QCheckBox)
+    from PyQt5.QtCore import QUrl, QObject, QRunnable, QThreadPool, pyqtSignal
+    from PyQt5.QtGui import QDesktopServices, QPixmap
+
+    class GenerationSignals(QObject):
+        """Signals sent from a GenerationWorker back to the UI thread.
+
+        Signals:
+        - progress(stage, theme_index, texture_index, value): Sent for each texture name, SD progress update, image and error.
+        - finished(results, cancelled): Sent with the texture names when the run ends.
+        - failed(message): Sent if the run stopped with an error.
+        """
+        progress = pyqtSignal(str, int, object, object)
+        finished = pyqtSignal(list, bool)
+        failed = pyqtSignal(str)
+
+    class GenerationWorker(QRunnable):
+        """Class that runs a TexturePipeline on a thread pool so the UI stays responsive.
+
+        Attributes:
+        - gpt_generators (list): The GPTGenerator for each theme.
+        - signals (GenerationSignals): The signals used to report back to the UI.
+        - pipeline (TexturePipeline): The pipeline doing the work.
+
+        Methods:
+        - run(): Runs the pipeline. Called by the thread pool.
+        - cancel(): Cancels the run.
+        """
+
+        def __init__(self, gpt_generators, pbr_maps=(), mips=None):
+            """Initializes the GenerationWorker object.
+
+            Args:
+            - gpt_generators (list): The GPTGenerator for each theme.
+            - pbr_maps (tuple): The PBR maps to save next to each texture.
+            - mips (str): The layout to save each texture's mip chain in, or None for no mips.
+            """
+            super().__init__()
+            self.gpt_generators = gpt_generators
+            self.signals = GenerationSignals()
+            # Progress is emitted from the pipeline threads and queued onto the UI thread
+            self.pipeline = TexturePipeline(on_progress=self.signals.progress.emit, pbr_maps=pbr_maps, mips=mips)
+
+        def run(self):
+            """Runs the pipeline. Called by the thread pool."""
+            try:
+                results = self.pipeline.run(self.gpt_generators)
+            except Exception as e:
+                self.signals.failed.emit(str(e))
+                return
+            self.signals.finished.emit(results, self.pipeline.cancelled)
+
+        def cancel(self):
+            """Cancels the run."""
+            self.pipeline.cancel()
+
+    # The worker running the current generation, None when idle
+    active_worker = None
+    # Lines shown in the status label for the current generation
+    status_lines = []
+
     def generate_textures():
         """Generates textures using the GPTGenerator class and saves the generated images."""
-        global key
-        print(key)
+        global active_worker
+        # Collapse repeated triggers (e.g. Enter in both fields) into the run already in flight
+        if active_worker is not None:
+            return
+        print(config.key)
         # Set the OpenAI API key if it is the default user key
-        if key == "USER_KEY":
+        if config.key == "USER_KEY":
             openai.api_key = key_edit.text()
             user_key_var = key_edit.text()
         else:
@@ -210,9 +4952,121 @@ if __name__ == "__main__":
         if test:
             user_input_var = promt_edit.text()
             user_key_var = key_edit.text()
-            gpt_generator = GPTGenerator(user_input_var, user_key_var)
-            texture_names = gpt_generator.generate_texture_names()
-            print(texture_names)
+            config.dedup = dedup_check.isChecked()
+            gpt_generator = GPTGenerator(user_input_var, user_key_var, fresh=fresh_check.isChecked())
+            # Run the generation on the thread pool and report back through signals
+            active_worker = GenerationWorker([gpt_generator], PBR_MAPS if pbr_check.isChecked() else (),
+                                             "dds" if mips_check.isChecked() else None)
+            active_worker.signals.progress.connect(show_progress)
+            active_worker.signals.finished.connect(generation_finished)
+            active_worker.signals.failed.connect(generation_failed)
+            set_running(True)
+            set_status("Generating texture names...")
+            QThreadPool.globalInstance().start(active_worker)
+
+    def cancel_generation():
+        """Cancels the generation in flight, interrupting SD."""
+        if active_worker is not None:
+            active_worker.cancel()
+            add_status("Cancelling...")
+
+    def set_running(running):
+        """Enables the buttons that fit whether a generation is running.
+
+        Args:
+        - running (bool): Whether a generation is running.
+        """
+        genarate_btn.setEnabled(not running)
+        cancel_btn.setEnabled(running)
+
+    def set_status(text):
+        """Replaces the status text.
+
+        Args:
+        - text (str): The new status text.
+        """
+        status_lines[:] = [text]
+        status_lable.setText(text)
+
+    def add_status(text):
+        """Adds a line to the status text.
+
+        Args:
+        - text (str): The line to add.
+        """
+        status_lines.append(text)
+        status_lable.setText("\n".join(status_lines))
+
+    def show_progress(stage, theme_index, texture_index, value):
+        """Shows the progress of one texture.
+
+        Args:
+        - stage (str): "name", "progress", "draft", "image", "rejected", "duplicate", "pbr", "mips", "export",
+          "atlas", "timeout", "cancelled" or "error".
+        - theme_index (int): The theme the texture belongs to.
+        - texture_index (int): The position of the texture, or None for errors naming a theme.
+        - value: The texture name, the dict from parse_progress() for SD progress, or the exception for errors.
+        """
+        if stage == "progress":
+            # Show the step and the preview in their own labels instead of adding a line each poll
+            eta = "" if value["eta"] is None else f", {value['eta']:.0f}s left"
+            progress_lable.setText(f"Texture{texture_index}: step {value['step']}/{value['steps']}{eta}")
+            if value["preview"]:
+                pixmap = QPixmap()
+                if pixmap.loadFromData(value["preview"]):
+                    preview_lable.setPixmap(pixmap.scaled(128, 128))
+            return
+        if stage == "name":
+            add_status(f"Texture{texture_index}: {value} - generating image...")
+        elif stage == "draft":
+            add_status(f"Texture{texture_index}: {value} - draft saved")
+        elif stage == "image":
+            add_status(f"Texture{texture_index}: {value} - saved")
+        elif stage == "rejected":
+            add_status(f"Texture{texture_index}: {value} - saved, but it does not tile well")
+        elif stage == "duplicate":
+            add_status(f"Texture{texture_index}: {value} - saved, but it looks like a texture you already have")
+        elif stage == "pbr":
+            add_status(f"Texture{texture_index}: {value} - PBR maps saved")
+        elif stage == "mips":
+            add_status(f"Texture{texture_index}: {value} - mipmaps saved")
+        elif stage == "export":
+            add_status(f"Texture{texture_index}: {value} - exported")
+        elif stage == "atlas":
+            add_status(f"Atlas saved to {value}")
+        elif stage == "timeout":
+            add_status("GPT timed out" if texture_index is None else f"Texture{texture_index}: {value} - timed out")
+        elif stage == "cancelled":
+            add_status(f"Texture{texture_index}: {value} - cancelled")
+        else:
+            add_status(f"Error: {value}")
+
+    def generation_finished(texture_names, cancelled):
+        """Resets the UI when a generation ends.
+
+        Args:
+        - texture_names (list): The texture names for each theme.
+        - cancelled (bool): Whether the generation was cancelled.
+        """
+        global active_worker
+        active_worker = None
+        set_running(False)
+        progress_lable.setText("")
+        add_status("Cancelled" if cancelled else "Done")
+        print(texture_names)
+
+    def generation_failed(message):
+        """Resets the UI and shows an error when a generation fails.
+
+        Args:
+        - message (str): The error message.
+        """
+        global active_worker
+        active_worker = None
+        set_running(False)
+        progress_lable.setText("")
+        add_status("Failed")
+        show_error_dialog(f"Texture generation failed.\n{message}")
 
     def issue_check():
         """Performs various checks to ensure the necessary requirements are met for image generation.
@@ -220,23 +5074,6 @@ if __name__ == "__main__":
         Returns:
         - boolean: True if all checks pass, False otherwise.
         """
-        # Declare global variables
-        global SD_URL
-        global folder_path
-
-        # Check if the folder path exists
-        if not QDir(folder_path).exists():
-            # Show an error dialog for the folder
-            show_error_dialog("The folder you selected dose not exsist. Try selecting a diffrent folder")
-            return False
-        # Check if the SD_URL is accessible
-        try:
-            response = requests.get(SD_URL)
-            response.raise_for_status()
-        except RequestException:
-            show_error_dialog("Faild to connect to SD. Make sure you have it running on your computor")
-            return False
-
         # Check if the input text can be encoded in Latin-1
         try:
             key_edit.text().encode('latin-1')
@@ -252,37 +5089,28 @@ if __name__ == "__main__":
             show_error_dialog("Your Open AI key contaned ivalid Characters. Make sure you enter a valid key click 'Get help' to learn how to get one")
             return False
 
-        # Check the API connection and authentication
-        try:
-            response = openai.Completion.create(
-                engine="text-davinci-003",
-                prompt="test",
-                temperature=0.6,
-                max_tokens=150)
-        except openai.error.APIError:
-            show_error_dialog("There was an error connecting to Open AI. Make sure you enter a valid key click 'Get help' to learn how to get one \n(APIError)")
-            return False
-        except openai.error.APIConnectionError:
-            show_error_dialog("There was an error connecting to Open AI. Make sure you enter a valid key click 'Get help' to learn how to get one \n(APIConnectionError)")
-            return False
-        except openai.error.RateLimitError:
-            show_error_dialog("There was an error connecting to Open AI. Make sure you enter a valid key click 'Get help' to learn how to get one \nYou are out of creditds you can get more from OpenAI\n(RateLimitError)")
-            return False
-        except openai.error.AuthenticationError:
-            show_error_dialog("There was an error connecting to Open AI. Make sure you enter a valid key click 'Get help' to learn how to get one \n(AuthenticationError)")
+        # Check the folder, the SD connection and the OpenAI key at the same time,
+        # checks that passed in the last minute are not run again
+        problem = preflight.run(config.folder_path, config.sd_urls, openai.api_key)
+        if problem:
+            show_error_dialog(problem)
             return False
         return True
 
+    def warm_preflight():
+        """Runs the preflight checks in the background once a key has been entered."""
+        api_key = key_edit.text() if config.key == "USER_KEY" else openai.api_key
+        preflight.revalidate(config.folder_path, config.sd_urls, api_key)
+
     def browse_folder():
         """Opens a file dialog to browse and select an output folder for saving generated images."""
-        global folder_path
         # Open a file dialog to select a folder
         folder_dialog = QFileDialog()
         select_folder_path = folder_dialog.getExistingDirectory(window,
                                                                 'Select a folder')
         # Update the folder path if a folder is selected
         if select_folder_path != '':
-            folder_path = select_folder_path
+            config.folder_path = select_folder_path
         print('Selected Folder:', select_folder_path)
 
     def open_help_url():
@@ -312,6 +5140,11 @@ if __name__ == "__main__":
         msg_box.setStandardButtons(QMessageBox.Ok)
         msg_box.exec_()
 
+    # Create the output folder and resolve the OpenAI key
+    config.load()
+    # Warm the preflight checks so the first click does not wait for them
+    preflight.revalidate(config.folder_path, config.sd_urls, openai.api_key)
+
     # Initialize the application
     app = QApplication(sys.argv)
 
@@ -362,6 +5195,12 @@ if __name__ == "__main__":
     # Connect the browse_folder function when the browse button is clicked
     browse_btn.clicked.connect(browse_folder)
 
+    # Create a check box for asking GPT for new names instead of reusing names from earlier runs
+    fresh_check = QCheckBox('Fresh texture names (do not reuse names from earlier runs of this theme)')
+    pbr_check = QCheckBox('Also save height, normal, roughness and AO maps')
+    mips_check = QCheckBox('Also save mipmaps (one .dds file per texture)')
+    dedup_check = QCheckBox('Generate again textures that look like ones already in the folder')
+
     # Create a button for generating textures
     genarate_btn = QPushButton('Generate textures')
 
@@ -372,6 +5211,21 @@ if __name__ == "__main__":
     promt_edit.returnPressed.connect(generate_textures)
     key_edit.returnPressed.connect(generate_textures)
 
+    # Check the key in the background as soon as it has been entered
+    key_edit.editingFinished.connect(warm_preflight)
+
+    # Create a button for cancelling a generation, only enabled while one is running
+    cancel_btn = QPushButton('Cancel')
+    cancel_btn.setEnabled(False)
+    cancel_btn.clicked.connect(cancel_generation)
+
+    # Create a label that shows the progress of each texture
+    status_lable = QLabel('')
+
+    # Create labels that show the step and a preview of the image SD is working on
+    progress_lable = QLabel('')
+    preview_lable = QLabel('')
+
     help_btn = QPushButton('Get help')
     help_btn.clicked.connect(open_help_url)
 
@@ -383,7 +5237,15 @@ if __name__ == "__main__":
     form_layout1.addRow(browse_lable)
     form_layout1.addRow(browse_btn)
     form_layout1.addRow(help_btn)
+    form_layout1.addRow(fresh_check)
+    form_layout1.addRow(pbr_check)
+    form_layout1.addRow(mips_check)
+    form_layout1.addRow(dedup_check)
     form_layout1.addRow(genarate_btn)
+    form_layout1.addRow(cancel_btn)
+    form_layout1.addRow(status_lable)
+    form_layout1.addRow(progress_lable)
+    form_layout1.addRow(preview_lable)
 
     # Add the group box to the main layout
     layout.addRow(group_box1)
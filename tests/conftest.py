@@ -0,0 +1,6 @@
+"""Shared setup for the tests: main.py lives in the folder above this one."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,107 @@
+"""Tests that atlas tiles keep to their gutters down the atlas's mip chain."""
+
+import json
+import os
+
+import pytest
+
+import main
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+COLOURS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)]
+
+
+def solid_tiles(size=128):
+    """Returns one solid colour tile per colour, so any bleed from a neighbour shows."""
+    return [np.full((size, size, 3), colour, dtype=np.uint8) for colour in COLOURS]
+
+
+def textured_tiles(size=128):
+    """Returns tiles of smooth noise, which show a box filter's blocks shifting against the tile."""
+    tiles = []
+    for seed in range(len(COLOURS)):
+        noise = main.wrap_blur(np.random.default_rng(seed).uniform(0, 255, (size, size, 3)), 4)
+        tiles.append(((noise - noise.min()) / (noise.max() - noise.min()) * 255).round().astype(np.uint8))
+    return tiles
+
+
+def bleed(levels, rects, tiles, mip_filter, level):
+    """Returns the largest difference between each tile in an atlas level and the same level of its own chain."""
+    scale = 2 ** level
+    worst = 0
+    for (left, top, width, height), tile in zip(rects, tiles):
+        own = main.mip_chain(tile, mip_filter)[level].astype(int)
+        packed = levels[level][top // scale:(top + height) // scale, left // scale:(left + width) // scale]
+        worst = max(worst, int(np.abs(packed.astype(int) - own).max()))
+    return worst
+
+
+@pytest.mark.parametrize("mip_filter", main.MIP_FILTERS)
+@pytest.mark.parametrize("gutter", [4, 8, 16, 32])
+def test_max_mip_level_is_the_last_clean_level(mip_filter, gutter):
+    max_level = main.atlas_max_mip_level(gutter, mip_filter)
+    worst = [0] * (max_level + 2)
+    for tiles in (solid_tiles(), textured_tiles()):
+        atlas, rects = main.build_atlas(tiles, gutter)
+        levels = main.mip_chain(atlas, mip_filter, max_level=max_level + 1)
+        for level in range(1, max_level + 2):
+            worst[level] = max(worst[level], bleed(levels, rects, tiles, mip_filter, level))
+    assert max(worst[:max_level + 1]) <= 1
+    # The next level would bleed
+    assert worst[max_level + 1] > 1
+
+
+def test_atlas_mip_chain_stops_at_max_mip_level(tmp_path):
+    tiles = []
+    for index, pixels in enumerate(solid_tiles(64)):
+        path = str(tmp_path / f"Texture{index}.png")
+        tiles.append((f"Texture{index}", path, main.png_bytes(pixels)))
+    paths = main.save_atlas(str(tmp_path), tiles, gutter=8, mip_layout="files", mip_filter="kaiser",
+                            block_format="bc7")
+    with open(str(tmp_path / "atlas.json")) as f:
+        manifest = json.load(f)
+    assert manifest["max_mip_level"] == main.atlas_max_mip_level(8, "kaiser") == 1
+    assert str(tmp_path / "atlas_mip1.png") in paths
+    assert not os.path.exists(str(tmp_path / "atlas_mip2.png"))
+    with open(str(tmp_path / "atlas_bc7.dds"), "rb") as f:
+        # The DDS header's mip count
+        assert int.from_bytes(f.read()[28:32], "little") == 2
+
+
+def saved_tiles(folder, size=32):
+    """Saves the solid tiles in folder and returns them as save_atlas() takes them."""
+    tiles = []
+    for index, pixels in enumerate(solid_tiles(size)):
+        path = os.path.join(folder, f"Texture{index}.png")
+        main.save_png(path, main.png_bytes(pixels))
+        tiles.append((f"Texture{index}", path, None))
+    return tiles
+
+
+def test_array_only_saves_no_atlas(tmp_path):
+    tiles = saved_tiles(str(tmp_path))
+    paths = main.save_atlas(str(tmp_path), tiles, mip_layout="files", block_format="bc1",
+                            array_format="bc7", atlas=False)
+    assert paths == [str(tmp_path / "array_bc7.dds"), str(tmp_path / "array.json")]
+    assert sorted(os.listdir(str(tmp_path))) == sorted(["array_bc7.dds", "array.json"]
+                                                       + [f"Texture{index}.png" for index in range(len(tiles))])
+    with open(paths[-1]) as f:
+        manifest = json.load(f)
+    assert manifest == {"arrays": {"color": "array_bc7.dds"},
+                        "tiles": [{"name": name, "file": os.path.basename(path), "layer": index}
+                                  for index, (name, path, _) in enumerate(tiles)]}
+    assert main.save_atlas(str(tmp_path), tiles, atlas=False) == []
+
+
+def test_atlas_with_array_lists_both(tmp_path):
+    tiles = saved_tiles(str(tmp_path))
+    paths = main.save_atlas(str(tmp_path), tiles, array_format="bc7")
+    assert paths[-1] == str(tmp_path / "atlas.json")
+    with open(paths[-1]) as f:
+        manifest = json.load(f)
+    assert manifest["files"] == {"color": "atlas.png"}
+    assert manifest["arrays"] == {"color": "array_bc7.dds"}
+    assert [tile["layer"] for tile in manifest["tiles"]] == list(range(len(tiles)))
+    assert all(set(tile) == {"name", "file", "layer", "rect", "uv"} for tile in manifest["tiles"])
@@ -0,0 +1,137 @@
+"""Tests that the block compressed exports decode close to their image and have valid DDS and KTX2 headers."""
+
+import io
+import struct
+
+import pytest
+
+import main
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+# Channels each format keeps
+CHANNELS = {"bc1": 3, "bc3": 4, "bc4": 1, "bc5": 2, "bc7": 4}
+
+# Highest root mean square error each format may decode with, in 8 bit levels. The colour
+# formats fit one line of colours per block, so the uncorrelated channels of the test
+# image cost them more than the single channel formats
+MAX_ERRORS = {"bc1": 16, "bc3": 16, "bc4": 4, "bc5": 4, "bc7": 16}
+
+
+def smooth_image(size=64, channels=4, seed=0):
+    """Returns smooth noise that wraps round the edges, in 8 bit levels."""
+    noise = main.wrap_blur(np.random.default_rng(seed).uniform(0, 255, (size, size, channels)), 4)
+    return ((noise - noise.min()) / (noise.max() - noise.min()) * 255).round().astype(np.uint8)
+
+
+def decode(data, channels):
+    """Decodes the first level of a DDS file with Pillow, keeping the first channels."""
+    decoded = np.asarray(Image.open(io.BytesIO(data))).astype(np.float64)
+    if decoded.ndim == 2:
+        decoded = decoded[..., None]
+    return decoded[..., :channels]
+
+
+def rms_error(decoded, pixels):
+    return float(np.sqrt(((decoded - pixels) ** 2).mean()))
+
+
+# Pillow reads the linear formats, it does not know the sRGB BC1 and BC3 ones
+@pytest.mark.parametrize("block_format", list(main.BLOCK_FORMATS))
+def test_dds_decodes_close_to_the_image(block_format):
+    pixels = smooth_image(channels=CHANNELS[block_format])
+    data = main.dds_block_bytes(64, 64, [[main.encode_blocks(pixels, block_format)]], block_format, False)
+    assert rms_error(decode(data, CHANNELS[block_format]), pixels) < MAX_ERRORS[block_format]
+
+
+@pytest.mark.parametrize("block_format", list(main.BLOCK_FORMATS))
+def test_solid_colour_is_kept(block_format):
+    pixels = np.empty((8, 8, 4), dtype=np.uint8)
+    pixels[:] = (200, 120, 40, 255)
+    pixels = pixels[..., :CHANNELS[block_format]]
+    data = main.dds_block_bytes(8, 8, [[main.encode_blocks(pixels, block_format)]], block_format, False)
+    # BC1 and BC3 store the endpoints in 5 and 6 bits
+    assert np.abs(decode(data, pixels.shape[-1]) - pixels).max() <= 4
+
+
+def test_opaque_images_stay_opaque():
+    pixels = smooth_image(channels=3)
+    for block_format in ("bc3", "bc7"):
+        data = main.dds_block_bytes(64, 64, [[main.encode_blocks(pixels, block_format)]], block_format, False)
+        assert decode(data, 4)[..., 3].min() == 255
+
+
+def test_bc7_is_sharper_than_bc1():
+    pixels = smooth_image(channels=3)
+    errors = {}
+    for block_format in ("bc1", "bc7"):
+        data = main.dds_block_bytes(64, 64, [[main.encode_blocks(pixels, block_format)]], block_format, False)
+        errors[block_format] = rms_error(decode(data, 3), pixels)
+    assert errors["bc7"] < errors["bc1"]
+
+
+def test_block_sizes():
+    pixels = smooth_image(16, 4)
+    for block_format, info in main.BLOCK_FORMATS.items():
+        assert len(main.encode_blocks(pixels, block_format)) == 16 * info["block"]
+    with pytest.raises(ValueError):
+        main.encode_blocks(pixels, "bc6")
+
+
+def encoded_layers(layer_count, block_format="bc7", size=32):
+    """Returns the mip chain of layer_count images and their encoded levels."""
+    layers = [main.mip_chain(smooth_image(size, 4, seed)) for seed in range(layer_count)]
+    return layers, [[main.encode_blocks(level, block_format) for level in levels] for levels in layers]
+
+
+@pytest.mark.parametrize("layer_count", [1, 3])
+@pytest.mark.parametrize("srgb", [False, True])
+def test_dds_header(layer_count, srgb):
+    layers, encoded = encoded_layers(layer_count)
+    data = main.dds_block_bytes(32, 32, encoded, "bc7", srgb)
+    magic, size, flags, height, width, linear_size, depth, level_count = struct.unpack_from("<4sIIIIIII", data)
+    assert (magic, size, height, width, level_count) == (b"DDS ", 124, 32, 32, 6)
+    assert linear_size == len(encoded[0][0])
+    assert struct.unpack_from("<4s", data, 84)[0] == b"DX10"
+    dxgi_format, dimension, _, array_size, _ = struct.unpack_from("<IIIII", data, 128)
+    assert dxgi_format == main.BLOCK_FORMATS["bc7"]["dxgi"][srgb]
+    assert (dimension, array_size) == (3, layer_count)
+    # Each layer follows the one before it with all its levels
+    assert data[148:] == b"".join(b"".join(levels) for levels in encoded)
+
+
+@pytest.mark.parametrize("layer_count", [1, 3])
+@pytest.mark.parametrize("srgb", [False, True])
+def test_ktx2_header(layer_count, srgb):
+    layers, encoded = encoded_layers(layer_count)
+    data = main.ktx2_bytes(32, 32, encoded, "bc7", srgb)
+    assert data[:12] == b"\xabKTX 20\xbb\r\n\x1a\n"
+    (vk_format, type_size, width, height, depth, array_size, faces, level_count,
+     supercompression) = struct.unpack_from("<IIIIIIIII", data, 12)
+    assert vk_format == main.BLOCK_FORMATS["bc7"]["vk"][srgb]
+    assert (type_size, width, height, depth, faces, level_count, supercompression) == (1, 32, 32, 0, 1, 6, 0)
+    # A texture that is not an array has a layer count of 0
+    assert array_size == (layer_count if layer_count > 1 else 0)
+    dfd_offset, dfd_length = struct.unpack_from("<II", data, 48)
+    assert struct.unpack_from("<I", data, dfd_offset)[0] == dfd_length
+    model, primaries, transfer = struct.unpack_from("<BBB", data, dfd_offset + 12)
+    assert (model, primaries, transfer) == (main.BLOCK_FORMATS["bc7"]["model"], 1, 2 if srgb else 1)
+    for index in range(level_count):
+        start, length, uncompressed = struct.unpack_from("<QQQ", data, 80 + 24 * index)
+        assert length == uncompressed
+        assert start % main.BLOCK_FORMATS["bc7"]["block"] == 0
+        # Each level holds that level of every layer
+        assert data[start:start + length] == b"".join(levels[index] for levels in encoded)
+
+
+def test_save_compressed(tmp_path):
+    pixels = smooth_image(32, 3)
+    path = str(tmp_path / "Texture0.png")
+    for container in main.CONTAINERS:
+        out_path = main.save_compressed(path, [main.mip_chain(pixels)], "bc1", container, srgb=False)
+        assert out_path == str(tmp_path / f"Texture0_bc1.{container}")
+    with open(str(tmp_path / "Texture0_bc1.dds"), "rb") as file:
+        assert rms_error(decode(file.read(), 3), pixels) < MAX_ERRORS["bc1"]
+    with pytest.raises(ValueError):
+        main.save_compressed(path, [main.mip_chain(pixels)], "bc1", "png")
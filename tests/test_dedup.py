@@ -0,0 +1,109 @@
+"""Tests for the perceptual hash and the HashIndex that finds near-duplicate textures with it."""
+
+import os
+
+import pytest
+
+import main
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+
+def texture(seed, size=256):
+    """Returns a smooth texture that wraps round the edges, in 8 bit levels."""
+    noise = main.wrap_blur(np.random.default_rng(seed).uniform(0, 255, (size, size, 3)), 8)
+    return ((noise - noise.min()) / (noise.max() - noise.min()) * 255).round().astype(np.uint8)
+
+
+def distance(a, b):
+    return bin(main.perceptual_hash(a) ^ main.perceptual_hash(b)).count("1")
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_shifted_copy_is_a_duplicate(seed):
+    image = texture(seed)
+    assert distance(image, np.roll(image, 3, axis=(0, 1))) <= main.DEDUP_MAX_DISTANCE
+
+
+def test_noise_and_brightness_keep_the_hash_close():
+    image = texture(0)
+    noisy = np.clip(image + np.random.default_rng(1).normal(0, 8, image.shape), 0, 255).astype(np.uint8)
+    brighter = np.clip(image.astype(np.int16) + 20, 0, 255).astype(np.uint8)
+    assert distance(image, noisy) <= main.DEDUP_MAX_DISTANCE
+    assert distance(image, brighter) <= main.DEDUP_MAX_DISTANCE
+
+
+def test_unrelated_textures_are_far_apart():
+    image = texture(0)
+    for seed in range(1, 6):
+        assert distance(image, texture(seed)) > main.DEDUP_MAX_DISTANCE
+
+
+def test_grey_and_small_images_hash():
+    image = texture(0, 16)
+    assert 0 <= main.perceptual_hash(image[..., 0]) < 2 ** 64
+    assert main.perceptual_hash(image[..., :1]) == main.perceptual_hash(image[..., 0])
+
+
+@pytest.fixture
+def index(tmp_path):
+    """An empty HashIndex of the tmp_path folder, already scanned."""
+    hash_index = main.HashIndex(str(tmp_path / ".cache" / "hashes.sqlite"), str(tmp_path))
+    hash_index.scan()
+    return hash_index
+
+
+def test_nearest_matches_a_brute_force_search(index, tmp_path):
+    rng = np.random.default_rng(0)
+    # More than the 64 rows the array starts with
+    hashes = {str(tmp_path / f"Texture{i}.png"): int(rng.integers(0, 2 ** 63)) for i in range(150)}
+    for path, image_hash in hashes.items():
+        index.add(path, image_hash)
+    for _ in range(20):
+        query = int(rng.integers(0, 2 ** 63))
+        distances = {path: bin(image_hash ^ query).count("1") for path, image_hash in hashes.items()}
+        path, found = index.nearest(query)
+        assert found == min(distances.values()) == distances[path]
+
+
+def test_nearest_leaves_out_excluded_textures(index, tmp_path):
+    assert index.nearest(0) is None
+    first, second = str(tmp_path / "a.png"), str(tmp_path / "b.png")
+    index.add(first, 0)
+    index.add(second, 0b111)
+    assert index.nearest(0) == (first, 0)
+    assert index.nearest(0, exclude=[first]) == (second, 3)
+    assert index.nearest(0, exclude=[first, second]) is None
+
+
+def test_check_finds_duplicates_and_indexes_the_new_texture(index, tmp_path):
+    original, copy, other = (str(tmp_path / name) for name in ("a.png", "b.png", "c.png"))
+    hash_a = main.perceptual_hash(texture(0))
+    assert index.check(original, hash_a) is None
+    assert index.check(copy, main.perceptual_hash(np.roll(texture(0), 3, axis=(0, 1)))) == original
+    # A texture's own variants are not duplicates of it
+    assert index.check(other, hash_a, exclude=[original, copy]) is None
+    index.remove(original)
+    index.remove(copy)
+    assert index.nearest(hash_a) == (other, 0)
+
+
+def test_index_persists_and_follows_the_folder(tmp_path, monkeypatch):
+    db_path = str(tmp_path / ".cache" / "hashes.sqlite")
+    paths = []
+    for seed in range(3):
+        path = str(tmp_path / "Castle" / f"Texture{seed}.png")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.fromarray(texture(seed, 64)).save(path)
+        paths.append(path)
+    first = main.HashIndex(db_path, str(tmp_path))
+    assert first.nearest(main.perceptual_hash(texture(1, 64))) == (paths[1], 0)
+    # A new index reads the hashes back without hashing the files again, and forgets the deleted file
+    os.remove(paths[1])
+    image_hash = main.perceptual_hash(texture(2, 64))
+    monkeypatch.setattr(main, "perceptual_hash", None)
+    second = main.HashIndex(db_path, str(tmp_path))
+    second.scan()
+    assert sorted(second._paths) == [paths[0], paths[2]]
+    assert second.nearest(image_hash) == (paths[2], 0)
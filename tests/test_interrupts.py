@@ -0,0 +1,66 @@
+"""Tests that interrupts sent for abandoned jobs reach SD before the engine closes."""
+
+import http.server
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import main
+
+
+class SlowInterruptHandler(http.server.BaseHTTPRequestHandler):
+    """Answers /sdapi/v1/interrupt after a delay, like a busy SD, and counts the requests."""
+
+    received = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(0.3)
+        self.received.append(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+
+@pytest.fixture
+def sd_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SlowInterruptHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    SlowInterruptHandler.received = []
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_close_waits_for_interrupts(sd_url):
+    engine = main.AsyncEngine()
+
+    async def abandon_jobs():
+        sd_client = engine.sd_client(main.SDClient(sd_url))
+        for _ in range(4):
+            sd_client.interrupt_soon()
+
+    engine.run_sync(abandon_jobs())
+    engine.close()
+    assert SlowInterruptHandler.received == ["/sdapi/v1/interrupt"] * 4
+
+
+def test_flush_gives_up_after_timeout(sd_url):
+    engine = main.AsyncEngine()
+
+    async def abandon_job():
+        sd_client = engine.sd_client(main.SDClient(sd_url))
+        sd_client.interrupt_soon()
+        return await sd_client.flush_interrupts(timeout=0.01)
+
+    try:
+        assert engine.run_sync(abandon_job()) == 1
+    finally:
+        engine.close()
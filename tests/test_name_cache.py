@@ -0,0 +1,66 @@
+"""Tests for the expiry, eviction and keys of the SQLite NameCache."""
+
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake time.time() that only moves when the test moves it."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return main.NameCache(str(tmp_path / "names.sqlite"), ttl=60, max_entries=2)
+
+
+def test_key_ignores_case_and_spacing():
+    assert main.NameCache.key("  Medieval   Castle ") == main.NameCache.key("medieval castle")
+    assert main.NameCache.key("Castle") != main.NameCache.key("Castles")
+    assert main.NameCache.key("Castle").startswith(main.GPT_ENGINE + ":")
+
+
+def test_get_returns_the_first_count_names(cache):
+    cache.put("Castle", ["Stone", "Oak", "Iron"])
+    assert cache.get("castle", 2) == ["Stone", "Oak"]
+    assert cache.get(" CASTLE ", 3) == ["Stone", "Oak", "Iron"]
+    # Fewer names than asked for is a miss
+    assert cache.get("Castle", 4) is None
+    assert cache.get("Forest", 1) is None
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.put("Castle", ["Stone"])
+    clock[0] += 59
+    assert cache.get("Castle", 1) == ["Stone"]
+    # Using an entry does not extend its life
+    clock[0] += 2
+    assert cache.get("Castle", 1) is None
+
+
+def test_least_recently_used_theme_is_evicted(cache, clock):
+    cache.put("Castle", ["Stone"])
+    clock[0] += 1
+    cache.put("Forest", ["Moss"])
+    clock[0] += 1
+    # Using Castle leaves Forest the least recently used
+    assert cache.get("Castle", 1) == ["Stone"]
+    clock[0] += 1
+    cache.put("Desert", ["Sand"])
+    assert cache.get("Forest", 1) is None
+    assert cache.get("Castle", 1) == ["Stone"]
+    assert cache.get("Desert", 1) == ["Sand"]
+
+
+def test_entries_persist_and_clear(cache, tmp_path):
+    cache.put("Castle", ["Stone"])
+    reopened = main.NameCache(str(tmp_path / "names.sqlite"), ttl=60, max_entries=2)
+    assert reopened.get("Castle", 1) == ["Stone"]
+    reopened.clear()
+    assert cache.get("Castle", 1) is None
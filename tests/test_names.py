@@ -0,0 +1,73 @@
+"""Tests for parsing GPT's texture names and for filling the slots a batched reply left empty."""
+
+import asyncio
+
+import pytest
+
+import main
+
+
+def scripted_generator(replies, **kwargs):
+    """Returns a GPTGenerator whose GPT replies are taken from a list, recording each prompt."""
+    gpt_generator = main.GPTGenerator("Castle", "key", **kwargs)
+    gpt_generator.prompts = []
+    replies = list(replies)
+
+    async def aask_gpt(text, max_tokens=150, deadline=None):
+        gpt_generator.prompts.append(text)
+        return replies.pop(0)
+
+    gpt_generator.aask_gpt = aask_gpt
+    return gpt_generator
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('["Stone", "Oak wood", "Iron"]', ["Stone", "Oak wood", "Iron"]),
+    ('Sure! Here you go: ["Stone", "Iron"] Enjoy.', ["Stone", "Iron"]),
+    ("1. Stone\n2. Oak wood.\n3) Iron", ["Stone", "Oak wood", "Iron"]),
+    ("- Stone\n* Iron\n• Moss", ["Stone", "Iron", "Moss"]),
+    ("Stone, Iron, Moss", ["Stone", "Iron", "Moss"]),
+    ('["Stone", "stone", " STONE. ", "Iron"]', ["Stone", "Iron"]),
+    ('["Stone", 3, null, ""]', ["Stone"]),
+    ('["Stone", "This castle is mostly built from very large grey stones"]', ["Stone"]),
+    ("", []),
+])
+def test_parse_texture_names(text, expected):
+    assert main.parse_texture_names(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("\n\n1. Rusty metal.", "Rusty metal"),
+    ('"Granite"', "Granite"),
+    ("Moss;", "Moss"),
+    ("The castle walls are built from large blocks of grey granite stone", ""),
+    ("Stone\nIron", ""),
+    ("  ", ""),
+])
+def test_clean_texture_name(text, expected):
+    assert main.clean_texture_name(text) == expected
+
+
+def test_slot_skips_sentences_and_repeats():
+    gpt_generator = scripted_generator(["The castle is made of many different kinds of stone",
+                                        "stone.", "Slate"])
+    assert asyncio.run(gpt_generator.aask_texture_name(["Stone", "Iron"])) == "Slate"
+    assert len(gpt_generator.prompts) == 3
+
+
+def test_slot_gives_up():
+    gpt_generator = scripted_generator(["Stone"] * (main.NAME_RETRIES + 1))
+    assert asyncio.run(gpt_generator.aask_texture_name(["Stone"])) is None
+    assert len(gpt_generator.prompts) == main.NAME_RETRIES + 1
+
+
+def test_short_list_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.config, "name_cache_path", str(tmp_path / "names.sqlite3"))
+    # The batch only has two names and GPT keeps repeating one of them for the third slot
+    gpt_generator = scripted_generator(['["Stone", "Iron"]'] + ["iron"] * (main.NAME_RETRIES + 1), count=3)
+    assert gpt_generator.texture_names() == ["Stone", "Iron"]
+    assert main.get_name_cache().get("Castle", 2) is None
+
+    gpt_generator = scripted_generator(['["Stone", "Iron"]', "Iron", "Moss"], count=3)
+    assert gpt_generator.texture_names() == ["Stone", "Iron", "Moss"]
+    assert main.get_name_cache().get("Castle", 3) == ["Stone", "Iron", "Moss"]
@@ -0,0 +1,65 @@
+"""Tests that the PBR maps derived from a texture are valid and tile like it."""
+
+import os
+
+import pytest
+
+import main
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+
+def albedo(seed=0, size=64):
+    """Returns a smooth albedo that wraps round the edges."""
+    noise = main.wrap_blur(np.random.default_rng(seed).uniform(0, 255, (size, size, 3)), 2)
+    return ((noise - noise.min()) / (noise.max() - noise.min()) * 255).round().astype(np.uint8)
+
+
+def test_maps_are_grey_or_rgb():
+    maps = main.derive_pbr_maps(albedo())
+    assert set(maps) == set(main.PBR_MAPS)
+    for name, pixels in maps.items():
+        assert pixels.dtype == np.uint8
+        assert pixels.shape == ((64, 64, 3) if name == "normal" else (64, 64))
+
+
+def test_maps_tile_like_the_texture():
+    pixels = albedo()
+    maps = main.derive_pbr_maps(pixels)
+    rolled = main.derive_pbr_maps(np.roll(pixels, (5, 17), axis=(0, 1)))
+    for name in main.PBR_MAPS:
+        # Rounding to 8 bits may tip a value the other way
+        difference = np.abs(rolled[name].astype(int) - np.roll(maps[name], (5, 17), axis=(0, 1)).astype(int))
+        assert difference.max() <= 1, name
+
+
+def test_normals_are_unit_length_and_face_out():
+    normal = main.derive_pbr_maps(albedo())["normal"]
+    vectors = normal.astype(np.float64) / 255 * 2 - 1
+    assert np.abs(np.linalg.norm(vectors, axis=-1) - 1).max() < 0.02
+    assert normal[..., 2].min() > 128
+
+
+def test_flat_albedo_gives_flat_maps():
+    maps = main.derive_pbr_maps(np.full((32, 32, 3), 120, dtype=np.uint8))
+    # A flat normal is 127.5 in X and Y, which rounds either way
+    assert np.isin(maps["normal"][..., :2], (127, 128)).all()
+    assert (maps["normal"][..., 2] == 255).all()
+    assert (maps["ao"] == 255).all()
+    assert maps["height"].max() - maps["height"].min() <= 1
+    assert maps["roughness"].max() - maps["roughness"].min() <= 1
+
+
+def test_save_pbr_maps_writes_each_map(tmp_path):
+    path = str(tmp_path / "Texture0.png")
+    main.save_png(path, main.png_bytes(albedo()))
+    paths = main.save_pbr_maps(path)
+    assert paths == [str(tmp_path / f"Texture0_{name}.png") for name in main.PBR_MAPS]
+    derived = main.derive_pbr_maps(albedo())
+    for name, map_path in zip(main.PBR_MAPS, paths):
+        assert np.array_equal(main.read_map(map_path, name), derived[name])
+    # Only the maps asked for, each with its export
+    paths = main.save_pbr_maps(path, maps=("normal",), container="dds")
+    assert paths == [str(tmp_path / "Texture0_normal.png"), str(tmp_path / "Texture0_normal_bc5.dds")]
+    assert os.path.exists(paths[1])
@@ -0,0 +1,68 @@
+"""Tests for the statuses TexturePipeline keeps for drafts and the variants refined from them."""
+
+import asyncio
+import os
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def fake_sd(monkeypatch, tmp_path):
+    """Replaces GPT and SD with instant fakes, refined variants wait until released."""
+    monkeypatch.setattr(main.config, "texture_cache", False)
+    monkeypatch.setattr(main.config, "dedup", False)
+    monkeypatch.setattr(main.config, "sd_urls", ["http://127.0.0.1:9"])
+    rendered = []
+
+    async def aask_gpt(self, text, max_tokens=150, deadline=None):
+        return "\n".join(f"{i + 1}. Stone {i}" for i in range(self.count))
+
+    async def agenerate_image(self, can_swap=None, deadline=None, on_progress=None,
+                              progress_interval=0, previews=True):
+        if self.profile != "draft":
+            # Give cancel_texture() time to reach the variant while it runs
+            await asyncio.sleep(0.2)
+        rendered.append(self.file_name)
+        self.paths = [os.path.join(str(tmp_path), f"{self.file_name}_v{k}.png") for k in range(self.variants)]
+        self.images = [b""] * self.variants
+        self.seeds = list(range(self.variants))
+
+    monkeypatch.setattr(main.GPTGenerator, "aask_gpt", aask_gpt)
+    monkeypatch.setattr(main.SDImageGenerator, "agenerate_image", agenerate_image)
+    return rendered
+
+
+def run_pipeline(tmp_path, refine, cancel=None):
+    """Runs one theme of one texture with two draft variants, cancel(pipeline) is called on the first refined image."""
+    gpt_generator = main.GPTGenerator("Castle", "key", count=1, folder=str(tmp_path), variants=2,
+                                      profile="draft", fresh=True)
+    pipeline = main.TexturePipeline(refine=refine, progress_interval=0)
+
+    def on_progress(stage, theme_index, texture_index, value):
+        if stage == "draft" and cancel is not None:
+            pipeline._loop.call_later(0.05, cancel, pipeline)
+
+    pipeline.on_progress = on_progress
+    pipeline.run([gpt_generator])
+    return pipeline
+
+
+def test_refined_variants_get_their_own_status(fake_sd, tmp_path):
+    pipeline = run_pipeline(tmp_path, refine=lambda sd_generator, variant: True)
+    assert pipeline.statuses == {(0, 0): "refined", (0, 0, 0): "done", (0, 0, 1): "done"}
+    assert sorted(fake_sd) == ["Texture0_draft", "Texture0_v0", "Texture0_v1"]
+
+
+def test_cancel_texture_stops_one_variant(fake_sd, tmp_path):
+    pipeline = run_pipeline(tmp_path, refine=lambda sd_generator, variant: True,
+                            cancel=lambda pipeline: pipeline.cancel_texture(0, 0, 1))
+    assert pipeline.statuses == {(0, 0): "refined", (0, 0, 0): "done", (0, 0, 1): "cancelled"}
+    assert "Texture0_v1" not in fake_sd
+
+
+def test_cancel_texture_stops_every_variant(fake_sd, tmp_path):
+    pipeline = run_pipeline(tmp_path, refine=lambda sd_generator, variant: True,
+                            cancel=lambda pipeline: pipeline.cancel_texture(0, 0))
+    assert pipeline.statuses == {(0, 0): "refined", (0, 0, 0): "cancelled", (0, 0, 1): "cancelled"}
@@ -0,0 +1,90 @@
+"""Tests for the PNG chunk helpers that store SD's parameters without re-encoding the pixels."""
+
+import io
+import zlib
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+PngImagePlugin = pytest.importorskip("PIL.PngImagePlugin")
+
+import main
+
+
+def make_png(text=None):
+    """Returns a small PNG made by Pillow, optionally with a "parameters" tEXt chunk."""
+    info = None
+    if text is not None:
+        info = PngImagePlugin.PngInfo()
+        info.add_text("parameters", text)
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 3), (10, 20, 30)).save(buffer, "PNG", pnginfo=info)
+    return buffer.getvalue()
+
+
+def image_data(data):
+    """Returns the IDAT chunks of a PNG file, which hold the compressed pixels."""
+    return [body for chunk_type, body, _, _ in main.iter_png_chunks(data) if chunk_type == b"IDAT"]
+
+
+def test_chunks_cover_the_whole_file():
+    data = make_png("Steps: 20")
+    chunks = list(main.iter_png_chunks(data))
+    assert chunks[0][0] == b"IHDR"
+    assert chunks[-1][0] == b"IEND"
+    # The chunks follow each other with no gaps
+    assert chunks[0][2] == len(main.PNG_SIGNATURE)
+    assert all(a[3] == b[2] for a, b in zip(chunks, chunks[1:]))
+    assert chunks[-1][3] == len(data)
+
+
+def test_not_a_png():
+    with pytest.raises(ValueError):
+        list(main.iter_png_chunks(b"GIF89a"))
+
+
+def test_text_round_trip():
+    data = main.png_with_text(make_png(), "parameters", "PBR, Wood\nSteps: 20, Seed: 13")
+    assert main.read_png_text(data) == "PBR, Wood\nSteps: 20, Seed: 13"
+    # Pillow still reads the file and sees the same text
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        assert image.size == (4, 3)
+        assert image.getpixel((0, 0)) == (10, 20, 30)
+        assert image.text["parameters"] == "PBR, Wood\nSteps: 20, Seed: 13"
+
+
+def test_text_replaces_the_old_copy():
+    data = main.png_with_text(make_png("old"), "parameters", "new")
+    assert main.read_png_text(data) == "new"
+    texts = [body for chunk_type, body, _, _ in main.iter_png_chunks(data) if chunk_type == b"tEXt"]
+    assert texts == [b"parameters\0new"]
+
+
+def test_other_keys_are_kept():
+    data = main.png_with_text(make_png("Steps: 20"), main.TILE_SCORE_KEY, "0.875")
+    assert main.read_png_text(data) == "Steps: 20"
+    assert main.read_png_text(data, main.TILE_SCORE_KEY) == "0.875"
+
+
+def test_unicode_text_uses_itxt():
+    data = main.png_with_text(make_png(), "parameters", "Ziegel – 木")
+    assert b"iTXt" in data
+    assert main.read_png_text(data) == "Ziegel – 木"
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.text["parameters"] == "Ziegel – 木"
+
+
+def test_pixels_are_not_recompressed():
+    original = make_png()
+    data = main.png_with_text(original, "parameters", "x")
+    assert image_data(data) == image_data(original)
+
+
+def test_ztxt_is_read():
+    chunk = main.png_chunk(b"zTXt", b"parameters\0\0" + zlib.compress(b"Steps: 30"))
+    original = make_png()
+    # Put the chunk before IEND, the last 12 bytes
+    data = original[:-12] + chunk + original[-12:]
+    assert main.read_png_text(data) == "Steps: 30"
+    assert main.read_png_text(data, "missing") is None
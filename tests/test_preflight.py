@@ -0,0 +1,109 @@
+"""Tests that Preflight caches passed checks, never failed ones, and runs its checks at the same time."""
+
+import threading
+import time
+import types
+
+import pytest
+
+import main
+
+
+class FakeProbes:
+    """Stands in for the SD backend pool and the OpenAI model lookup, counting each probe."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sd_up = True
+        self.key_works = True
+        self.calls = {"sd": 0, "openai": 0}
+        self.lock = threading.Lock()
+
+    def probe_all(self):
+        with self.lock:
+            self.calls["sd"] += 1
+        time.sleep(self.delay)
+        return 1 if self.sd_up else 0
+
+    def retrieve(self, engine, api_key=None, request_timeout=None):
+        with self.lock:
+            self.calls["openai"] += 1
+        time.sleep(self.delay)
+        if not self.key_works:
+            raise AuthenticationError("bad key")
+
+
+class OpenAIError(Exception):
+    pass
+
+
+class AuthenticationError(OpenAIError):
+    pass
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    fake = FakeProbes()
+    error = types.SimpleNamespace(OpenAIError=OpenAIError, AuthenticationError=AuthenticationError,
+                                  InvalidRequestError=type("InvalidRequestError", (OpenAIError,), {}),
+                                  RateLimitError=type("RateLimitError", (OpenAIError,), {}),
+                                  APIConnectionError=type("APIConnectionError", (OpenAIError,), {}),
+                                  Timeout=type("Timeout", (OpenAIError,), {}))
+    monkeypatch.setattr(main, "openai", types.SimpleNamespace(Model=types.SimpleNamespace(retrieve=fake.retrieve),
+                                                              error=error))
+    monkeypatch.setattr(main, "get_backend_pool", lambda urls=None: fake)
+    return fake
+
+
+URLS = ["http://127.0.0.1:7860"]
+
+
+def test_passed_checks_are_reused_within_ttl(probes, tmp_path):
+    preflight = main.Preflight(ttl=0.3)
+    assert preflight.run(str(tmp_path), URLS, "key") is None
+    assert preflight.run(str(tmp_path), URLS, "key") is None
+    assert probes.calls == {"sd": 1, "openai": 1}
+    # Another key is checked on its own
+    assert preflight.check_openai("other key") is None
+    assert probes.calls["openai"] == 2
+    # Once the ttl has passed, the checks probe again
+    time.sleep(0.35)
+    assert preflight.run(str(tmp_path), URLS, "key") is None
+    assert probes.calls == {"sd": 2, "openai": 3}
+
+
+def test_failed_checks_are_not_cached(probes, tmp_path):
+    preflight = main.Preflight(ttl=60)
+    probes.sd_up = False
+    probes.key_works = False
+    assert preflight.check_sd(URLS) is not None
+    assert preflight.check_openai("key").endswith("(AuthenticationError)")
+    # Fixing the problem and trying again works at once
+    probes.sd_up = True
+    probes.key_works = True
+    assert preflight.run(str(tmp_path), URLS, "key") is None
+    assert probes.calls == {"sd": 2, "openai": 2}
+
+
+def test_problems_come_in_order(probes, tmp_path):
+    preflight = main.Preflight(ttl=60)
+    probes.sd_up = False
+    assert "folder" in preflight.run(str(tmp_path / "missing"), URLS, "key")
+    assert "SD" in preflight.run(str(tmp_path), URLS, "key")
+    probes.sd_up = True
+    assert preflight.run(str(tmp_path), URLS, "").startswith(main.OPENAI_PROBLEM)
+
+
+def test_checks_run_at_the_same_time(probes, tmp_path):
+    probes.delay = 0.3
+    start = time.monotonic()
+    assert main.Preflight(ttl=60).run(str(tmp_path), URLS, "key") is None
+    assert time.monotonic() - start < 0.5
+
+
+def test_revalidate_warms_the_cache(probes, tmp_path):
+    preflight = main.Preflight(ttl=60)
+    preflight.revalidate(str(tmp_path), URLS, "key").join(5)
+    assert probes.calls == {"sd": 1, "openai": 1}
+    assert preflight.run(str(tmp_path), URLS, "key") is None
+    assert probes.calls == {"sd": 1, "openai": 1}
@@ -0,0 +1,96 @@
+"""Tests for spreading SD jobs over backends by checkpoint, with simulated backends instead of SD."""
+
+import asyncio
+import itertools
+
+import pytest
+
+import main
+
+# Each simulation gets backends of its own, since SD clients are shared by URL
+_urls = itertools.count()
+
+
+def simulate(checkpoints, backends=2, queue_size=None, loaded="Base"):
+    """Runs one SD job per checkpoint through a CheckpointQueue and a BackendPool.
+
+    Each consumer takes a job, acquires a backend like SDImageGenerator does and switches the
+    backend's checkpoint like SDClient.ensure_checkpoint() does, counting each switch.
+
+    Args:
+    - checkpoints (list): The checkpoint of each job, in the order they are put.
+    - backends (int): The number of backends.
+    - queue_size (int): The number of jobs that may wait, all of them if None.
+    - loaded (str): The checkpoint every backend starts with, unknown to the pool until a job asks.
+
+    Returns:
+    - tuple: (swaps, started) with the switches on every backend and the jobs each one ran.
+    """
+    pool = main.BackendPool([f"http://backend{next(_urls)}.invalid" for _ in range(backends)])
+    real = {backend.client: loaded for backend in pool.backends}
+
+    async def run():
+        jobs = main.CheckpointQueue(queue_size or len(checkpoints), pool)
+
+        async def produce():
+            for checkpoint in checkpoints:
+                await jobs.put(checkpoint, checkpoint)
+            await jobs.close()
+
+        async def consume():
+            while True:
+                checkpoint = await jobs.get()
+                if checkpoint is None:
+                    return
+                backend = pool.acquire(checkpoint, jobs.can_swap, probe=False)
+                client = backend.client
+                # Let the other consumers pick before this job has looked at the backend
+                await asyncio.sleep(0)
+                if client.active_checkpoint is None:
+                    client.active_checkpoint = real[client]
+                if not main.same_checkpoint(client.active_checkpoint, checkpoint):
+                    client.active_checkpoint = real[client] = checkpoint
+                    client.swaps += 1
+                    await asyncio.sleep(0.02)
+                await asyncio.sleep(0.005)
+                pool.release(backend)
+
+        await asyncio.gather(produce(), *(consume() for _ in range(backends * main.SD_WORKERS)))
+
+    asyncio.run(run())
+    return pool.swaps(), [backend.started for backend in pool.backends]
+
+
+@pytest.mark.parametrize("queue_size", [None, main.SD_QUEUE_SIZE])
+def test_two_checkpoints_get_a_backend_each(queue_size):
+    swaps, started = simulate(["A", "B"] * 12, queue_size=queue_size)
+    assert swaps == 2
+    assert started == [12, 12]
+
+
+def test_one_checkpoint_uses_every_backend():
+    swaps, started = simulate(["A"] * 12, queue_size=main.SD_QUEUE_SIZE)
+    assert swaps == 2
+    assert started == [6, 6]
+
+
+def test_loaded_checkpoint_is_not_switched():
+    swaps, started = simulate(["A"] * 6, loaded="A")
+    assert swaps == 0
+    assert sum(started) == 6
+
+
+def test_idle_backend_waits_for_recent_checkpoint():
+    pool = main.BackendPool([f"http://backend{next(_urls)}.invalid"])
+
+    async def run():
+        jobs = main.CheckpointQueue(3, pool)
+        await jobs.put("job", "A")
+        assert await jobs.get() == "job"
+        # Nothing for A is queued, but it was just put, so more are likely on the way
+        assert not jobs.can_swap("A")
+        assert jobs.can_swap("B")
+        await jobs.close()
+        assert jobs.can_swap("A")
+
+    asyncio.run(run())
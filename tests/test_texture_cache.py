@@ -0,0 +1,77 @@
+"""Tests for the LRU order, eviction and counters of the on-disk TextureCache."""
+
+import os
+
+import main
+
+
+def put_aged(cache, key, data, age):
+    """Stores an entry and dates its file age seconds back, so the order on disk is certain."""
+    cache.put(key, data)
+    stamp = 1_000_000_000 - age
+    os.utime(os.path.join(cache.path, f"{key}.png"), (stamp, stamp))
+
+
+def test_key_ignores_payload_order_and_formatting():
+    first = main.TextureCache.key({"prompt": "Stone", "steps": 20, "cfg_scale": 7.0}, "model [abc]")
+    second = main.TextureCache.key({"cfg_scale": 7, "steps": 20, "prompt": " Stone "}, "model [abc]")
+    assert first == second
+    assert first != main.TextureCache.key({"prompt": "Stone", "steps": 20, "cfg_scale": 7}, "other [def]")
+    assert first != main.TextureCache.key({"prompt": "Stone", "steps": 21, "cfg_scale": 7}, "model [abc]")
+
+
+def test_put_evicts_the_oldest_entry(tmp_path):
+    cache = main.TextureCache(str(tmp_path), max_bytes=250)
+    cache.put("a", b"a" * 100)
+    cache.put("b", b"b" * 100)
+    cache.put("c", b"c" * 100)
+    assert cache.get("a") is None
+    assert not (tmp_path / "a.png").exists()
+    assert cache.get("b") == b"b" * 100
+    assert cache.get("c") == b"c" * 100
+    # Only whole files, no temporary ones, are left behind
+    assert sorted(os.listdir(str(tmp_path))) == ["b.png", "c.png"]
+
+
+def test_put_replaces_an_entry_in_place(tmp_path):
+    cache = main.TextureCache(str(tmp_path), max_bytes=250)
+    cache.put("a", b"a" * 100)
+    cache.put("a", b"A" * 150)
+    cache.put("b", b"b" * 100)
+    # The replaced entry counts once, at its new size
+    assert cache.get("a") == b"A" * 150
+    assert cache.get("b") == b"b" * 100
+
+
+def test_get_refreshes_recency_across_restarts(tmp_path):
+    cache = main.TextureCache(str(tmp_path), max_bytes=250)
+    put_aged(cache, "a", b"a" * 100, 30)
+    put_aged(cache, "b", b"b" * 100, 20)
+    # Using "a" makes "b" the least recently used, on disk too
+    assert cache.get("a") == b"a" * 100
+    reopened = main.TextureCache(str(tmp_path), max_bytes=250)
+    reopened.put("c", b"c" * 100)
+    assert not (tmp_path / "b.png").exists()
+    assert reopened.get("a") == b"a" * 100
+    assert reopened.get("b") is None
+
+
+def test_rebuilt_order_follows_file_times(tmp_path):
+    cache = main.TextureCache(str(tmp_path), max_bytes=1000)
+    put_aged(cache, "new", b"n" * 100, 10)
+    put_aged(cache, "old", b"o" * 100, 30)
+    put_aged(cache, "mid", b"m" * 100, 20)
+    reopened = main.TextureCache(str(tmp_path), max_bytes=250)
+    reopened.put("d", b"d" * 100)
+    assert sorted(os.listdir(str(tmp_path))) == ["d.png", "new.png"]
+
+
+def test_hits_and_misses(tmp_path):
+    cache = main.TextureCache(str(tmp_path))
+    cache.put("a", b"a" * 10)
+    assert cache.get("a") == b"a" * 10
+    assert cache.get("missing") is None
+    # A file deleted behind the cache's back is a miss, not an error
+    os.remove(str(tmp_path / "a.png"))
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,66 @@
+"""Tests that tile_scores() tells textures that tile from ones with a seam."""
+
+import pytest
+
+import main
+
+np = pytest.importorskip("numpy")
+
+
+def smooth_noise(seed=0, size=64):
+    """Returns noise blurred with wrapping, so it is smooth and repeats every size pixels."""
+    noise = np.random.default_rng(seed).uniform(0, 255, (size, size, 3))
+    return main.wrap_blur(noise, 2)
+
+
+def to_levels(array):
+    """Stretches an array to the 8 bit levels."""
+    return ((array - array.min()) / (array.max() - array.min()) * 255).round().astype(np.uint8)
+
+
+def periodic_image(seed=0):
+    """Returns a 64 pixel image that tiles."""
+    return to_levels(smooth_noise(seed))
+
+
+def cropped_image(seed=0):
+    """Returns a 64 pixel crop of a larger tiling image, so its edges do not meet."""
+    return to_levels(smooth_noise(seed, 96)[:64, :64])
+
+
+def test_periodic_image_tiles():
+    assert main.tile_scores(periodic_image()) > main.TILE_MIN_SCORE
+
+
+def test_gradient_does_not_tile():
+    ramp = np.linspace(0, 255, 64, dtype=np.float32)
+    gradient = np.repeat(np.repeat(ramp[None, :, None], 64, axis=0), 3, axis=2).astype(np.uint8)
+    assert main.tile_scores(gradient) < main.TILE_MIN_SCORE
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_seam_lowers_the_score(seed):
+    assert main.tile_scores(cropped_image(seed)) < main.tile_scores(periodic_image(seed))
+
+
+def test_step_does_not_tile():
+    # Brightening the bottom rows makes a step where the last row meets the first
+    stepped = periodic_image().astype(np.int16)
+    stepped[48:] += 60
+    assert main.tile_scores(np.clip(stepped, 0, 255).astype(np.uint8)) < main.TILE_MIN_SCORE
+
+
+def test_stack_is_scored_like_each_image():
+    images = [periodic_image(seed) for seed in range(3)]
+    scores = main.tile_scores(np.stack(images))
+    assert scores.shape == (3,)
+    for image, score in zip(images, scores):
+        assert score == pytest.approx(main.tile_scores(image), abs=1e-6)
+
+
+def test_score_ignores_alpha_and_accepts_grey():
+    image = periodic_image()
+    grey = image[..., :1]
+    alpha = np.dstack([image, np.full(image.shape[:2], 255, np.uint8)])
+    assert main.tile_scores(alpha) == pytest.approx(main.tile_scores(image), abs=1e-6)
+    assert main.tile_scores(grey) > main.TILE_MIN_SCORE